@@ -0,0 +1,4 @@
+from .sdk import ConfigError, GameClient, backoff_delay
+from .spool import ResultSpool
+
+__all__ = ["ConfigError", "GameClient", "ResultSpool", "backoff_delay"]
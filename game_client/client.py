@@ -1,45 +1,44 @@
-
 import argparse
 import asyncio
-import json
+import logging
 import random
-import websockets
-import requests
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from game_client.sdk import GameClient
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--server", default="http://127.0.0.1:8000")
     ap.add_argument("--game_id", required=True)
     ap.add_argument("--api_key", required=False, default=None)
+    ap.add_argument("--spool", default="game_results_spool.db", help="SQLite file for undelivered results")
     args = ap.parse_args()
-
-    ws_url = args.server.replace("http", "ws") + f"/ws/game/{args.game_id}"
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
     async def run():
-        async with websockets.connect(ws_url) as ws:
-            print(f"Connected to {ws_url}")
-            while True:
-                msg = await ws.recv()
-                data = json.loads(msg)
+        async with GameClient(args.server, args.game_id, args.api_key, spool_path=args.spool) as client:
+            async for data in client.events():
                 print("Event:", data)
                 if data.get("type") == "session_started":
                     session_id = data["session_id"]
                     # Simulate game runtime
                     await asyncio.sleep(3)
-                    # Post end-of-session metrics
-                    url = args.server + "/sessions/end"
+                    # Post end-of-session metrics (spooled if the server is unreachable)
                     players = []
-                    for pid in [1, 2]:
+                    for p in data.get("players") or [{"player_id": 1}, {"player_id": 2}]:
                         players.append({
-                            "player_id": pid,
+                            "player_id": p["player_id"],
                             "score": random.randint(0, 100),
                             "play_time_sec": random.randint(30, 300),
                             "metrics": {"shots": random.randint(1, 50)}
                         })
-                    payload = {"session_id": session_id, "game_metrics": {"note": "simulated"}, "players": players}
-                    headers = {"X-API-Key": args.api_key} if args.api_key else {}
-                    r = requests.post(url, json=payload, headers=headers)
-                    print("End session resp:", r.status_code, r.text)
+                    delivered = await client.end_session(session_id, players, {"note": "simulated"})
+                    print("End session:", "delivered" if delivered else f"spooled ({len(client.spool)} pending)")
 
     asyncio.run(run())
 
@@ -0,0 +1,209 @@
+"""
+Async SDK for game servers talking to the kiosk server.
+
+- One pooled httpx.AsyncClient per GameClient (keep-alive connections are reused).
+- events() yields hub messages and transparently reconnects with jittered
+  exponential backoff; server pings are answered automatically. Reconnects
+  resume with ?since=<seq> so missed events (e.g. session_started) are
+  replayed; if the server can't, a {"type": "resync"} event is yielded.
+- end_session() writes results to a local spool first and replays the spool
+  oldest-first whenever the server is reachable. A result the server
+  answers with 429 or 5xx is retried later with its own backoff, without
+  holding up the ones behind it. 401/403 means the API key is wrong: it
+  raises ConfigError and nothing is dropped.
+"""
+import asyncio
+import json
+import logging
+import random
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+import websockets
+
+from .spool import ResultSpool
+
+logger = logging.getLogger("game_client")
+
+
+class ConfigError(Exception):
+    """The server rejected the game's credentials (401/403); fix the API key or GAME_KEYS."""
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class GameClient:
+    def __init__(
+        self,
+        server: str,
+        game_id: str,
+        api_key: Optional[str] = None,
+        spool_path: str = "game_results_spool.db",
+        max_connections: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        flush_interval: float = 5.0,
+    ):
+        self.server = server.rstrip("/")
+        self.game_id = game_id
+        self.api_key = api_key
+        self.spool = ResultSpool(spool_path)
+        self.max_connections = max_connections
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.flush_interval = flush_interval
+        self._http: Optional[httpx.AsyncClient] = None
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.epoch: Optional[str] = None
+        self.last_seq = 0
+
+    @property
+    def ws_url(self) -> str:
+        url = self.server.replace("http", "ws", 1) + f"/ws/game/{self.game_id}?pong=1"
+        if self.epoch:
+            url += f"&since={self.last_seq}&epoch={self.epoch}"
+        return url
+
+    async def __aenter__(self) -> "GameClient":
+        headers = {"X-API-Key": self.api_key} if self.api_key else {}
+        self._http = httpx.AsyncClient(
+            base_url=self.server,
+            headers=headers,
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+        )
+        self._flusher = asyncio.create_task(self._flush_loop())
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush()
+        except ConfigError as e:
+            logger.error("%s", e)
+        finally:
+            await self._http.aclose()
+            self.spool.close()
+
+    async def events(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield hub events forever, reconnecting whenever the socket drops."""
+        attempt = 0
+        while True:
+            try:
+                async with websockets.connect(self.ws_url) as ws:
+                    logger.info("Connected to %s", self.ws_url)
+                    attempt = 0
+                    async for raw in ws:
+                        data = json.loads(raw)
+                        kind = data.get("type")
+                        if kind == "ping":
+                            await ws.send(json.dumps({"type": "pong"}))
+                            continue
+                        if kind == "hello":
+                            if self.epoch is None:
+                                self.last_seq = max(self.last_seq, data["seq"])
+                            self.epoch = data["epoch"]
+                            continue
+                        if kind == "resync":
+                            self.last_seq = data["seq"]
+                        elif "seq" in data:
+                            if data["seq"] <= self.last_seq:
+                                continue
+                            self.last_seq = data["seq"]
+                        yield data
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                logger.warning("WebSocket dropped (%s)", e)
+            delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+            attempt += 1
+            logger.info("Reconnecting in %.2fs", delay)
+            await asyncio.sleep(delay)
+
+    async def game_ready(self, kiosk_id: str) -> Dict[str, Any]:
+        r = await self._http.post("/games/ready", params={"game_id": self.game_id, "kiosk_id": kiosk_id})
+        r.raise_for_status()
+        return r.json()
+
+    async def end_session(
+        self,
+        session_id: int,
+        players: List[Dict[str, Any]],
+        game_metrics: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """
+        Spool the result, then try to deliver everything pending.
+        Returns True if this result (and all older ones) reached the server.
+        Raises ConfigError if the server rejects the API key.
+        """
+        payload = {"session_id": session_id, "game_metrics": game_metrics or {}, "players": players}
+        self.spool.append(payload)
+        await self.flush()
+        return len(self.spool) == 0
+
+    async def flush(self) -> int:
+        """
+        Replay due spooled results oldest-first. Returns the number delivered.
+        Stops at the first transient failure (unreachable, 429, 5xx) and
+        defers that result; raises ConfigError on 401/403 (it stays spooled).
+        """
+        delivered = 0
+        async with self._flush_lock:
+            while True:
+                batch = self.spool.pending()
+                if not batch:
+                    return delivered
+                for spool_id, payload in batch:
+                    attempts = self.spool.mark_attempt(spool_id)
+                    try:
+                        r = await self._http.post("/sessions/end", json=payload)
+                    except httpx.TransportError as e:
+                        logger.warning("Server unreachable, %d result(s) spooled (%s)", len(self.spool), e)
+                        return delivered
+                    if r.status_code == 200:
+                        self.spool.ack(spool_id)
+                        delivered += 1
+                    elif r.status_code in (400, 404, 422):
+                        # Permanently rejected (e.g. session already ended by an admin reset,
+                        # or a replay of a result the server did receive). Retrying can't help.
+                        logger.warning("Dropping spooled result for session %s: %s %s",
+                                       payload.get("session_id"), r.status_code, r.text)
+                        self.spool.ack(spool_id)
+                    elif r.status_code in (401, 403):
+                        raise ConfigError(
+                            f"Server rejected game {self.game_id!r} with {r.status_code}; check the API key. "
+                            f"{len(self.spool)} result(s) stay spooled."
+                        )
+                    else:
+                        delay = max(self.backoff_base, backoff_delay(attempts, self.backoff_base, self.backoff_max))
+                        if r.status_code == 429:
+                            delay = max(delay, _retry_after(r))
+                        self.spool.defer(spool_id, delay)
+                        logger.warning("Server returned %s for session %s, retrying it in %.1fs",
+                                       r.status_code, payload.get("session_id"), delay)
+                        # End the pass, so a failing server gets one request per pass
+                        # rather than a retry loop; later entries are tried next pass.
+                        return delivered
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if len(self.spool):
+                try:
+                    await self.flush()
+                except ConfigError as e:
+                    logger.error("%s", e)
+
+
+def _retry_after(r: httpx.Response) -> float:
+    try:
+        return float(r.headers.get("Retry-After", 0))
+    except ValueError:
+        return 0.0
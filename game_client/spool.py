@@ -0,0 +1,62 @@
+"""
+Durable on-disk spool for session results.
+
+Results are appended before any network call and only removed once the
+server has acknowledged them, so a crash or an outage never loses a game.
+"""
+import json
+import sqlite3
+import time
+from typing import Any, Dict, List, Tuple
+
+
+class ResultSpool:
+    def __init__(self, path: str = "game_results_spool.db"):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " payload TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        if "next_attempt_at" not in columns:  # spool files from before per-entry backoff
+            self._conn.execute("ALTER TABLE results ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0")
+
+    def append(self, payload: Dict[str, Any]) -> int:
+        cur = self._conn.execute(
+            "INSERT INTO results (payload, created_at) VALUES (?, ?)",
+            (json.dumps(payload), time.time()),
+        )
+        return cur.lastrowid
+
+    def pending(self, limit: int = 100) -> List[Tuple[int, Dict[str, Any]]]:
+        """Oldest-first list of (spool_id, payload) that are due for a (re)try."""
+        rows = self._conn.execute(
+            "SELECT id, payload FROM results WHERE next_attempt_at <= ? ORDER BY id ASC LIMIT ?",
+            (time.time(), limit),
+        ).fetchall()
+        return [(rid, json.loads(payload)) for rid, payload in rows]
+
+    def mark_attempt(self, spool_id: int) -> int:
+        """Count an attempt; returns the attempts so far."""
+        self._conn.execute("UPDATE results SET attempts = attempts + 1 WHERE id = ?", (spool_id,))
+        row = self._conn.execute("SELECT attempts FROM results WHERE id = ?", (spool_id,)).fetchone()
+        return row[0] if row else 0
+
+    def defer(self, spool_id: int, delay: float):
+        """Skip this result in pending() for `delay` seconds; later results are still tried."""
+        self._conn.execute("UPDATE results SET next_attempt_at = ? WHERE id = ?", (time.time() + delay, spool_id))
+
+    def ack(self, spool_id: int):
+        self._conn.execute("DELETE FROM results WHERE id = ?", (spool_id,))
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
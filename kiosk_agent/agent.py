@@ -0,0 +1,285 @@
+"""
+Kiosk agent: bridges a serial RFID reader to the kiosk browser page.
+
+- Reads UID lines from /dev/ttyUSB* (any tty works, including a pty in tests).
+- Drops repeat reads of the same UID inside debounce_window_sec.
+- Fans each scan out to browser clients on ws://127.0.0.1:8765; kiosk.js then
+  calls /rfid/scan as usual.
+- If no browser is connected or the server is unreachable, scans are appended
+  to a local JSONL spool and later delivered via POST /rfid/scan/bulk. Batches
+  the server rejects (400/422) move to dead_letter_path so later scans still go.
+
+Run: python agent.py [--config config.yaml]
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import termios
+import time
+import tty
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+import websockets
+import yaml
+
+logger = logging.getLogger("kiosk_agent")
+
+MAX_BULK_BATCH = 500  # RFIDBulkScanIn.scans max_length on the server
+
+BAUD_RATES = {
+    1200: termios.B1200,
+    2400: termios.B2400,
+    4800: termios.B4800,
+    9600: termios.B9600,
+    19200: termios.B19200,
+    38400: termios.B38400,
+    57600: termios.B57600,
+    115200: termios.B115200,
+}
+
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "serial": {"port": "/dev/ttyUSB*", "baud": 9600, "reconnect_delay_sec": 2.0},
+    "debounce_window_sec": 2.0,
+    "local_ws": {"host": "127.0.0.1", "port": 8765},
+    "server": {
+        "url": "http://127.0.0.1:8000",
+        "kiosk_id": "",
+        "api_key": "",
+        "probe_interval_sec": 5.0,
+        "bulk_batch_size": 200,
+    },
+    "spool_path": "scan_spool.jsonl",
+    "dead_letter_path": "scan_spool.rejected.jsonl",
+}
+
+
+def load_config(path: Optional[str]) -> Dict[str, Any]:
+    cfg = json.loads(json.dumps(DEFAULT_CONFIG))
+    if path and os.path.exists(path):
+        with open(path) as f:
+            user = yaml.safe_load(f) or {}
+        for k, v in user.items():
+            if isinstance(v, dict) and isinstance(cfg.get(k), dict):
+                cfg[k].update(v)
+            else:
+                cfg[k] = v
+    if not 1 <= int(cfg["server"]["bulk_batch_size"]) <= MAX_BULK_BATCH:
+        raise ValueError(f"server.bulk_batch_size must be between 1 and {MAX_BULK_BATCH}")
+    return cfg
+
+
+class Debouncer:
+    """Suppress repeat reads of a UID until it has been quiet for `window` seconds."""
+
+    def __init__(self, window: float):
+        self.window = window
+        self._last: Dict[str, float] = {}
+
+    def accept(self, uid: str, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        last = self._last.get(uid)
+        self._last[uid] = now
+        if len(self._last) > 1024:
+            self._last = {u: t for u, t in self._last.items() if now - t < self.window}
+        return last is None or now - last >= self.window
+
+
+class ScanSpool:
+    """Append-only JSONL file of scans awaiting delivery."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def append(self, record: Dict[str, Any]):
+        self.extend([record])
+
+    def extend(self, records: List[Dict[str, Any]]):
+        with open(self.path, "a") as f:
+            for r in records:
+                f.write(json.dumps(r) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def replace(self, records: List[Dict[str, Any]]):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            for r in records:
+                f.write(json.dumps(r) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+def open_serial(path: str, baud: int) -> int:
+    """Open a tty in raw, non-blocking mode at the given baud rate."""
+    fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+    tty.setraw(fd)
+    attrs = termios.tcgetattr(fd)
+    speed = BAUD_RATES.get(int(baud), termios.B9600)
+    attrs[4] = attrs[5] = speed
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    return fd
+
+
+async def read_uids(path: str, baud: int):
+    """Yield stripped UID lines from the reader; raises OSError when it goes away."""
+    loop = asyncio.get_running_loop()
+    fd = open_serial(path, baud)
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    def _on_readable():
+        try:
+            data = os.read(fd, 1024)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            data = e
+        chunks.put_nowait(data if data else OSError("reader closed"))
+
+    loop.add_reader(fd, _on_readable)
+    buf = b""
+    try:
+        while True:
+            data = await chunks.get()
+            if isinstance(data, OSError):
+                raise data
+            buf += data.replace(b"\r", b"\n")
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                uid = line.decode(errors="ignore").strip()
+                if uid:
+                    yield uid
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+
+
+class Agent:
+    def __init__(self, cfg: Dict[str, Any]):
+        self.cfg = cfg
+        self.debouncer = Debouncer(float(cfg["debounce_window_sec"]))
+        self.spool = ScanSpool(cfg["spool_path"])
+        self.dead_letter = ScanSpool(cfg["dead_letter_path"])
+        self.clients: Set[Any] = set()
+        self.server_ok = False
+        self._http: Optional[httpx.AsyncClient] = None
+
+    async def handle_uid(self, uid: str):
+        if not self.debouncer.accept(uid):
+            logger.debug("Debounced %s", uid)
+            return
+        if self.clients and self.server_ok:
+            logger.info("Scan %s -> %d browser client(s)", uid, len(self.clients))
+            websockets.broadcast(self.clients, uid)
+        else:
+            logger.info("Scan %s spooled (browser=%s, server=%s)", uid, bool(self.clients), self.server_ok)
+            self.spool.append({"rfid_uid": uid, "scanned_at": datetime.utcnow().isoformat()})
+
+    async def serial_loop(self):
+        scfg = self.cfg["serial"]
+        while True:
+            ports = sorted(glob.glob(scfg["port"]))
+            if not ports:
+                logger.warning("No reader at %s", scfg["port"])
+            else:
+                try:
+                    logger.info("Reading %s @ %s baud", ports[0], scfg["baud"])
+                    async for uid in read_uids(ports[0], scfg["baud"]):
+                        await self.handle_uid(uid)
+                except OSError as e:
+                    logger.warning("Reader %s lost (%s)", ports[0], e)
+            await asyncio.sleep(float(scfg["reconnect_delay_sec"]))
+
+    async def local_client(self, ws):
+        self.clients.add(ws)
+        try:
+            await ws.wait_closed()
+        finally:
+            self.clients.discard(ws)
+
+    async def probe(self) -> bool:
+        scfg = self.cfg["server"]
+        try:
+            r = await self._http.get(f"/kiosks/{scfg['kiosk_id']}/status")
+            self.server_ok = r.status_code < 500
+        except httpx.TransportError:
+            self.server_ok = False
+        return self.server_ok
+
+    async def flush(self) -> int:
+        """
+        Deliver spooled scans in order through /rfid/scan/bulk. Returns how many
+        were sent. Stops on transport errors, 429/5xx and 401/403 (scans kept).
+        """
+        scfg = self.cfg["server"]
+        pending = self.spool.load()
+        sent = 0
+        batch_size = int(scfg["bulk_batch_size"])
+        while pending:
+            batch = pending[:batch_size]
+            try:
+                r = await self._http.post("/rfid/scan/bulk", json={"kiosk_id": scfg["kiosk_id"], "scans": batch})
+            except httpx.TransportError as e:
+                self.server_ok = False
+                logger.warning("Bulk delivery failed (%s); %d scan(s) kept", e, len(pending))
+                break
+            if r.status_code in (401, 403):
+                logger.error("Server rejected kiosk %r with %s; check server.api_key. %d scan(s) kept",
+                             scfg["kiosk_id"], r.status_code, len(pending))
+                break
+            if r.status_code in (400, 422):
+                # Retrying the same batch can't succeed and would hold back every later scan.
+                logger.error("Bulk delivery rejected: %s %s; %d scan(s) moved to %s",
+                             r.status_code, r.text, len(batch), self.dead_letter.path)
+                self.dead_letter.extend([{**record, "rejected": r.status_code} for record in batch])
+            elif r.status_code != 200:
+                logger.warning("Bulk delivery failed: %s %s; %d scan(s) kept", r.status_code, r.text, len(pending))
+                break
+            else:
+                sent += len(batch)
+            pending = pending[batch_size:]
+            self.spool.replace(pending)
+        if sent:
+            logger.info("Delivered %d spooled scan(s)", sent)
+        return sent
+
+    async def server_loop(self):
+        interval = float(self.cfg["server"]["probe_interval_sec"])
+        while True:
+            if await self.probe():
+                await self.flush()
+            await asyncio.sleep(interval)
+
+    async def run(self):
+        scfg = self.cfg["server"]
+        headers = {"X-API-Key": scfg["api_key"]} if scfg.get("api_key") else {}
+        async with httpx.AsyncClient(base_url=scfg["url"], headers=headers, timeout=5.0) as http:
+            self._http = http
+            lcfg = self.cfg["local_ws"]
+            async with websockets.serve(self.local_client, lcfg["host"], int(lcfg["port"])):
+                logger.info("Serving browser clients on ws://%s:%s", lcfg["host"], lcfg["port"])
+                await asyncio.gather(self.serial_loop(), self.server_loop())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml"))
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(Agent(load_config(args.config)).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+Fill players.email_bidx (the email blind index) for existing players.
+The app also does this periodically (EMAIL_INDEX_INTERVAL_SEC); run it by
+hand after first deploying the index, or with --rebuild after changing
+EMAIL_INDEX_KEY.
+
+    python scripts/backfill_email_index.py [--batch-size 500] [--rebuild]
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from server.database import init_schema
+from server.services.email_index import backfill
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--batch-size", type=int, default=500)
+    ap.add_argument("--rebuild", action="store_true", help="recompute every row (after a key change)")
+    args = ap.parse_args()
+    init_schema()
+    print(json.dumps(backfill(batch_size=args.batch_size, rebuild=args.rebuild), indent=2))
@@ -0,0 +1,27 @@
+"""
+One-off backfill after upgrading to the typed metric store: split session
+mode/game_metrics out of GameSession.meta and extract numeric per-player
+metrics into session_player_metrics for rows ingested before it existed.
+Runs against the home database and every venue in VENUES.
+
+    python scripts/backfill_metrics.py
+"""
+import json
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from server.database import init_schema
+from server.services.metrics import backfill
+from server.shards import shards
+
+if __name__ == "__main__":
+    init_schema()
+    out = {}
+    for venue in shards.names():
+        with shards.session(venue) as db:
+            out[venue or "home"] = backfill(db)
+    print(json.dumps(out if shards.venues else out["home"], indent=2))
@@ -0,0 +1,212 @@
+"""
+Read-path benchmark: ORM entities + response_model serialization (the old
+handlers, reproduced here) against the Core projections + FastJSONResponse
+the routes use now, on 500-row responses.
+
+Run from the project root:
+    python scripts/bench_reads.py --rows 500 --seconds 3
+
+Seeds a throwaway SQLite file (players, one kiosk queue holding every
+player, session history for one player, a row of kiosks) and calls each
+handler in-process, so the numbers are handler + serialization cost without
+the network. Emails are encrypted with FERNET_KEY when it is set; pass
+--no-email to leave them out and isolate the query/serialization cost.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+
+def seed(db, models, rows: int, with_email: bool, enc_all):
+    from sqlalchemy import insert
+
+    game = models.Game(game_id="bench", name="Bench Game")
+    db.add(game)
+    db.flush()
+    kiosks = [models.Kiosk(kiosk_id=f"bench{i}", location=f"Room {i}", game_id=game.id, modes={"list": ["default"]}) for i in range(50)]
+    db.add_all(kiosks)
+    db.flush()
+    emails = enc_all([f"player{i}@example.com" for i in range(rows)]) if with_email else [None] * rows
+    db.execute(insert(models.Player), [
+        {"username": f"bench.player{i}", "name": f"Bench Player", "email_enc": emails[i],
+         "avatar_path": f"/srv/static/avatars/avatar{i % 12}.png"}
+        for i in range(rows)
+    ])
+    ids = [pid for (pid,) in db.query(models.Player.id).order_by(models.Player.id).all()]
+    now = datetime.utcnow()
+    db.execute(insert(models.QueueEntry), [
+        {"kiosk_id": kiosks[0].id, "player_id": pid, "created_at": now + timedelta(seconds=i)} for i, pid in enumerate(ids)
+    ])
+    db.execute(insert(models.GameSession), [
+        {"game_id": game.id, "kiosk_id": kiosks[i % len(kiosks)].id, "status": "ended", "mode": "default",
+         "started_at": now - timedelta(minutes=10 * i), "ended_at": now - timedelta(minutes=10 * i - 5)}
+        for i in range(rows)
+    ])
+    sids = [sid for (sid,) in db.query(models.GameSession.id).order_by(models.GameSession.id).all()]
+    db.execute(insert(models.SessionPlayer), [
+        {"session_id": sid, "player_id": ids[0], "score": i * 10, "play_time_sec": 300, "metrics": {"kills": i, "accuracy": 0.5}}
+        for i, sid in enumerate(sids)
+    ])
+    db.commit()
+    return ids[0], kiosks[0].kiosk_id
+
+
+def orm_handlers(models, dec, dec_many):
+    """The pre-projection handlers: ORM entities, PlayerOut models, FastAPI-style serialization."""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    from typing import List
+    from server.schemas import PlayerOut
+
+    players_out = TypeAdapter(List[PlayerOut])
+
+    def respond(content, adapter=None):
+        if adapter is not None:
+            content = adapter.dump_python(adapter.validate_python(content), mode="json")
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def list_players(db, limit):
+        players = db.query(models.Player).order_by(models.Player.created_at.desc()).limit(limit).all()
+        emails = dec_many([p.email_enc for p in players])
+        out = [
+            PlayerOut(id=p.id, email=e, name=p.name, username=p.username,
+                      avatar_url=f"/static/avatars/{os.path.basename(p.avatar_path)}" if p.avatar_path else None)
+            for p, e in zip(players, emails)
+        ]
+        return respond(out, players_out)
+
+    def get_queue(db, kiosk_id):
+        kiosk = db.query(models.Kiosk).filter_by(kiosk_id=kiosk_id).first()
+        q = (
+            db.query(models.QueueEntry, models.Player)
+            .join(models.Player, models.Player.id == models.QueueEntry.player_id)
+            .filter(models.QueueEntry.kiosk_id == kiosk.id)
+            .order_by(models.QueueEntry.created_at.asc())
+            .all()
+        )
+        items = [{"player": {
+            "id": p.id, "email": dec(p.email_enc) if p.email_enc else None, "name": p.name, "username": p.username,
+            "avatar_url": f"/static/avatars/{os.path.basename(p.avatar_path)}" if p.avatar_path else None,
+        }} for qe, p in q]
+        return respond({"kiosk_id": kiosk_id, "queue": items})
+
+    def player_history(db, player_id, limit):
+        db.get(models.Player, player_id)
+        rows = (
+            db.query(models.SessionPlayer, models.GameSession, models.Game, models.Kiosk)
+            .join(models.GameSession, models.SessionPlayer.session_id == models.GameSession.id)
+            .join(models.Game, models.GameSession.game_id == models.Game.id)
+            .join(models.Kiosk, models.GameSession.kiosk_id == models.Kiosk.id)
+            .filter(models.SessionPlayer.player_id == player_id)
+            .order_by(models.GameSession.started_at.desc())
+            .limit(limit)
+            .all()
+        )
+        sessions = [{
+            "session_id": sess.id, "game_id": game.game_id, "game_name": game.name, "kiosk_id": kiosk.kiosk_id,
+            "location": kiosk.location,
+            "started_at": sess.started_at.isoformat() if sess.started_at else None,
+            "ended_at": sess.ended_at.isoformat() if sess.ended_at else None,
+            "status": sess.status, "mode": sess.mode or "default", "score": sp.score,
+            "play_time_sec": sp.play_time_sec, "metrics": sp.metrics or {},
+        } for sp, sess, game, kiosk in rows]
+        return respond({"player_id": player_id, "sessions": sessions})
+
+    def kiosk_details(db):
+        from server.services.queue_manager import hub
+        from server.services.rate_limit import limiter
+
+        items = []
+        for k in db.query(models.Kiosk).all():
+            g = db.get(models.Game, k.game_id)
+            running = db.query(models.GameSession).filter_by(kiosk_id=k.id, status="running").first()
+            conns = hub.connection_stats("kiosk", k.kiosk_id)
+            items.append({
+                "game_name": g.name if g else None, "kiosk_id": k.kiosk_id, "game_id": g.game_id if g else None,
+                "location": k.location, "venue": k.venue, "connected": bool(conns), "connections": len(conns),
+                "connected_for_sec": max((c["age_sec"] for c in conns), default=None),
+                "last_seen_sec": min((c["idle_sec"] for c in conns), default=None),
+                "status": "running" if running else "idle", **limiter.kiosk_stats(k.kiosk_id),
+            })
+        return respond({"kiosks": items})
+
+    return list_players, get_queue, player_history, kiosk_details
+
+
+def measure(func, seconds: float):
+    func()  # warm caches / compiled statements
+    n, t0 = 0, time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        body = func()
+        n += 1
+    elapsed = time.perf_counter() - t0
+    return n / elapsed, body
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=500)
+    ap.add_argument("--seconds", type=float, default=3.0, help="time spent per handler and variant")
+    ap.add_argument("--no-email", action="store_true", help="seed players without encrypted emails")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-reads-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    os.environ["EXECUTOR_POOLS"] = ""  # keep crypto inline so both variants pay the same cost
+    os.environ["RATE_QUEUE_PER_SEC"] = os.environ["RATE_QUEUE_GLOBAL_PER_SEC"] = "0"
+
+    from server import models
+    from server.app import kiosk_details as lean_kiosk_details
+    from server.database import SessionLocal, init_schema
+    from server.responses import orjson
+    from server.routers.kiosks import get_queue as lean_get_queue
+    from server.routers.players import list_players as lean_list_players, player_history as lean_player_history
+    from server.services.encryption import dec, dec_many, enc_all
+    from server.settings import settings
+
+    init_schema()
+    db = SessionLocal()
+    player_id, kiosk_id = seed(db, models, args.rows, not args.no_email, enc_all)
+    orm_list, orm_queue, orm_history, orm_details = orm_handlers(models, dec, dec_many)
+    unwrap = lambda f: getattr(f, "__wrapped__", f)
+    limit = min(args.rows, 500)
+    cases = [
+        ("GET /players", lambda: orm_list(db, limit), lambda: unwrap(lean_list_players)(limit=limit, db=db).body),
+        ("GET /kiosks/{id}/queue", lambda: orm_queue(db, kiosk_id), lambda: unwrap(lean_get_queue)(kiosk_id=kiosk_id, db=db).body),
+        ("GET /players/{id}/history", lambda: orm_history(db, player_id, 200), lambda: unwrap(lean_player_history)(player_id=player_id, limit=200, db=db).body),
+        ("GET /ui/kiosks/details", lambda: orm_details(db), lambda: lean_kiosk_details(db=db).body),
+    ]
+
+    report = {"rows": args.rows, "encoder": "orjson" if orjson else "json", "encrypted_emails": bool(settings.fernet_key) and not args.no_email, "routes": {}}
+    for name, orm, lean in cases:
+        orm_rps, orm_body = measure(orm, args.seconds)
+        lean_rps, lean_body = measure(lean, args.seconds)
+        if json.loads(orm_body) != json.loads(lean_body):
+            print(f"warning: {name} responses differ", file=sys.stderr)
+        t0 = time.perf_counter()
+        packed = gzip.compress(lean_body, compresslevel=settings.gzip_level)
+        report["routes"][name] = {
+            "orm_req_per_sec": round(orm_rps, 1),
+            "lean_req_per_sec": round(lean_rps, 1),
+            "speedup": round(lean_rps / orm_rps, 2),
+            "body_bytes": len(lean_body),
+            "gzip_bytes": len(packed),
+            "gzip_ms": round((time.perf_counter() - t0) * 1000, 2),
+        }
+    db.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
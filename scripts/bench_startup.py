@@ -0,0 +1,92 @@
+"""
+Cold-start benchmark: time from spawning uvicorn to the first /rfid/scan response.
+
+Run from the project root:
+    python scripts/bench_startup.py --runs 3
+
+The first run uses a fresh SQLite file (schema gets created); later runs reuse
+it, so they show the warm path where the schema version check skips DDL.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[1]
+
+KIOSK_ID = "bench1"
+KIOSK_KEY = "bench-secret"
+
+
+def first_scan(base_url: str, deadline: float) -> int:
+    body = json.dumps({"kiosk_id": KIOSK_ID, "rfid_uid": "BENCH-TAG"}).encode()
+    while time.monotonic() < deadline:
+        req = urllib.request.Request(
+            base_url + "/rfid/scan",
+            data=body,
+            headers={"Content-Type": "application/json", "X-API-Key": KIOSK_KEY},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=5) as resp:
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.005)
+    raise TimeoutError("server did not answer /rfid/scan in time")
+
+
+def run_once(port: int, db_path: str, cache_dir: str, timeout: float) -> float:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "KIOSK_KEYS": f"{KIOSK_ID}:{KIOSK_KEY}",
+        "TEMPLATE_CACHE_DIR": cache_dir,
+    })
+    t0 = time.monotonic()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server.app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=str(project_root),
+        env=env,
+    )
+    try:
+        status = first_scan(f"http://127.0.0.1:{port}", t0 + timeout)
+        elapsed = time.monotonic() - t0
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    if status != 200:
+        raise RuntimeError(f"/rfid/scan returned {status}")
+    return elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--port", type=int, default=8865)
+    ap.add_argument("--timeout", type=float, default=30.0)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        cache_dir = os.path.join(tmp, "jinja-cache")
+        results = []
+        for i in range(args.runs):
+            elapsed = run_once(args.port, db_path, cache_dir, args.timeout)
+            results.append(elapsed)
+            label = "cold (fresh DB)" if i == 0 else "warm (schema up to date)"
+            print(f"run {i + 1}: {elapsed * 1000:.0f} ms  {label}")
+        if len(results) > 1:
+            warm = results[1:]
+            print(f"warm mean: {sum(warm) / len(warm) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Bulk-enroll players (and their wristbands) from a CSV or JSON file.
+
+CSV header: name,username,email,rfid_uid (any subset; blank username -> generated)
+JSON: [{"name": ..., "rfid_uid": ...}, ...] or {"players": [...]}
+
+    python scripts/enroll_players.py party.csv --dry-run
+    python scripts/enroll_players.py party.csv --partial
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from server.database import SessionLocal, init_schema
+from server.routers.players import bulk_enroll, parse_enrollment_file
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("file")
+    ap.add_argument("--format", choices=["csv", "json"], default=None, help="default: from the file extension")
+    ap.add_argument("--partial", action="store_true", help="enroll the valid rows even if some rows have errors")
+    ap.add_argument("--dry-run", action="store_true", help="validate only")
+    args = ap.parse_args()
+
+    fmt = args.format or ("json" if args.file.lower().endswith(".json") else "csv")
+    rows = parse_enrollment_file(Path(args.file).read_bytes(), fmt)
+    init_schema()
+    t0 = time.perf_counter()
+    with SessionLocal() as db:
+        report = bulk_enroll(db, rows, partial=args.partial, dry_run=args.dry_run)
+    report["elapsed_sec"] = round(time.perf_counter() - t0, 3)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    sys.exit(1 if report["errors"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Export session history as CSV, NDJSON or Parquet without loading it into memory.
+
+    python scripts/export_sessions.py --format csv --start 2025-01-01 --end 2025-02-01 -o jan.csv
+    python scripts/export_sessions.py --format ndjson --game laser_tag > laser.ndjson
+"""
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from server.services import export
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--format", choices=sorted(export.FORMATS), default="csv")
+    ap.add_argument("--start", type=datetime.fromisoformat, default=None, help="started_at >= (ISO date/time, UTC)")
+    ap.add_argument("--end", type=datetime.fromisoformat, default=None, help="started_at < (ISO date/time, UTC)")
+    ap.add_argument("--game", default=None, help="game_id to filter on")
+    ap.add_argument("--chunk-size", type=int, default=1000)
+    ap.add_argument("-o", "--output", default="-", help="file path, or - for stdout")
+    args = ap.parse_args()
+
+    if args.format == "parquet" and args.output == "-":
+        ap.error("parquet output needs -o <file>")
+    rows = export.iter_export_rows(start=args.start, end=args.end, game_id=args.game, chunk_size=args.chunk_size)
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in export.iter_export(args.format, rows, args.chunk_size):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+if __name__ == "__main__":
+    main()
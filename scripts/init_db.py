@@ -6,10 +6,10 @@ project_root = Path(__file__).resolve().parents[1]
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
-from server.database import SessionLocal, Base, engine
+from server.database import SessionLocal, init_schema
 from server import models
 
-Base.metadata.create_all(bind=engine)
+init_schema(force=True)
 db = SessionLocal()
 
 def ensure_game(game_id, name):
@@ -0,0 +1,176 @@
+"""
+Replay a recorded request journal (see server/services/journal.py) against a
+server and compare latency distributions per route.
+
+    python scripts/replay_journal.py --day 2025-06-14 --speed 10 --base-url http://127.0.0.1:8000
+    python scripts/replay_journal.py journal/requests-2025-06-14*.jsonl --speed max --concurrency 64
+
+--speed 1 keeps the recorded pacing, 10 compresses it tenfold, max sends as
+fast as --concurrency allows. Writes are replayed too, so point it at a
+local server with a copy of the database. API keys and admin credentials
+are taken from this environment (KIOSK_KEYS, GAME_KEYS, ADMIN_USER,
+ADMIN_PASSWORD). Records captured without JOURNAL_CAPTURE_BODY get a
+placeholder body built from the recorded shape.
+"""
+import argparse
+import base64
+import glob
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlencode
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from server.settings import settings
+
+_PLACEHOLDERS = {"str": "replay", "int": 0, "float": 0.0, "bool": False, "null": None}
+
+
+def from_shape(s):
+    if isinstance(s, dict) and set(s) == {"list", "item"}:
+        return [from_shape(s["item"])] * s["list"] if s["item"] is not None else []
+    if isinstance(s, dict):
+        return {k: from_shape(v) for k, v in s.items()}
+    return _PLACEHOLDERS.get(s, None)
+
+
+def load(paths):
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def build_request(rec, base_url):
+    url = base_url.rstrip("/") + rec["path"]
+    if rec.get("query"):
+        url += "?" + urlencode(rec["query"])
+    headers = {}
+    data = None
+    body = rec.get("body")
+    if body is None and "form" not in rec and isinstance(rec.get("body_shape"), dict) and "json" in (rec.get("content_type") or ""):
+        body = from_shape(rec["body_shape"])
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+    elif "form" in rec:
+        data = urlencode(rec["form"]).encode()
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+    if rec.get("auth") == "api_key":
+        fields = {**(body if isinstance(body, dict) else {}), **rec.get("query", {}), **rec.get("path_params", {})}
+        key = settings.kiosk_keys.get(fields.get("kiosk_id", "")) or settings.game_keys.get(fields.get("game_id", ""))
+        if key:
+            headers["X-API-Key"] = key
+    elif rec.get("auth") == "basic":
+        token = base64.b64encode(f"{settings.admin_username}:{settings.admin_password}".encode()).decode()
+        headers["Authorization"] = f"Basic {token}"
+    return urllib.request.Request(url, data=data, headers=headers, method=rec["method"])
+
+
+def send(req, timeout):
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, (time.perf_counter() - t0) * 1000
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1)
+
+
+def replay(records, base_url, speed, concurrency, timeout):
+    results = [None] * len(records)
+    t_first = datetime.fromisoformat(records[0]["ts"])
+    start = time.perf_counter()
+
+    def run(i, rec):
+        results[i] = send(build_request(rec, base_url), timeout)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, rec in enumerate(records):
+            if speed is not None:
+                due = (datetime.fromisoformat(rec["ts"]) - t_first).total_seconds() / speed
+                delay = due - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(run, i, rec)
+    return results, time.perf_counter() - start
+
+
+def compare(records, results):
+    routes = defaultdict(lambda: {"recorded": [], "replayed": [], "status_mismatch": 0})
+    for rec, (status, latency) in zip(records, results):
+        r = routes[f"{rec['method']} {rec.get('route') or rec['path']}"]
+        r["recorded"].append(rec["latency_ms"])
+        r["replayed"].append(latency)
+        r["status_mismatch"] += status != rec["status"]
+    out = {}
+    for name, r in sorted(routes.items(), key=lambda kv: -len(kv[1]["recorded"])):
+        out[name] = {
+            "count": len(r["recorded"]),
+            "status_mismatch": r["status_mismatch"],
+            **{f"recorded_p{int(p * 100)}_ms": percentile(r["recorded"], p) for p in (0.5, 0.9, 0.99)},
+            **{f"replayed_p{int(p * 100)}_ms": percentile(r["replayed"], p) for p in (0.5, 0.9, 0.99)},
+        }
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("files", nargs="*", help="journal files (default: --day from JOURNAL_DIR)")
+    ap.add_argument("--day", help="YYYY-MM-DD; replays JOURNAL_DIR/requests-<day>*.jsonl")
+    ap.add_argument("--base-url", default="http://127.0.0.1:8000")
+    ap.add_argument("--speed", default="1", help="1, 10, ... or max")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--limit", type=int, default=None, help="replay only the first N records")
+    ap.add_argument("--json", action="store_true", help="print the comparison as JSON")
+    args = ap.parse_args()
+
+    paths = list(args.files)
+    if args.day:
+        paths += sorted(glob.glob(os.path.join(settings.journal_dir, f"requests-{args.day}*.jsonl")))
+    if not paths:
+        ap.error("give journal files or --day")
+    records = load(paths)[: args.limit]
+    if not records:
+        ap.error("no records found")
+    speed = None if args.speed == "max" else float(args.speed)
+
+    results, elapsed = replay(records, args.base_url, speed, args.concurrency, args.timeout)
+    report = compare(records, results)
+    if args.json:
+        print(json.dumps({"records": len(records), "elapsed_sec": round(elapsed, 2), "routes": report}, indent=2))
+        return
+    print(f"{len(records)} requests in {elapsed:.1f}s ({len(records) / elapsed:.1f} req/s)")
+    print(f"{'route':50} {'n':>6} {'bad':>4}   {'rec p50/p90/p99 ms':>22}   {'replay p50/p90/p99 ms':>22}")
+    for name, r in report.items():
+        rec = "/".join(str(r[f"recorded_p{p}_ms"]) for p in (50, 90, 99))
+        rep = "/".join(str(r[f"replayed_p{p}_ms"]) for p in (50, 90, 99))
+        print(f"{name[:50]:50} {r['count']:>6} {r['status_mismatch']:>4}   {rec:>22}   {rep:>22}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Re-encrypt all stored emails under the current FERNET_KEY.
+
+1. python scripts/gen_keys.py  -> new FERNET_KEY
+2. Set FERNET_KEY=<new> and FERNET_OLD_KEYS=<old>, restart the app
+3. python scripts/rotate_keys.py   (safe to interrupt and re-run; it resumes)
+4. When it reports done, drop FERNET_OLD_KEYS
+
+The app also does this in the background every KEY_ROTATION_INTERVAL_SEC.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from server.database import init_schema
+from server.services import key_rotation
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--batch-size", type=int, default=None)
+    ap.add_argument("--pause-ms", type=int, default=None, help="sleep between batches")
+    ap.add_argument("--restart", action="store_true", help="start over from the first player")
+    args = ap.parse_args()
+    init_schema()
+
+    def progress(p):
+        print(f"{p['percent']:5.1f}%  scanned={p['scanned']} rotated={p['rotated']} failed={p['failed']} {p['rows_per_sec']} rows/s", file=sys.stderr)
+
+    result = key_rotation.run(batch_size=args.batch_size, pause_ms=args.pause_ms, restart=args.restart, progress=progress)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if result.get("failed") else 0)
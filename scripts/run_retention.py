@@ -0,0 +1,28 @@
+"""
+Archive and delete session history older than RETENTION_DAYS.
+
+    python scripts/run_retention.py                 # use RETENTION_DAYS / ARCHIVE_DIR from .env
+    python scripts/run_retention.py --days 90 --batch-size 200
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from server.services.retention import run_retention
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=int, default=None, help="override RETENTION_DAYS")
+    ap.add_argument("--batch-size", type=int, default=None, help="sessions per delete transaction")
+    ap.add_argument("--max-batches", type=int, default=None)
+    args = ap.parse_args()
+    stats = run_retention(horizon_days=args.days, batch_size=args.batch_size, max_batches=args.max_batches)
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Local stand-in for a webhook receiver (POS, marketing, ...), for trying out
+outbox delivery without the real systems.
+
+    python scripts/webhook_receiver.py --port 9010
+    WEBHOOKS=pos=http://127.0.0.1:9010/hook uvicorn server.app:app
+
+Checks X-Outbox-Signature with WEBHOOK_SECRET (else SECRET_KEY) from this
+environment, skips event ids it has already seen (delivery is at-least-once)
+and prints one line per new event. --fail-first and --fail-rate answer 503
+to exercise retries and backoff; --delay-ms slows responses down.
+"""
+import argparse
+import hmac
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from server.services.webhooks import sign
+
+
+def make_handler(args):
+    seen = set()
+    lock = threading.Lock()
+    counts = {"requests": 0, "failed": 0, "events": 0, "duplicates": 0, "bad_signature": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *a):
+            pass
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._reply(200, counts)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with lock:
+                counts["requests"] += 1
+                n = counts["requests"]
+            if args.delay_ms:
+                time.sleep(args.delay_ms / 1000)
+            if not hmac.compare_digest(self.headers.get("X-Outbox-Signature", ""), sign(body)):
+                counts["bad_signature"] += 1
+                return self._reply(401, {"error": "bad signature"})
+            if n <= args.fail_first or random.random() < args.fail_rate:
+                counts["failed"] += 1
+                return self._reply(503, {"error": "induced failure"})
+            batch = json.loads(body)
+            with lock:
+                for e in batch["events"]:
+                    if e["id"] in seen:
+                        counts["duplicates"] += 1
+                        continue
+                    seen.add(e["id"])
+                    counts["events"] += 1
+                    if not args.quiet:
+                        print(f"{batch['endpoint']} #{e['id']} {e['topic']} {json.dumps(e['data'])}", flush=True)
+            self._reply(200, {"ok": True})
+
+    return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9010)
+    ap.add_argument("--fail-first", type=int, default=0, help="answer 503 to the first N requests")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="answer 503 to this fraction of requests")
+    ap.add_argument("--delay-ms", type=int, default=0)
+    ap.add_argument("--quiet", action="store_true", help="don't print events (GET / still reports counts)")
+    args = ap.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    print(f"Listening on http://{args.host}:{args.port}/ (GET / for counts)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
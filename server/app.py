@@ -1,25 +1,125 @@
 
-from fastapi import FastAPI, Request, Depends, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, Request, Depends, Form, HTTPException
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
+import logging
 import os
+import tempfile
+import time
 
-from .database import Base, engine
+from .database import init_schema
 from .deps import get_db
 from . import models
+from .responses import FastJSONResponse
 from .security import verify_admin
-from .routers import players, rfid, kiosks, games, sessions, ws
+from .settings import settings
+from .routers import players, rfid, kiosks, games, sessions, ws, exports, changes
 from .schemas import PlayerCreate
+from .services.queue_manager import hub
+from .services.rate_limit import limiter
+from .services.scheduler import scheduler
+from .services import jobs, maintenance, profiler, throughput
+from .services.executors import executors
+from .services.journal import JournalMiddleware, journal
+from .services.live_scores import live_scores
+from .services.webhooks import dispatcher
+from .shards import shards
 
-app = FastAPI(title="Kiosk System v2")
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger("uvicorn.error")
 
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 templates_dir = os.path.join(os.path.dirname(__file__), "templates")
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
+template_cache_dir = settings.template_cache_dir or os.path.join(tempfile.gettempdir(), "kiosk-jinja-cache")
 templates = Jinja2Templates(directory=templates_dir)
+templates.env.bytecode_cache = FileSystemBytecodeCache(template_cache_dir)
+
+
+@contextmanager
+def _phase(timings: dict, name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - t0) * 1000, 2)
+
+
+def _precompile_templates():
+    """Compile every template up front; the bytecode cache makes later cold starts cheaper."""
+    os.makedirs(template_cache_dir, exist_ok=True)
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    All one-off startup work lives here instead of at import time.
+    Per-phase timings (ms) are logged and kept on app.state.startup_timings.
+    """
+    timings: dict = {}
+    with _phase(timings, "schema"):
+        ddl_ran = init_schema()
+    with _phase(timings, "avatar_dir"):
+        players.ensure_avatar_dir()
+    with _phase(timings, "templates"):
+        _precompile_templates()
+    if settings.ws_event_persist:
+        with _phase(timings, "event_log"):
+            await asyncio.to_thread(hub.load_persisted)
+    app.state.startup_timings = timings
+    logger.info("Startup phases (ms): %s; schema %s", timings, "created/updated" if ddl_ran else "up to date")
+    heartbeat = asyncio.create_task(hub.run_heartbeat())
+    live = asyncio.create_task(live_scores.run())
+    journal_writer = asyncio.create_task(journal.run())
+    webhook_sender = asyncio.create_task(dispatcher.run())
+    job_worker = asyncio.create_task(jobs.worker.run()) if settings.jobs_worker else None
+    scheduled = None
+    if settings.scheduler_enabled:
+        maintenance.register(scheduler)
+        scheduled = asyncio.create_task(scheduler.run())
+    try:
+        yield
+    finally:
+        heartbeat.cancel()
+        live.cancel()
+        journal_writer.cancel()
+        webhook_sender.cancel()
+        if job_worker:
+            # Let running jobs finish; anything cut off is reclaimed when its lease expires.
+            jobs.worker.stop()
+            try:
+                await asyncio.wait_for(job_worker, timeout=10)
+            except asyncio.TimeoutError:
+                pass
+        # Jobs still running in a thread keep their lease until it expires.
+        busy = [j.name for j in scheduler.jobs.values() if j.running]
+        if scheduled:
+            scheduled.cancel()
+        try:
+            await asyncio.to_thread(scheduler.release, busy)
+        except Exception:
+            logger.exception("Releasing scheduler leases failed")
+        await hub.flush_all()
+        await asyncio.to_thread(throughput.flush)
+        await asyncio.to_thread(live_scores.flush)
+        await asyncio.to_thread(journal.flush)
+        executors.shutdown()
+
+
+app = FastAPI(title="Kiosk System v2", lifespan=lifespan)
+app.add_middleware(JournalMiddleware)
+if settings.gzip_min_bytes > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.gzip_min_bytes, compresslevel=settings.gzip_level)
+app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 app.include_router(players.router)
 app.include_router(rfid.router)
@@ -27,6 +127,8 @@ app.include_router(kiosks.router)
 app.include_router(games.router)
 app.include_router(sessions.router)
 app.include_router(ws.router)
+app.include_router(exports.router)
+app.include_router(changes.router)
 
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
@@ -34,7 +136,6 @@ def index(request: Request):
 
 @app.get("/kiosk", response_class=HTMLResponse)
 def kiosk_ui(request: Request, kiosk_id: str, game_id: str, db: Session = Depends(get_db)):
-    from .settings import settings
     api_key = settings.kiosk_keys.get(kiosk_id, "")
     game = db.query(models.Game).filter_by(game_id=game_id).first()
     game_name = game.name if game else game_id
@@ -61,30 +162,72 @@ def profile_new(request: Request, rfid_uid: str, kiosk_id: str, game_id: str):
 @app.post("/ui/profile/create")
 def profile_create(request: Request, email: str = Form(...), name: str = Form(...), username: str = Form(...), rfid_uid: str = Form(...), db: Session = Depends(get_db)):
     data = PlayerCreate(email=email, name=name, username=username, rfid_uid=rfid_uid)
-    from .routers.players import create_player as _create
-    player = _create(data, db)
+    players.register_player(db, data)
     return RedirectResponse(url="/", status_code=303)
 
 
 
+def _running_kiosk_ids(db: Session):
+    K, GS = models.Kiosk, models.GameSession
+    return db.execute(select(K.kiosk_id).join(GS, GS.kiosk_id == K.id).where(GS.status == "running")).scalars().all()
+
+
 @app.get("/ui/kiosks/details")
 def kiosk_details(db: Session = Depends(get_db)):
-    from .services.queue_manager import hub
+    K, G = models.Kiosk, models.Game
+    rows = db.execute(
+        select(K.kiosk_id, K.location, K.venue, G.game_id, G.name.label("game_name"))
+        .outerjoin(G, K.game_id == G.id)
+        .order_by(K.id)
+    ).all()
+    running = set().union(*shards.fan_out(_running_kiosk_ids, db=db))
     items = []
-    kiosks = db.query(models.Kiosk).all()
-    for k in kiosks:
-        g = db.get(models.Game, k.game_id)
-        running = db.query(models.GameSession).filter_by(kiosk_id=k.id, status="running").first()
-        connected = bool((hub.kiosk_clients.get(k.kiosk_id) or []))
+    for r in rows:
+        conns = hub.connection_stats("kiosk", r.kiosk_id)
         items.append({
-            "game_name": g.name if g else None,
-            "kiosk_id": k.kiosk_id,
-            "game_id": g.game_id if g else None,
-            "location": k.location,
-            "connected": connected,
-            "status": "running" if running else "idle"
+            "game_name": r.game_name,
+            "kiosk_id": r.kiosk_id,
+            "game_id": r.game_id,
+            "location": r.location,
+            "venue": r.venue,
+            "connected": bool(conns),
+            "connections": len(conns),
+            "connected_for_sec": max((c["age_sec"] for c in conns), default=None),
+            "last_seen_sec": min((c["idle_sec"] for c in conns), default=None),
+            "status": "running" if r.kiosk_id in running else "idle",
+            **limiter.kiosk_stats(r.kiosk_id),
         })
-    return {"kiosks": items}
+    return FastJSONResponse({"kiosks": items})
+
+
+@app.get("/ui/kiosks/throughput")
+def kiosk_throughput(
+    minutes: int = 60,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    kiosk_id: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Sessions/hour, queue-wait percentiles and utilization per kiosk, from the
+    minute rollups. Window is [start, end) or, by default, the last `minutes`.
+    """
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(minutes=minutes)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    kiosks = {k.id: k.kiosk_id for k in db.query(models.Kiosk).all()}
+    kiosk_pk = None
+    if kiosk_id is not None:
+        kiosk_pk = next((pk for pk, kid in kiosks.items() if kid == kiosk_id), None)
+        if kiosk_pk is None:
+            raise HTTPException(status_code=404, detail="Kiosk not found")
+    stats = throughput.summarize(start, end, kiosk_pk)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "kiosks": [{"kiosk_id": kiosks[pk], **row} for pk, row in stats.items() if pk in kiosks],
+    }
 
 
 @app.get("/ui/kiosks")
@@ -93,6 +236,12 @@ def list_kiosk_ids(db: Session = Depends(get_db)):
     return {"kiosks": ids}
 
 
+@app.get("/ui/venues")
+def venue_status(admin: bool = Depends(verify_admin)):
+    """Home and venue databases with their kiosks, queue length and running sessions."""
+    return {"venues": shards.status()}
+
+
 @app.get("/ui/games/history", response_class=HTMLResponse)
 def game_history_page(request: Request, game_id: str):
     return templates.TemplateResponse("game_history.html", {"request": request, "game_id": game_id})
@@ -103,6 +252,114 @@ def dev_page(request: Request, admin: bool = Depends(verify_admin)):
     return templates.TemplateResponse("dev.html", {"request": request})
 
 
+@app.get("/ui/maintenance")
+def maintenance_status(admin: bool = Depends(verify_admin)):
+    return {"enabled": settings.scheduler_enabled, "worker": scheduler.holder, "jobs": scheduler.status()}
+
+
+@app.post("/ui/maintenance/{name}/run")
+async def maintenance_run(name: str, admin: bool = Depends(verify_admin)):
+    """Run a maintenance job now (still subject to the cross-worker lease)."""
+    if name not in scheduler.jobs:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return {"name": name, "result": await scheduler.run_job(name)}
+
+
+@app.get("/ui/executors")
+def executor_stats(admin: bool = Depends(verify_admin)):
+    """Queue depth and recent queue-wait / run times per executor pool."""
+    return {"pools": executors.stats()}
+
+
+@app.get("/ui/jobs")
+def job_stats(admin: bool = Depends(verify_admin)):
+    """Job queue depth per kind and status, run times on this worker, recent dead jobs."""
+    return jobs.worker.stats()
+
+
+@app.post("/ui/jobs/{job_id}/retry")
+def job_retry(job_id: int, admin: bool = Depends(verify_admin)):
+    """Requeue a dead job."""
+    if not jobs.retry(job_id):
+        raise HTTPException(status_code=404, detail="No dead job with that id")
+    return {"ok": True, "job_id": job_id}
+
+
+@app.get("/ui/webhooks")
+def webhook_status(admin: bool = Depends(verify_admin)):
+    """Cursor, backlog and last delivery/failure per WEBHOOKS endpoint."""
+    return {"endpoints": dispatcher.status()}
+
+
+@app.post("/ui/webhooks/{name}/cursor")
+def webhook_set_cursor(name: str, after: int, admin: bool = Depends(verify_admin)):
+    """Move an endpoint's cursor (replay from `after`, or skip events it keeps rejecting)."""
+    if name not in settings.webhooks:
+        raise HTTPException(status_code=404, detail="Unknown webhook endpoint")
+    dispatcher.set_cursor(name, max(0, after))
+    return {"ok": True, "name": name, "cursor": max(0, after)}
+
+
+@app.get("/ui/debug/profile")
+async def debug_profile(
+    seconds: float = 10.0,
+    hz: Optional[float] = None,
+    format: str = "json",
+    top: int = 25,
+    admin: bool = Depends(verify_admin),
+):
+    """
+    Sample every thread's stack (and event-loop lag) for `seconds`.
+    format=collapsed returns flamegraph input as text; json adds a summary.
+    """
+    if not 0 < seconds <= settings.profile_max_sec:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {settings.profile_max_sec}]")
+    if hz is not None and not 1 <= hz <= 1000:
+        raise HTTPException(status_code=400, detail="hz must be between 1 and 1000")
+    if format not in ("json", "collapsed"):
+        raise HTTPException(status_code=400, detail="format must be json or collapsed")
+    if profiler.busy():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    result = await profiler.sample(seconds, hz)
+    stacks = result.pop("stacks")
+    if format == "collapsed":
+        lag = result["event_loop_lag"]
+        return PlainTextResponse(
+            profiler.collapsed(stacks),
+            headers={"X-Samples": str(result["samples"]), "X-Loop-Lag-Max-Ms": str(lag.get("max_ms", ""))},
+        )
+    return {**result, "top_frames": profiler.top_frames(stacks, top), "collapsed": profiler.collapsed(stacks)}
+
+
+@app.get("/ui/debug/memory")
+def debug_memory_status(admin: bool = Depends(verify_admin)):
+    return profiler.memory_status()
+
+
+@app.post("/ui/debug/memory/start")
+def debug_memory_start(frames: int = 1, admin: bool = Depends(verify_admin)):
+    """Start tracemalloc (slows allocations while on; stop it when done)."""
+    if not 1 <= frames <= 25:
+        raise HTTPException(status_code=400, detail="frames must be between 1 and 25")
+    return profiler.memory_start(frames)
+
+
+@app.post("/ui/debug/memory/stop")
+def debug_memory_stop(admin: bool = Depends(verify_admin)):
+    return profiler.memory_stop()
+
+
+@app.get("/ui/debug/memory/snapshot")
+async def debug_memory_snapshot(top: int = 25, group_by: str = "lineno", admin: bool = Depends(verify_admin)):
+    """Top allocation sites, plus the diff against the previous snapshot."""
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    try:
+        return await asyncio.to_thread(profiler.memory_snapshot, top, group_by)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
 @app.get("/ui/players/dev", response_class=HTMLResponse)
 def dev_players_page(request: Request, admin: bool = Depends(verify_admin)):
     return templates.TemplateResponse("players_dev.html", {"request": request})
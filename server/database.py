@@ -1,8 +1,13 @@
 
-from sqlalchemy import create_engine
+from datetime import datetime
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from .settings import settings
 
+# Bump whenever models change so init_schema() re-runs DDL on the next start.
+SCHEMA_VERSION = 13
+
 class Base(DeclarativeBase):
     pass
 
@@ -12,3 +17,64 @@ engine = create_engine(
     pool_pre_ping=True,
 )
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+
+def get_schema_version():
+    """Return the schema version recorded in the DB, or None if it has never been stamped."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT version FROM schema_meta WHERE id = 1")).scalar()
+    except (OperationalError, ProgrammingError):
+        return None
+
+
+def add_missing_columns(bind=None, tables=None, schema=None):
+    """
+    create_all() only creates missing tables. Add nullable columns that were
+    introduced on existing tables since the DB was created.
+    """
+    bind = bind if bind is not None else engine
+    insp = inspect(bind)
+    existing_tables = set(insp.get_table_names(schema=schema))
+    with bind.begin() as conn:
+        for table in tables if tables is not None else Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            have = {c["name"] for c in insp.get_columns(table.name, schema=schema)}
+            qualified = f'"{schema}".{table.name}' if schema else table.name
+            for col in table.columns:
+                if col.name in have or not col.nullable:
+                    continue
+                col_type = col.type.compile(dialect=bind.dialect)
+                conn.execute(text(f'ALTER TABLE {qualified} ADD COLUMN "{col.name}" {col_type}'))
+                for idx in table.indexes:
+                    if [c.name for c in idx.columns] == [col.name]:
+                        idx.create(conn, checkfirst=True)
+
+
+def init_schema(force: bool = False) -> bool:
+    """
+    Create missing tables and stamp SCHEMA_VERSION.
+    Skips all DDL when the stored version already matches, so warm starts
+    only pay for a single SELECT (plus one per venue database, which only
+    gets DDL when it is new). Returns True if DDL was run.
+    """
+    from . import models
+    from .services import player_search
+    from .shards import shards
+
+    if not force and get_schema_version() == SCHEMA_VERSION:
+        return bool(shards.init_schema())
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    player_search.ensure_index(engine)
+    with SessionLocal() as db:
+        row = db.get(models.SchemaMeta, 1)
+        if row is None:
+            row = models.SchemaMeta(id=1)
+            db.add(row)
+        row.version = SCHEMA_VERSION
+        row.updated_at = datetime.utcnow()
+        db.commit()
+    shards.init_schema(force=True)
+    return True
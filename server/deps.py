@@ -1,4 +1,5 @@
 from .database import SessionLocal
+from .shards import shards
 
 def get_db():
     db = SessionLocal()
@@ -6,3 +7,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def get_kiosk_db(kiosk_id: str):
+    """get_db bound to the database that holds this kiosk's queue and sessions (shards.py)."""
+    db = shards.session(shards.venue_for(kiosk_id=kiosk_id))
+    try:
+        yield db
+    finally:
+        db.close()
@@ -1,13 +1,17 @@
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import Integer, String, DateTime, ForeignKey, JSON, UniqueConstraint
-from datetime import datetime
+from sqlalchemy import BigInteger, Integer, String, DateTime, Date, Float, Boolean, ForeignKey, JSON, UniqueConstraint, Index
+from datetime import datetime, date
 from .database import Base
 
+# Ids of the per-venue tables (shards.py) start at 10**9 multiples; SQLite needs plain INTEGER for its rowid alias.
+BigId = BigInteger().with_variant(Integer, "sqlite")
+
 class Player(Base):
     __tablename__ = "players"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     email_enc: Mapped[str] = mapped_column(String, nullable=True)
+    email_bidx: Mapped[str] = mapped_column(String, nullable=True, unique=True, index=True)  # encryption.email_index()
     name: Mapped[str] = mapped_column(String, nullable=True)
     username: Mapped[str] = mapped_column(String, unique=True, index=True)
     avatar_path: Mapped[str] = mapped_column(String, nullable=True)
@@ -29,6 +33,8 @@ class Game(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     game_id: Mapped[str] = mapped_column(String, unique=True, index=True)
     name: Mapped[str] = mapped_column(String)
+    max_session_sec: Mapped[int] = mapped_column(Integer, nullable=True)  # None -> SESSION_MAX_SEC
+    session_capacity: Mapped[int] = mapped_column(Integer, nullable=True)  # players per session; None -> BALANCE_SESSION_CAPACITY
     kiosks = relationship("Kiosk", back_populates="game")
     sessions = relationship("GameSession", back_populates="game")
 
@@ -37,6 +43,7 @@ class Kiosk(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     kiosk_id: Mapped[str] = mapped_column(String, unique=True, index=True)
     location: Mapped[str] = mapped_column(String, nullable=True)
+    venue: Mapped[str] = mapped_column(String, nullable=True, index=True)  # one of VENUES; None -> home database (shards.py)
     game_id: Mapped[int] = mapped_column(ForeignKey("games.id"))
     api_key_hash: Mapped[str] = mapped_column(String, nullable=True)
     modes: Mapped[dict] = mapped_column(JSON, default=dict)  # {"list":["solo","team"]}
@@ -49,7 +56,7 @@ class Kiosk(Base):
 
 class QueueEntry(Base):
     __tablename__ = "queue_entries"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    id: Mapped[int] = mapped_column(BigId, primary_key=True)
     kiosk_id: Mapped[int] = mapped_column(ForeignKey("kiosks.id"))
     player_id: Mapped[int] = mapped_column(ForeignKey("players.id"))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -60,13 +67,15 @@ class QueueEntry(Base):
 
 class GameSession(Base):
     __tablename__ = "game_sessions"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    id: Mapped[int] = mapped_column(BigId, primary_key=True)
     kiosk_id: Mapped[int] = mapped_column(ForeignKey("kiosks.id"))
     game_id: Mapped[int] = mapped_column(ForeignKey("games.id"))
     status: Mapped[str] = mapped_column(String, default="pending")  # pending|running|ended|cancelled
     started_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     ended_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     meta: Mapped[dict] = mapped_column(JSON, default=dict)
+    mode: Mapped[str] = mapped_column(String, nullable=True, index=True)
+    game_metrics: Mapped[dict] = mapped_column(JSON, nullable=True)  # as posted to /sessions/end
 
     kiosk = relationship("Kiosk", back_populates="sessions")
     game = relationship("Game", back_populates="sessions")
@@ -74,15 +83,17 @@ class GameSession(Base):
 
 class SessionPlayer(Base):
     __tablename__ = "session_players"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    session_id: Mapped[int] = mapped_column(ForeignKey("game_sessions.id", ondelete="CASCADE"))
+    id: Mapped[int] = mapped_column(BigId, primary_key=True)
+    session_id: Mapped[int] = mapped_column(BigId, ForeignKey("game_sessions.id", ondelete="CASCADE"))
     player_id: Mapped[int] = mapped_column(ForeignKey("players.id"))
     score: Mapped[int] = mapped_column(Integer, default=0)
     play_time_sec: Mapped[int] = mapped_column(Integer, default=0)
     metrics: Mapped[dict] = mapped_column(JSON, default=dict)
+    queued_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)  # when the player joined the queue
 
     session = relationship("GameSession", back_populates="players")
     player = relationship("Player", back_populates="sessions")
+    metric_values = relationship("SessionPlayerMetric", cascade="all,delete", passive_deletes=True)
 
 
 class UsernameWord(Base):
@@ -91,3 +102,125 @@ class UsernameWord(Base):
     kind: Mapped[str] = mapped_column(String)  # "adj" or "noun"
     word: Mapped[str] = mapped_column(String, unique=True, index=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class SchemaMeta(Base):
+    __tablename__ = "schema_meta"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class JobLease(Base):
+    """Which worker may run a scheduled job, and until when (see services/scheduler.py)."""
+    __tablename__ = "job_leases"
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    holder: Mapped[str] = mapped_column(String)
+    expires_at: Mapped[datetime] = mapped_column(DateTime)
+
+
+class JobState(Base):
+    """Resumable progress of a long-running job (e.g. key rotation), keyed by job name."""
+    __tablename__ = "job_state"
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    cursor: Mapped[int] = mapped_column(Integer, default=0)  # last processed id
+    done: Mapped[bool] = mapped_column(Boolean, default=False)
+    stats: Mapped[dict] = mapped_column(JSON, default=dict)
+    started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class HubEvent(Base):
+    """Optional persisted copy of sequenced hub broadcasts (see WS_EVENT_PERSIST)."""
+    __tablename__ = "hub_events"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    group_name: Mapped[str] = mapped_column(String)  # "kiosk" | "game"
+    channel_key: Mapped[str] = mapped_column(String)  # kiosk_id or game_id
+    seq: Mapped[int] = mapped_column(Integer)
+    payload: Mapped[dict] = mapped_column(JSON, default=dict)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    __table_args__ = (Index("ix_hub_events_channel_seq", "group_name", "channel_key", "seq"),)
+
+
+class QueuedJob(Base):
+    """Deferred work for the background job queue (see services/jobs.py)."""
+    __tablename__ = "job_queue"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String, index=True)  # handler name, e.g. "player.delete"
+    payload: Mapped[dict] = mapped_column(JSON, default=dict)
+    key: Mapped[str] = mapped_column(String, nullable=True, index=True)  # dedupe key among unfinished jobs
+    priority: Mapped[int] = mapped_column(Integer, default=0)  # higher runs first
+    status: Mapped[str] = mapped_column(String, default="queued")  # queued|running|done|dead
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=5)
+    run_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)  # not before (retry backoff)
+    locked_by: Mapped[str] = mapped_column(String, nullable=True)
+    locked_until: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str] = mapped_column(String, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    __table_args__ = (Index("ix_job_queue_claim", "status", "priority", "run_at"),)
+
+
+class OutboxEvent(Base):
+    """Change event written in the same transaction as the change (see services/outbox.py)."""
+    __tablename__ = "outbox_events"
+    id: Mapped[int] = mapped_column(BigId, primary_key=True)  # feed cursor
+    topic: Mapped[str] = mapped_column(String)  # e.g. "session.ended", "queue.joined"
+    payload: Mapped[dict] = mapped_column(JSON, default=dict)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+
+class SessionDailySummary(Base):
+    """Per day/game/kiosk rollup of sessions that were moved to the archive."""
+    __tablename__ = "session_daily_summaries"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, index=True)
+    game_id: Mapped[int] = mapped_column(ForeignKey("games.id"))
+    kiosk_id: Mapped[int] = mapped_column(ForeignKey("kiosks.id", ondelete="SET NULL"), nullable=True)
+    sessions: Mapped[int] = mapped_column(Integer, default=0)
+    player_slots: Mapped[int] = mapped_column(Integer, default=0)
+    total_score: Mapped[int] = mapped_column(Integer, default=0)
+    max_score: Mapped[int] = mapped_column(Integer, default=0)
+    total_play_time_sec: Mapped[int] = mapped_column(Integer, default=0)
+    __table_args__ = (UniqueConstraint("day", "game_id", "kiosk_id", name="uq_daily_summary_day_game_kiosk"),)
+
+
+class KioskThroughputMinute(Base):
+    """Per kiosk/minute counters flushed from services/throughput.py."""
+    __tablename__ = "kiosk_throughput_minutes"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kiosk_id: Mapped[int] = mapped_column(ForeignKey("kiosks.id", ondelete="CASCADE"))
+    minute: Mapped[datetime] = mapped_column(DateTime, index=True)
+    scans: Mapped[int] = mapped_column(Integer, default=0)
+    queued: Mapped[int] = mapped_column(Integer, default=0)
+    sessions_started: Mapped[int] = mapped_column(Integer, default=0)
+    sessions_ended: Mapped[int] = mapped_column(Integer, default=0)
+    players_started: Mapped[int] = mapped_column(Integer, default=0)
+    busy_sec: Mapped[float] = mapped_column(Float, default=0.0)
+    wait_sum_sec: Mapped[float] = mapped_column(Float, default=0.0)
+    wait_hist: Mapped[list] = mapped_column(JSON, default=list)  # counts per throughput.WAIT_BOUNDS bucket
+    __table_args__ = (UniqueConstraint("kiosk_id", "minute", name="uq_throughput_kiosk_minute"),)
+
+
+class GameMetricDef(Base):
+    """Registry entry for a per-player metric a game reports in SessionPlayer.metrics."""
+    __tablename__ = "game_metric_defs"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    game_id: Mapped[int] = mapped_column(ForeignKey("games.id", ondelete="CASCADE"))
+    name: Mapped[str] = mapped_column(String)
+    kind: Mapped[str] = mapped_column(String, default="float")  # int|float
+    unit: Mapped[str] = mapped_column(String, nullable=True)
+    indexed: Mapped[bool] = mapped_column(Boolean, default=True)  # extract into session_player_metrics
+    __table_args__ = (UniqueConstraint("game_id", "name", name="uq_metric_def_game_name"),)
+
+class SessionPlayerMetric(Base):
+    """One numeric metric value extracted from SessionPlayer.metrics at ingest."""
+    __tablename__ = "session_player_metrics"
+    id: Mapped[int] = mapped_column(BigId, primary_key=True)
+    session_player_id: Mapped[int] = mapped_column(BigId, ForeignKey("session_players.id", ondelete="CASCADE"), index=True)
+    game_id: Mapped[int] = mapped_column(ForeignKey("games.id"))
+    metric: Mapped[str] = mapped_column(String)
+    value: Mapped[float] = mapped_column(Float)
+    __table_args__ = (Index("ix_session_player_metrics_game_metric", "game_id", "metric"),)
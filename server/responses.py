@@ -0,0 +1,39 @@
+"""
+Fast JSON for the hot read endpoints.
+
+Routes that return FastJSONResponse build plain dicts once and skip FastAPI's
+response_model validation and jsonable_encoder pass (response_model is still
+declared for the OpenAPI schema). orjson is used when it is installed; without
+it, the stdlib encoder produces the same compact JSON as JSONResponse.
+Datetimes should already be ISO strings so both encoders give identical output.
+"""
+import json
+import os
+from functools import lru_cache
+from typing import Any, Optional
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=str)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+@lru_cache(maxsize=4096)
+def avatar_url(avatar_path: Optional[str]) -> Optional[str]:
+    """/static URL for a stored avatar path (players share a small pool, so this is nearly always a cache hit)."""
+    return f"/static/avatars/{os.path.basename(avatar_path)}" if avatar_path else None
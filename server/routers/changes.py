@@ -0,0 +1,23 @@
+
+from fastapi import APIRouter, Depends
+from ..security import verify_admin
+from ..services import outbox
+from ..settings import settings
+
+router = APIRouter(prefix="/changes", tags=["changes"], dependencies=[Depends(verify_admin)])
+
+@router.get("")
+async def list_changes(after: int = 0, limit: int = 100, wait: float = 0):
+    """
+    Outbox change feed, oldest first: events with id > `after`.
+    Pass back `next_after` to continue. With wait=N (seconds, up to
+    CHANGES_MAX_WAIT_SEC) an empty result is held open until an event arrives.
+    """
+    limit = max(1, min(int(limit), 1000))
+    wait = max(0.0, min(float(wait), settings.changes_max_wait_sec))
+    events = await outbox.changes(after, limit, wait)
+    return {
+        "events": events,
+        "next_after": events[-1]["id"] if events else after,
+        "has_more": len(events) == limit,
+    }
@@ -0,0 +1,35 @@
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from datetime import datetime
+from typing import Optional
+from ..security import verify_admin
+from ..services import export
+
+router = APIRouter(prefix="/exports", tags=["exports"], dependencies=[Depends(verify_admin)])
+
+@router.get("/sessions")
+def export_sessions(
+    format: str = "csv",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    game_id: Optional[str] = None,
+    chunk_size: int = 1000,
+):
+    """
+    Stream every session player joined with its session, game, kiosk and mode.
+    Filters: started_at in [start, end), game_id. Formats: csv, ndjson, parquet.
+    """
+    fmt = format.lower()
+    if fmt not in export.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be csv, ndjson or parquet")
+    if fmt == "parquet" and not export.parquet_available():
+        raise HTTPException(status_code=400, detail="Parquet export requires pyarrow on the server")
+    chunk_size = max(100, min(int(chunk_size), 10000))
+    rows = export.iter_export_rows(start=start, end=end, game_id=game_id, chunk_size=chunk_size)
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    return StreamingResponse(
+        export.iter_export(fmt, rows, chunk_size),
+        media_type=export.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="sessions-{stamp}.{fmt}"'},
+    )
@@ -1,11 +1,19 @@
 
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
+from typing import Optional, List
+from datetime import datetime
+import re
 from ..deps import get_db
 from .. import models
-from ..schemas import GameCreate
+from ..schemas import GameCreate, GameMetricDefIn
 from ..security import verify_game_key
+from ..settings import settings
 from ..services.queue_manager import hub
+from ..services import retention
+from ..services.balancer import balancer
+from ..services import metrics as metric_store
+from ..shards import merge_sorted, shards
 
 router = APIRouter(prefix="/games", tags=["games"])
 
@@ -13,13 +21,18 @@ router = APIRouter(prefix="/games", tags=["games"])
 def create_game(data: GameCreate, db: Session = Depends(get_db)):
     if db.query(models.Game).filter_by(game_id=data.game_id).first():
         raise HTTPException(status_code=400, detail="Game exists")
-    g = models.Game(game_id=data.game_id, name=data.name)
+    g = models.Game(
+        game_id=data.game_id, name=data.name,
+        max_session_sec=data.max_session_sec, session_capacity=data.session_capacity,
+    )
     db.add(g); db.commit()
+    balancer.sync(db)
     return {"ok": True}
 
 @router.post("/ready")
 async def game_ready(game_id: str, kiosk_id: str, request: Request, db: Session = Depends(get_db)):
     verify_game_key(request, game_id)
+    shards.route(db, kiosk_id=kiosk_id)
     kiosk = db.query(models.Kiosk).filter_by(kiosk_id=kiosk_id).first()
     game = db.query(models.Game).filter_by(game_id=game_id).first()
     if not kiosk or not game or kiosk.game_id != game.id:
@@ -29,20 +42,53 @@ async def game_ready(game_id: str, kiosk_id: str, request: Request, db: Session
     return {"kiosk_id": kiosk_id, "queue_count": q_count}
 
 
-@router.get("/{game_id}/history")
-def game_history(game_id: str, limit: int = 20, db: Session = Depends(get_db)):
-    """
-    Return recent sessions and per-player scores for a given game_id.
-    Intended for use by the admin UI.
-    """
+@router.get("/{game_id}/balance")
+def game_balance(game_id: str, db: Session = Depends(get_db)):
+    """Per-kiosk queue length, running state and expected wait, as the balancer sees them."""
     game = db.query(models.Game).filter_by(game_id=game_id).first()
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
+    balancer.ensure_loaded(db)
+    return {"game_id": game_id, "mode": settings.balance_mode, "kiosks": balancer.game_status(game.id)}
 
-    limit = max(1, min(int(limit), 100))
+
+def _validate_month(month: str):
+    if not re.fullmatch(r"\d{4}-\d{2}", month):
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+
+
+def _archived_game_history(game_id: str, month: str, limit: int, db: Session):
+    _validate_month(month)
+    try:
+        records = [r for r in retention.read_archive_month(month) if r["game_id"] == game_id]
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    records.sort(key=lambda r: r["started_at"] or "", reverse=True)
+    records = records[:limit]
+    pids = {p["player_id"] for r in records for p in r["players"]}
+    names = dict(db.query(models.Player.id, models.Player.username).filter(models.Player.id.in_(pids)).all()) if pids else {}
+    out = []
+    for r in records:
+        out.append(
+            {
+                "session_id": r["session_id"],
+                "kiosk_id": r["kiosk_id"],
+                "started_at": r["started_at"],
+                "ended_at": r["ended_at"],
+                "status": r["status"],
+                "players": [
+                    {"player_id": p["player_id"], "username": names.get(p["player_id"]), "score": p["score"]}
+                    for p in r["players"]
+                ],
+            }
+        )
+    return {"game_id": game_id, "month": month, "archived": True, "sessions": out}
+
+
+def _recent_sessions(db: Session, game_pk: int, limit: int) -> List[dict]:
     sessions = (
         db.query(models.GameSession)
-        .filter_by(game_id=game.id)
+        .filter_by(game_id=game_pk)
         .order_by(models.GameSession.started_at.desc())
         .limit(limit)
         .all()
@@ -71,5 +117,114 @@ def game_history(game_id: str, limit: int = 20, db: Session = Depends(get_db)):
                 "players": players,
             }
         )
+    return out
 
+
+@router.get("/{game_id}/history")
+def game_history(game_id: str, limit: int = 20, month: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Return recent sessions and per-player scores for a given game_id.
+    Intended for use by the admin UI. Pass month=YYYY-MM to read sessions
+    that retention has moved to the archive.
+    """
+    game = db.query(models.Game).filter_by(game_id=game_id).first()
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+
+    limit = max(1, min(int(limit), 100))
+    if month:
+        return _archived_game_history(game_id, month, limit, db)
+    parts = shards.fan_out(_recent_sessions, game.id, limit, db=db)
+    out = merge_sorted(parts, key=lambda s: s["started_at"] or "", limit=limit)
     return {"game_id": game_id, "sessions": out}
+
+
+@router.get("/{game_id}/archive")
+def game_archive(game_id: str, db: Session = Depends(get_db)):
+    """
+    Archived months available for ?month= on the history endpoints, plus the
+    daily per-kiosk rollups kept for archived sessions.
+    """
+    game = db.query(models.Game).filter_by(game_id=game_id).first()
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+    rows = (
+        db.query(models.SessionDailySummary, models.Kiosk.kiosk_id)
+        .outerjoin(models.Kiosk, models.SessionDailySummary.kiosk_id == models.Kiosk.id)
+        .filter(models.SessionDailySummary.game_id == game.id)
+        .order_by(models.SessionDailySummary.day.desc())
+        .all()
+    )
+    daily = [
+        {
+            "day": r.day.isoformat(),
+            "kiosk_id": kiosk_id,
+            "sessions": r.sessions,
+            "player_slots": r.player_slots,
+            "total_score": r.total_score,
+            "max_score": r.max_score,
+            "total_play_time_sec": r.total_play_time_sec,
+        }
+        for r, kiosk_id in rows
+    ]
+    return {"game_id": game_id, "months": retention.archived_months(), "daily": daily}
+
+
+def _get_game(game_id: str, db: Session) -> models.Game:
+    game = db.query(models.Game).filter_by(game_id=game_id).first()
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+    return game
+
+
+def _metric_def_out(d: models.GameMetricDef):
+    return {"name": d.name, "kind": d.kind, "unit": d.unit, "indexed": d.indexed}
+
+
+@router.get("/{game_id}/metrics")
+def list_metric_defs(game_id: str, db: Session = Depends(get_db)):
+    """Metric schema registered for this game (declared or auto-registered at ingest)."""
+    game = _get_game(game_id, db)
+    defs = db.query(models.GameMetricDef).filter_by(game_id=game.id).order_by(models.GameMetricDef.name).all()
+    return {"game_id": game_id, "metrics": [_metric_def_out(d) for d in defs]}
+
+
+@router.put("/{game_id}/metrics")
+def upsert_metric_defs(game_id: str, data: List[GameMetricDefIn], request: Request, db: Session = Depends(get_db)):
+    """
+    Declare or update metric definitions. Only numeric kinds are indexed;
+    changing a def affects sessions ingested from now on.
+    """
+    verify_game_key(request, game_id)
+    game = _get_game(game_id, db)
+    defs = metric_store.load_defs(db, game.id)
+    for item in data:
+        if item.kind not in metric_store.METRIC_KINDS:
+            raise HTTPException(status_code=400, detail=f"kind must be one of {sorted(metric_store.METRIC_KINDS)}")
+        d = defs.get(item.name)
+        if d is None:
+            d = models.GameMetricDef(game_id=game.id, name=item.name)
+            db.add(d)
+            defs[item.name] = d
+        d.kind, d.unit, d.indexed = item.kind, item.unit, item.indexed
+    db.commit()
+    return {"game_id": game_id, "metrics": [_metric_def_out(d) for d in defs.values()]}
+
+
+@router.get("/{game_id}/metrics/stats")
+def metric_stats(
+    game_id: str,
+    metric: str,
+    mode: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    by_mode: bool = False,
+    db: Session = Depends(get_db),
+):
+    """
+    Aggregate one per-player metric in SQL, e.g.
+    /games/laser_tag/metrics/stats?metric=shots&mode=team
+    """
+    game = _get_game(game_id, db)
+    rows = metric_store.metric_stats(db, game.id, metric, mode=mode, start=start, end=end, by_mode=by_mode)
+    return {"game_id": game_id, "metric": metric, "stats": rows}
@@ -1,26 +1,43 @@
 
 from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from ..deps import get_db
+from ..deps import get_db, get_kiosk_db
 from .. import models
-from ..schemas import KioskCreate, KioskUpdate, QueueLeaveIn
-from ..security import verify_kiosk_key
+from ..responses import FastJSONResponse, avatar_url
+from ..schemas import KioskCreate, KioskUpdate, QueueLeaveIn, QueueMoveIn
+from ..security import has_kiosk_key, verify_kiosk_key
+from ..services import outbox
+from ..services.balancer import balancer
+from ..services.encryption import dec_many
+from ..services.executors import on_pool
+from ..services.live_scores import live_scores
+from ..services.rate_limit import ANONYMOUS, limiter
+from ..services.throughput import counters
 from ..services.queue_manager import hub
+from ..shards import shards
 from datetime import datetime
-import os
 
 router = APIRouter(prefix="/kiosks", tags=["kiosks"])
 
+
+def _check_venue(venue):
+    if venue is not None and venue not in shards.venues:
+        raise HTTPException(status_code=400, detail="Unknown venue")
+
 @router.post("")
+@on_pool("io")
 def create_kiosk(data: KioskCreate, db: Session = Depends(get_db)):
     game = db.query(models.Game).filter_by(game_id=data.game_id).first()
     if not game:
         raise HTTPException(status_code=400, detail="Unknown game_id")
     if db.query(models.Kiosk).filter_by(kiosk_id=data.kiosk_id).first():
         raise HTTPException(status_code=400, detail="Kiosk exists")
+    _check_venue(data.venue)
     k = models.Kiosk(
         kiosk_id=data.kiosk_id,
         location=data.location,
+        venue=data.venue,
         game_id=game.id,
         api_key_hash=None,
         modes=data.modes or {"list": ["default"]},
@@ -29,17 +46,33 @@ def create_kiosk(data: KioskCreate, db: Session = Depends(get_db)):
     )
     db.add(k)
     db.commit()
+    shards.forget()
+    balancer.sync(db)
     return {"ok": True}
 
 @router.post("/{kiosk_id}/config")
+@on_pool("io")
 def update_kiosk_config(kiosk_id: str, data: KioskUpdate, db: Session = Depends(get_db)):
     """
     Lightweight config update for dev tooling: supports updating
-    location, modes JSON, and objectives for an existing kiosk.
+    location, venue, modes JSON, and objectives for an existing kiosk.
+    A kiosk can only change venue while its queue is empty and no session
+    is running there.
     """
     kiosk = db.query(models.Kiosk).filter_by(kiosk_id=kiosk_id).first()
     if not kiosk:
         raise HTTPException(status_code=404, detail="Kiosk not found")
+    moved = "venue" in data.model_fields_set and data.venue != kiosk.venue
+    if moved:
+        _check_venue(data.venue)
+        with shards.session(kiosk.venue) as vdb:
+            busy = (
+                vdb.query(models.QueueEntry.id).filter_by(kiosk_id=kiosk.id).first()
+                or vdb.query(models.GameSession.id).filter_by(kiosk_id=kiosk.id, status="running").first()
+            )
+        if busy:
+            raise HTTPException(status_code=409, detail="Reset the kiosk before moving it to another venue")
+        kiosk.venue = data.venue
     if data.location is not None:
         kiosk.location = data.location
     if data.modes is not None:
@@ -49,9 +82,13 @@ def update_kiosk_config(kiosk_id: str, data: KioskUpdate, db: Session = Depends(
     if data.traits is not None:
         kiosk.traits = data.traits
     db.commit()
+    if moved:
+        shards.forget()
+        balancer.sync(db)
     return {"ok": True}
 
 @router.get("/{kiosk_id}")
+@on_pool("hot")
 def get_kiosk(kiosk_id: str, db: Session = Depends(get_db)):
     kiosk = db.query(models.Kiosk).filter_by(kiosk_id=kiosk_id).first()
     if not kiosk:
@@ -60,6 +97,7 @@ def get_kiosk(kiosk_id: str, db: Session = Depends(get_db)):
     return {
         "kiosk_id": kiosk.kiosk_id,
         "location": kiosk.location,
+        "venue": kiosk.venue,
         "game_id": game.game_id if game else None,
         "game_name": game.name if game else None,
         "modes": kiosk.modes or {},
@@ -69,33 +107,32 @@ def get_kiosk(kiosk_id: str, db: Session = Depends(get_db)):
 
 
 @router.get("/{kiosk_id}/queue")
-def get_queue(kiosk_id: str, db: Session = Depends(get_db)):
-    kiosk = db.query(models.Kiosk).filter_by(kiosk_id=kiosk_id).first()
-    if not kiosk:
+@on_pool("hot")
+def get_queue(kiosk_id: str, request: Request, db: Session = Depends(get_kiosk_db)):
+    # Only the kiosk itself draws on its bucket; anonymous readers (admin page, scripts)
+    # share one bucket, so they can't lock the kiosk out but still get 429s.
+    limiter.check("queue", kiosk_id if has_kiosk_key(request, kiosk_id) else ANONYMOUS)
+    kiosk_pk = db.execute(select(models.Kiosk.id).where(models.Kiosk.kiosk_id == kiosk_id)).scalar()
+    if kiosk_pk is None:
         raise HTTPException(status_code=404, detail="Kiosk not found")
-    q = (
-        db.query(models.QueueEntry, models.Player)
-        .join(models.Player, models.Player.id == models.QueueEntry.player_id)
-        .filter(models.QueueEntry.kiosk_id == kiosk.id)
-        .order_by(models.QueueEntry.created_at.asc())
-        .all()
-    )
-    items = []
-    from ..services.encryption import dec
-    for qe, p in q:
-        items.append({
-            "player": {
-                "id": p.id,
-                "email": dec(p.email_enc) if p.email_enc else None,
-                "name": p.name,
-                "username": p.username,
-                "avatar_url": f"/static/avatars/{os.path.basename(p.avatar_path)}" if p.avatar_path else None,
-            }
-        })
-    return {"kiosk_id": kiosk_id, "queue": items}
+    P, QE = models.Player, models.QueueEntry
+    rows = db.execute(
+        select(P.id, P.email_enc, P.name, P.username, P.avatar_path)
+        .join(QE, QE.player_id == P.id)
+        .where(QE.kiosk_id == kiosk_pk)
+        .order_by(QE.created_at.asc())
+    ).all()
+    emails = dec_many([r.email_enc for r in rows])
+    items = [
+        {"player": {"id": r.id, "email": email, "name": r.name, "username": r.username, "avatar_url": avatar_url(r.avatar_path)}}
+        for r, email in zip(rows, emails)
+    ]
+    return FastJSONResponse({"kiosk_id": kiosk_id, "queue": items})
 
 @router.get("/{kiosk_id}/status")
-def kiosk_status(kiosk_id: str, db: Session = Depends(get_db)):
+@on_pool("hot")
+def kiosk_status(kiosk_id: str, request: Request, db: Session = Depends(get_kiosk_db)):
+    limiter.check("queue", kiosk_id if has_kiosk_key(request, kiosk_id) else ANONYMOUS)
     kiosk = db.query(models.Kiosk).filter_by(kiosk_id=kiosk_id).first()
     if not kiosk:
         raise HTTPException(status_code=404, detail="Kiosk not found")
@@ -114,12 +151,13 @@ def kiosk_status(kiosk_id: str, db: Session = Depends(get_db)):
 
 
 @router.post("/{kiosk_id}/queue/dev_add")
-async def dev_add_to_queue(kiosk_id: str, request: Request, db: Session = Depends(get_db)):
+async def dev_add_to_queue(kiosk_id: str, request: Request, db: Session = Depends(get_kiosk_db)):
     """
     Convenience endpoint to enqueue a development/test player for this kiosk.
     Protected by the kiosk API key so it can be triggered from the kiosk UI only.
     """
     verify_kiosk_key(request, kiosk_id)
+    limiter.check("queue", kiosk_id)
 
     kiosk = db.query(models.Kiosk).filter_by(kiosk_id=kiosk_id).first()
     if not kiosk:
@@ -146,6 +184,7 @@ async def dev_add_to_queue(kiosk_id: str, request: Request, db: Session = Depend
         if not exists:
             qe = models.QueueEntry(kiosk_id=kiosk.id, player_id=candidate.id)
             db.add(qe)
+            outbox.emit(db, "queue.joined", {"kiosk_id": kiosk_id, "player_id": candidate.id})
             player = candidate
             break
 
@@ -155,17 +194,19 @@ async def dev_add_to_queue(kiosk_id: str, request: Request, db: Session = Depend
         return {"ok": False, "detail": "All dev players already queued."}
 
     db.commit()
+    balancer.queued(kiosk.id)
     await hub.broadcast("kiosk", kiosk_id, {"type": "queue_update"})
     return {"ok": True, "player_id": player.id}
 
 
 @router.post("/{kiosk_id}/queue/remove")
-async def remove_from_queue(kiosk_id: str, data: QueueLeaveIn, request: Request, db: Session = Depends(get_db)):
+async def remove_from_queue(kiosk_id: str, data: QueueLeaveIn, request: Request, db: Session = Depends(get_kiosk_db)):
     """
     Allow a queued player to leave the line from the kiosk UI.
     Protected by the kiosk API key.
     """
     verify_kiosk_key(request, kiosk_id)
+    limiter.check("queue", kiosk_id)
 
     kiosk = db.query(models.Kiosk).filter_by(kiosk_id=kiosk_id).first()
     if not kiosk:
@@ -179,12 +220,53 @@ async def remove_from_queue(kiosk_id: str, data: QueueLeaveIn, request: Request,
         return {"ok": False, "detail": "Player not in queue."}
 
     db.delete(qe)
+    outbox.emit(db, "queue.left", {"kiosk_id": kiosk_id, "player_id": data.player_id})
     db.commit()
+    limiter.forget_scans(kiosk_id)
+    balancer.queued(kiosk.id, -1)
 
     await hub.broadcast("kiosk", kiosk_id, {"type": "queue_update"})
     return {"ok": True}
 
 
+@router.post("/{kiosk_id}/queue/move")
+async def move_in_queue(kiosk_id: str, data: QueueMoveIn, request: Request, db: Session = Depends(get_kiosk_db)):
+    """
+    Move a queued player to another kiosk of the same game (accepting a
+    balance_offer). The player keeps their original queue time.
+    Protected by the source kiosk's API key.
+    """
+    verify_kiosk_key(request, kiosk_id)
+    limiter.check("queue", kiosk_id)
+
+    kiosk = db.query(models.Kiosk).filter_by(kiosk_id=kiosk_id).first()
+    target = db.query(models.Kiosk).filter_by(kiosk_id=data.to_kiosk_id).first()
+    if not kiosk or not target:
+        raise HTTPException(status_code=404, detail="Kiosk not found")
+    if target.game_id != kiosk.game_id or target.id == kiosk.id or target.venue != kiosk.venue:
+        raise HTTPException(status_code=400, detail="Target kiosk must be another kiosk of the same game and venue")
+
+    qe = db.query(models.QueueEntry).filter_by(kiosk_id=kiosk.id, player_id=data.player_id).first()
+    if not qe:
+        return {"ok": False, "detail": "Player not in queue."}
+    if db.query(models.QueueEntry.id).filter_by(kiosk_id=target.id, player_id=data.player_id).first():
+        db.delete(qe)
+    else:
+        qe.kiosk_id = target.id
+    outbox.emit(db, "queue.moved", {"player_id": data.player_id, "from_kiosk_id": kiosk_id, "to_kiosk_id": target.kiosk_id})
+    db.commit()
+    limiter.forget_scans(kiosk_id)
+    limiter.forget_scans(target.kiosk_id)
+    balancer.queued(kiosk.id, -1)
+    balancer.queued(target.id)
+
+    msg = {"type": "queue_moved", "player_id": data.player_id, "from_kiosk_id": kiosk_id, "to_kiosk_id": target.kiosk_id}
+    for kid in (kiosk_id, target.kiosk_id):
+        await hub.broadcast("kiosk", kid, {"type": "queue_update"})
+        await hub.broadcast("kiosk", kid, msg)
+    return {"ok": True, "kiosk_id": target.kiosk_id}
+
+
 def _clear_queue_and_end_sessions(kiosk: models.Kiosk, db: Session):
     """
     Helper to clear queue entries and mark any running sessions as ended.
@@ -194,20 +276,46 @@ def _clear_queue_and_end_sessions(kiosk: models.Kiosk, db: Session):
     cleared = len(q_items)
     for qe in q_items:
         db.delete(qe)
+    if q_items:
+        outbox.emit(db, "queue.cleared", {"kiosk_id": kiosk.kiosk_id, "player_ids": [qe.player_id for qe in q_items]})
 
     active_sessions = db.query(models.GameSession).filter_by(kiosk_id=kiosk.id, status="running").all()
-    ended_ids = []
+    ended = []
     for session in active_sessions:
         session.status = "ended"
         session.ended_at = datetime.utcnow()
-        ended_ids.append(session.id)
+        outbox.emit(db, "session.cancelled", {"session_id": session.id, "kiosk_id": kiosk.kiosk_id, "reason": "reset"})
+        ended.append((session.id, session.started_at, session.ended_at))
 
     db.commit()
+    # Only once committed, so in-memory counts never include a reset that rolled back.
+    for session_id, started_at, ended_at in ended:
+        counters.session_ended(kiosk.id, started_at, ended_at)
+        balancer.session_ended(kiosk.id, started_at, ended_at, completed=False)
+        live_scores.end(session_id)
+    ended_ids = [session_id for session_id, _, _ in ended]
+    limiter.forget_scans(kiosk.kiosk_id)
+    balancer.queue_cleared(kiosk.id)
     return cleared, ended_ids
 
 
+async def _broadcast_reset(kiosk: models.Kiosk, ended_ids, db: Session):
+    """
+    Tell kiosk and game clients that a kiosk was reset. queue_update and
+    admin_reset are coalesced by the hub; session_ended is sent as-is.
+    """
+    game = db.get(models.Game, kiosk.game_id)
+    await hub.broadcast("kiosk", kiosk.kiosk_id, {"type": "queue_update"})
+    for sid in ended_ids:
+        await hub.broadcast("kiosk", kiosk.kiosk_id, {"type": "session_ended", "session_id": sid})
+        if game:
+            await hub.broadcast("game", game.game_id, {"type": "session_ended", "session_id": sid})
+    if game:
+        await hub.broadcast("game", game.game_id, {"type": "admin_reset", "kiosk_id": kiosk.kiosk_id})
+
+
 @router.post("/{kiosk_id}/queue/reset")
-async def reset_queue(kiosk_id: str, db: Session = Depends(get_db)):
+async def reset_queue(kiosk_id: str, db: Session = Depends(get_kiosk_db)):
     """
     Clear the entire queue for a kiosk and forcibly end any running session.
     Notifies kiosk and game clients so UIs can return to their idle screens.
@@ -217,21 +325,13 @@ async def reset_queue(kiosk_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Kiosk not found")
 
     cleared, ended_ids = _clear_queue_and_end_sessions(kiosk, db)
-
-    await hub.broadcast("kiosk", kiosk_id, {"type": "queue_update"})
-    game = db.get(models.Game, kiosk.game_id)
-    for sid in ended_ids:
-        await hub.broadcast("kiosk", kiosk_id, {"type": "session_ended", "session_id": sid})
-        if game:
-            await hub.broadcast("game", game.game_id, {"type": "session_ended", "session_id": sid})
-    if game:
-        await hub.broadcast("game", game.game_id, {"type": "admin_reset", "kiosk_id": kiosk_id})
+    await _broadcast_reset(kiosk, ended_ids, db)
 
     return {"ok": True, "cleared": cleared, "ended_sessions": len(ended_ids)}
 
 
 @router.post("/{kiosk_id}/reset")
-async def reset_kiosk(kiosk_id: str, db: Session = Depends(get_db)):
+async def reset_kiosk(kiosk_id: str, db: Session = Depends(get_kiosk_db)):
     """
     Clear queue and forcibly end any running session for this kiosk.
     Broadcasts session_ended so game/kiosk listeners can clean up.
@@ -243,20 +343,13 @@ async def reset_kiosk(kiosk_id: str, db: Session = Depends(get_db)):
     cleared, ended_ids = _clear_queue_and_end_sessions(kiosk, db)
 
     # Notify kiosk/game clients
-    await hub.broadcast("kiosk", kiosk_id, {"type": "queue_update"})
-    game = db.get(models.Game, kiosk.game_id)
-    for sid in ended_ids:
-        await hub.broadcast("kiosk", kiosk_id, {"type": "session_ended", "session_id": sid})
-        if game:
-            await hub.broadcast("game", game.game_id, {"type": "session_ended", "session_id": sid})
-    if game:
-        await hub.broadcast("game", game.game_id, {"type": "admin_reset", "kiosk_id": kiosk_id})
+    await _broadcast_reset(kiosk, ended_ids, db)
 
     return {"ok": True, "cleared": cleared, "ended_sessions": len(ended_ids)}
 
 
 @router.delete("/{kiosk_id}")
-async def delete_kiosk(kiosk_id: str, db: Session = Depends(get_db)):
+async def delete_kiosk(kiosk_id: str, db: Session = Depends(get_kiosk_db)):
     """
     Development helper to remove a kiosk row entirely.
     Clears its queue and ends any running sessions, then deletes the kiosk.
@@ -269,15 +362,10 @@ async def delete_kiosk(kiosk_id: str, db: Session = Depends(get_db)):
     cleared, ended_ids = _clear_queue_and_end_sessions(kiosk, db)
 
     # Notify kiosk/game clients about the reset before deletion
-    await hub.broadcast("kiosk", kiosk_id, {"type": "queue_update"})
-    game = db.get(models.Game, kiosk.game_id)
-    for sid in ended_ids:
-        await hub.broadcast("kiosk", kiosk_id, {"type": "session_ended", "session_id": sid})
-        if game:
-            await hub.broadcast("game", game.game_id, {"type": "session_ended", "session_id": sid})
-    if game:
-        await hub.broadcast("game", game.game_id, {"type": "admin_reset", "kiosk_id": kiosk_id})
+    await _broadcast_reset(kiosk, ended_ids, db)
 
     db.delete(kiosk)
     db.commit()
+    shards.forget()
+    balancer.sync()
     return {"ok": True, "cleared": cleared, "ended_sessions": len(ended_ids)}
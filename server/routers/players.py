@@ -1,18 +1,33 @@
 
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from pydantic import ValidationError
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
-from typing import Optional, List, Dict, Any
-import os, uuid, shutil, random, re
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Set
+import os, uuid, shutil, random, re, csv, io, json
 
+from ..database import SessionLocal
 from ..deps import get_db
 from .. import models
-from ..schemas import PlayerCreate, PlayerOut, PlayerUpdate
-from ..services.encryption import enc, dec
+from ..responses import FastJSONResponse, avatar_url
+from ..schemas import PlayerCreate, PlayerOut, PlayerUpdate, PlayerSearchOut, PlayerBulkIn
+from ..security import verify_admin
+from ..services.encryption import enc, dec, dec_many, enc_many, email_index
+from ..services.executors import on_pool
+from ..services import jobs, outbox, player_search, retention
+from ..shards import merge_sorted, shards
 
 router = APIRouter(prefix="/players", tags=["players"])
 
 AVATAR_DIR = os.path.join(os.path.dirname(__file__), "..", "static", "avatars")
-os.makedirs(AVATAR_DIR, exist_ok=True)
+# Uploads wait here (outside /static) until the avatar.store job moves them into AVATAR_DIR.
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "..", "uploads")
+
+def ensure_avatar_dir():
+    """Create the avatar directories; called from the app lifespan, not at import."""
+    os.makedirs(AVATAR_DIR, exist_ok=True)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 ADJECTIVES = [
     "brave", "clever", "curious", "swift", "bright",
@@ -38,7 +53,7 @@ def _validate_display_name(name: Optional[str]):
     """
     if not name:
         return
-    if re.search(r"[^A-Za-z\\s]", name):
+    if re.search(r"[^A-Za-z\s]", name):
         raise HTTPException(
             status_code=400,
             detail="Name can only include letters and spaces.",
@@ -78,31 +93,222 @@ def _generate_username(db: Session) -> str:
     if not db.query(models.Player).filter(models.Player.username == candidate).first():
       return candidate
 
+_IN_CHUNK = 500
+ENROLL_FIELDS = ("name", "username", "email", "rfid_uid")
+
+
+def _existing(db: Session, column, values) -> Set[str]:
+  """Which of `values` already exist in `column` (chunked IN queries)."""
+  values = list(values)
+  found: Set[str] = set()
+  for i in range(0, len(values), _IN_CHUNK):
+    found.update(v for (v,) in db.query(column).filter(column.in_(values[i:i + _IN_CHUNK])).all())
+  return found
+
+
+def _generate_usernames(db: Session, n: int, reserved: Set[str]) -> List[str]:
+  """
+  Bulk version of _generate_username: draw n unique names, then check them
+  against the DB in one pass per round instead of one query per name.
+  """
+  bases = [f"{a}.{b}" for a in ADJECTIVES for b in NOUNS]
+  random.shuffle(bases)
+  out: List[str] = []
+  taken = set(reserved)
+  while len(out) < n:
+    batch = []
+    while len(batch) < n - len(out):
+      candidate = bases.pop() if bases else f"{random.choice(ADJECTIVES)}.{random.choice(NOUNS)}{random.randint(1, 999)}"
+      if candidate not in taken:
+        taken.add(candidate)
+        batch.append(candidate)
+    in_db = _existing(db, models.Player.username, batch)
+    out.extend(u for u in batch if u not in in_db)
+  return out
+
+
+def parse_enrollment_file(content: bytes, fmt: str) -> List[Dict[str, Any]]:
+    """Rows from a CSV (header: name,username,email,rfid_uid; any subset) or a JSON list."""
+    text = content.decode("utf-8-sig")
+    if fmt == "json":
+        data = json.loads(text)
+        rows = data.get("players", []) if isinstance(data, dict) else data
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise ValueError("expected a list of player objects")
+    elif fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(text)))
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+    return [{k: (str(v).strip() or None) if v is not None else None for k, v in r.items() if k in ENROLL_FIELDS} for r in rows]
+
+
+def bulk_enroll(db: Session, rows: List[Dict[str, Any]], partial: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Validate every row up front, then create players and tags with two
+    batched INSERTs in one transaction. Rows are numbered from 1.
+
+    By default nothing is written if any row has an error; partial=True
+    writes the valid rows and reports the rest.
+    """
+    errors: List[Dict[str, Any]] = []
+    seen_usernames: Dict[str, int] = {}
+    seen_tags: Dict[str, int] = {}
+    seen_emails: Dict[str, int] = {}
+    clean: Dict[int, Dict[str, Any]] = {}
+
+    def fail(row_no: int, field: str, msg: str):
+        errors.append({"row": row_no, "field": field, "error": msg})
+        clean.pop(row_no, None)
+
+    for row_no, raw in enumerate(rows, start=1):
+        try:
+            data = PlayerCreate(**raw)
+        except ValidationError as e:
+            err = e.errors()[0]
+            fail(row_no, str(err["loc"][0]) if err["loc"] else "", err["msg"])
+            continue
+        name = data.name.strip() if data.name else None
+        try:
+            _validate_display_name(name)
+        except HTTPException as e:
+            fail(row_no, "name", e.detail)
+            continue
+        bidx = email_index(data.email)
+        clean[row_no] = {"name": name, "username": data.username, "email": data.email, "email_bidx": bidx, "rfid_uid": data.rfid_uid}
+        if data.username:
+            if data.username in seen_usernames:
+                fail(row_no, "username", f"Duplicate of row {seen_usernames[data.username]}")
+                continue
+            seen_usernames[data.username] = row_no
+        if data.rfid_uid:
+            if data.rfid_uid in seen_tags:
+                fail(row_no, "rfid_uid", f"Duplicate of row {seen_tags[data.rfid_uid]}")
+                continue
+            seen_tags[data.rfid_uid] = row_no
+        if bidx:
+            if bidx in seen_emails:
+                fail(row_no, "email", f"Duplicate of row {seen_emails[bidx]}")
+                continue
+            seen_emails[bidx] = row_no
+
+    for username in _existing(db, models.Player.username, seen_usernames):
+        fail(seen_usernames[username], "username", "Username already exists")
+    for uid in _existing(db, models.RFIDTag.uid, seen_tags):
+        fail(seen_tags[uid], "rfid_uid", "Tag already assigned")
+    for bidx in _existing(db, models.Player.email_bidx, seen_emails):
+        fail(seen_emails[bidx], "email", "Email already registered")
+
+    errors.sort(key=lambda e: e["row"])
+    report: Dict[str, Any] = {"rows": len(rows), "created": 0, "dry_run": dry_run, "errors": errors, "players": []}
+    if (errors and not partial) or dry_run or not clean:
+        return report
+
+    todo = [clean[k] for k in sorted(clean)]
+    generated = iter(_generate_usernames(db, sum(1 for r in todo if not r["username"]), set(seen_usernames)))
+    try:
+        avatars = [f for f in os.listdir(AVATAR_DIR) if not f.startswith('.') and f != "default.png"]
+    except FileNotFoundError:
+        avatars = []
+    player_rows = []
+    emails_enc = enc_many([r["email"] for r in todo])
+    for r, email_enc in zip(todo, emails_enc):
+        r["username"] = r["username"] or next(generated)
+        player_rows.append({
+            "email_enc": email_enc,
+            "email_bidx": r["email_bidx"],
+            "name": r["name"],
+            "username": r["username"],
+            "avatar_path": os.path.join(AVATAR_DIR, random.choice(avatars)) if avatars else None,
+        })
+    db.execute(insert(models.Player), player_rows)
+    # Read ids back by username (unique) rather than INSERT..RETURNING, which
+    # SQLAlchemy splices together batch by batch and gets slow for big files.
+    usernames = [r["username"] for r in todo]
+    ids: Dict[str, int] = {}
+    for i in range(0, len(usernames), _IN_CHUNK):
+        ids.update(db.query(models.Player.username, models.Player.id).filter(models.Player.username.in_(usernames[i:i + _IN_CHUNK])).all())
+    tag_rows = [{"uid": r["rfid_uid"], "player_id": ids[r["username"]]} for r in todo if r["rfid_uid"]]
+    if tag_rows:
+        db.execute(insert(models.RFIDTag), tag_rows)
+    outbox.emit_many(db, [("player.created", {"player_id": ids[r["username"]], "username": r["username"]}) for r in todo])
+    db.commit()
+    report["created"] = len(todo)
+    report["players"] = [
+        {"row": row_no, "id": ids[clean[row_no]["username"]], "username": clean[row_no]["username"], "rfid_uid": clean[row_no]["rfid_uid"]}
+        for row_no in sorted(clean)
+    ]
+    return report
+
+
 @router.get("", response_model=List[PlayerOut])
+@on_pool("io")
 def list_players(limit: int = 200, db: Session = Depends(get_db)):
     """
     Lightweight listing endpoint for admin/dev tooling.
-    Returns up to `limit` most-recent players.
+    Returns up to `limit` most-recent players (column projection, no ORM
+    entities; serialized once by FastJSONResponse).
     """
     limit = max(1, min(int(limit), 500))
-    players = (
-        db.query(models.Player)
-        .order_by(models.Player.created_at.desc())
+    P = models.Player
+    rows = db.execute(
+        select(P.id, P.email_enc, P.name, P.username, P.avatar_path)
+        .order_by(P.created_at.desc())
         .limit(limit)
-        .all()
-    )
-    out: List[PlayerOut] = []
-    for p in players:
-        out.append(
+    ).all()
+    emails = dec_many([r.email_enc for r in rows])
+    return FastJSONResponse([
+        {"id": r.id, "email": email, "name": r.name, "username": r.username, "avatar_url": avatar_url(r.avatar_path)}
+        for r, email in zip(rows, emails)
+    ])
+
+
+@router.get("/search", response_model=PlayerSearchOut)
+@on_pool("io")
+def search_players(q: str = "", limit: int = 50, cursor: Optional[str] = None, fuzzy: bool = False, db: Session = Depends(get_db)):
+    """
+    Search players by username or display name for the staff console.
+    Substring/prefix match by default; fuzzy=true ranks by trigram similarity.
+    Pass back `next_cursor` as `cursor` for the next page.
+    """
+    limit = max(1, min(int(limit), 200))
+    try:
+        ids, next_cursor = player_search.search_player_ids(db, q, limit, cursor=cursor, fuzzy=fuzzy)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    players = {p.id: p for p in db.query(models.Player).filter(models.Player.id.in_(ids)).all()} if ids else {}
+    items = []
+    for pid in ids:
+        p = players.get(pid)
+        if not p:
+            continue
+        items.append(
             PlayerOut(
                 id=p.id,
                 email=dec(p.email_enc) if p.email_enc else None,
                 name=p.name,
                 username=p.username,
-                avatar_url=f"/static/avatars/{os.path.basename(p.avatar_path)}" if p.avatar_path else None,
+                avatar_url=avatar_url(p.avatar_path),
             )
         )
-    return out
+    return PlayerSearchOut(items=items, next_cursor=next_cursor)
+
+
+@router.get("/lookup", response_model=PlayerOut)
+def lookup_player_by_email(email: str, db: Session = Depends(get_db)):
+    """
+    Find the player registered with this email (case/whitespace-insensitive).
+    One indexed query on the blind index; no rows are decrypted to search.
+    """
+    p = db.query(models.Player).filter(models.Player.email_bidx == email_index(email)).first()
+    if not p:
+        raise HTTPException(status_code=404, detail="Player not found")
+    return PlayerOut(
+        id=p.id,
+        email=dec(p.email_enc) if p.email_enc else None,
+        name=p.name,
+        username=p.username,
+        avatar_url=avatar_url(p.avatar_path),
+    )
 
 
 @router.get("/words")
@@ -209,16 +415,44 @@ def remove_blocked_word(word: str) -> Dict[str, Any]:
     return {"ok": True, "word": w}
 
 
-@router.post("", response_model=PlayerOut)
-def create_player(data: PlayerCreate, db: Session = Depends(get_db)):
+@router.post("/bulk")
+@on_pool("io")
+def bulk_enroll_players(data: PlayerBulkIn, partial: bool = False, dry_run: bool = False, db: Session = Depends(get_db), admin: bool = Depends(verify_admin)):
+    """
+    Pre-register a group (party, school visit) in one request:
+    {"players": [{"name": "Ada", "rfid_uid": "04A1..."}, ...]}.
+    Usernames and avatars are assigned when missing. Returns a per-row
+    error report; see bulk_enroll() for the partial/dry_run semantics.
+    """
+    return bulk_enroll(db, [{k: v for k, v in r.items() if k in ENROLL_FIELDS} for r in data.players], partial, dry_run)
+
+
+@router.post("/bulk/file")
+@on_pool("io")
+def bulk_enroll_file(file: UploadFile = File(...), partial: bool = False, dry_run: bool = False, db: Session = Depends(get_db), admin: bool = Depends(verify_admin)):
+    """Same as /players/bulk, from an uploaded .csv or .json file."""
+    fmt = "json" if (file.filename or "").lower().endswith(".json") else "csv"
+    try:
+        rows = parse_enrollment_file(file.file.read(), fmt)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse {fmt}: {e}")
+    return bulk_enroll(db, rows, partial, dry_run)
+
+
+def register_player(db: Session, data: PlayerCreate) -> models.Player:
+    """Create a player (and tag) and commit; raises HTTPException 400 on a conflict."""
     name = data.name.strip() if data.name else None
     _validate_display_name(name)
     username = data.username or _generate_username(db)
     if db.query(models.Player).filter(models.Player.username == username).first():
         raise HTTPException(status_code=400, detail="Username already exists")
+    email_bidx = email_index(data.email)
+    if email_bidx and db.query(models.Player.id).filter(models.Player.email_bidx == email_bidx).first():
+        raise HTTPException(status_code=400, detail="Email already registered")
     avatar_fname = _random_avatar_filename()
     p = models.Player(
         email_enc=enc(data.email) if data.email else None,
+        email_bidx=email_bidx,
         name=name,
         username=username,
         avatar_path=os.path.join(AVATAR_DIR, avatar_fname) if avatar_fname else None,
@@ -231,13 +465,21 @@ def create_player(data: PlayerCreate, db: Session = Depends(get_db)):
             raise HTTPException(status_code=400, detail="Tag already assigned")
         tag = existing or models.RFIDTag(uid=data.rfid_uid, player_id=p.id)
         db.add(tag)
+    outbox.emit(db, "player.created", {"player_id": p.id, "username": p.username})
     db.commit()
+    return p
+
+
+@router.post("", response_model=PlayerOut)
+@on_pool("io")
+def create_player(data: PlayerCreate, db: Session = Depends(get_db)):
+    p = register_player(db, data)
     return PlayerOut(
         id=p.id,
         email=dec(p.email_enc) if p.email_enc else None,
         name=p.name,
         username=p.username,
-        avatar_url=f"/static/avatars/{os.path.basename(p.avatar_path)}" if p.avatar_path else None,
+        avatar_url=avatar_url(p.avatar_path),
     )
 
 @router.get("/{player_id}", response_model=PlayerOut)
@@ -250,11 +492,12 @@ def get_player(player_id: int, db: Session = Depends(get_db)):
         email=dec(p.email_enc) if p.email_enc else None,
         name=p.name,
         username=p.username,
-        avatar_url=f"/static/avatars/{os.path.basename(p.avatar_path)}" if p.avatar_path else None,
+        avatar_url=avatar_url(p.avatar_path),
     )
 
 
 @router.patch("/{player_id}", response_model=PlayerOut)
+@on_pool("io")
 def update_player(player_id: int, data: PlayerUpdate, db: Session = Depends(get_db)):
     p = db.get(models.Player, player_id)
     if not p:
@@ -271,26 +514,32 @@ def update_player(player_id: int, data: PlayerUpdate, db: Session = Depends(get_
         if fname:
             p.avatar_path = os.path.join(AVATAR_DIR, fname)
 
+    outbox.emit(db, "player.updated", {"player_id": p.id, "username": p.username})
     db.commit()
     return PlayerOut(
         id=p.id,
         email=dec(p.email_enc) if p.email_enc else None,
         name=p.name,
         username=p.username,
-        avatar_url=f"/static/avatars/{os.path.basename(p.avatar_path)}" if p.avatar_path else None,
+        avatar_url=avatar_url(p.avatar_path),
     )
 
 @router.post("/{player_id}/avatar", response_model=PlayerOut)
+@on_pool("io")
 def upload_avatar(player_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """
+    Stage the upload and return; the avatar.store job moves it into place
+    and points the player at it (avatar_url is where it will be served).
+    """
     p = db.get(models.Player, player_id)
     if not p:
         raise HTTPException(status_code=404, detail="Player not found")
     ext = os.path.splitext(file.filename)[1].lower()
     fname = f"{uuid.uuid4().hex}{ext}"
-    dest = os.path.join(AVATAR_DIR, fname)
-    with open(dest, "wb") as f:
+    staged = os.path.join(UPLOAD_DIR, fname)
+    with open(staged, "wb") as f:
         shutil.copyfileobj(file.file, f)
-    p.avatar_path = dest
+    jobs.enqueue(db, "avatar.store", {"player_id": p.id, "fname": fname}, priority=jobs.PRIORITY_HIGH)
     db.commit()
     return PlayerOut(
         id=p.id,
@@ -302,69 +551,157 @@ def upload_avatar(player_id: int, file: UploadFile = File(...), db: Session = De
 
 
 @router.delete("/{player_id}")
+@on_pool("io")
 def delete_player(player_id: int, db: Session = Depends(get_db)):
     """
     Development helper to remove a player and related data.
-    Clears RFID tags, queue entries, and session player rows before deleting.
+    The deletes run in the player.delete job; this returns once it is queued.
     """
-    player = db.get(models.Player, player_id)
-    if not player:
+    if not db.query(models.Player.id).filter_by(id=player_id).first():
       raise HTTPException(status_code=404, detail="Player not found")
+    job = jobs.enqueue(db, "player.delete", {"player_id": player_id}, key=str(player_id))
+    db.commit()
+    return {"ok": True, "queued": True, "job_id": job.id}
 
-    # Clear queue entries for this player across kiosks
-    db.query(models.QueueEntry).filter_by(player_id=player.id).delete(synchronize_session=False)
 
-    # Clear per-session player records
-    db.query(models.SessionPlayer).filter_by(player_id=player.id).delete(synchronize_session=False)
+def _delete_player_rows(db: Session, player_id: int):
+    # Clear queue entries for this player across kiosks
+    db.query(models.QueueEntry).filter_by(player_id=player_id).delete(synchronize_session=False)
 
-    # RFID tags are configured with cascade delete via relationship
-    db.delete(player)
+    # Clear per-session player records and their extracted metric rows
+    sp_ids = db.query(models.SessionPlayer.id).filter_by(player_id=player_id)
+    db.query(models.SessionPlayerMetric).filter(models.SessionPlayerMetric.session_player_id.in_(sp_ids)).delete(synchronize_session=False)
+    db.query(models.SessionPlayer).filter_by(player_id=player_id).delete(synchronize_session=False)
     db.commit()
-    return {"ok": True}
+
+
+@jobs.handler("player.delete")
+def _delete_player_job(payload: Dict[str, Any]):
+    """Clears queue entries, session player rows and RFID tags, then the player."""
+    player_id = payload["player_id"]
+    with SessionLocal() as db:
+        player = db.get(models.Player, player_id)
+        if not player:
+            return
+
+        # Queue and session rows live in every venue's database; the player row
+        # goes last, so a retry after a partial run finds it and tries again.
+        shards.fan_out(_delete_player_rows, player_id)
+
+        # RFID tags are configured with cascade delete via relationship
+        db.delete(player)
+        outbox.emit(db, "player.deleted", {"player_id": player_id})
+        db.commit()
+
+
+@jobs.handler("avatar.store")
+def _store_avatar_job(payload: Dict[str, Any]):
+    """Move a staged upload into AVATAR_DIR and point the player at it. Safe to re-run."""
+    staged = os.path.join(UPLOAD_DIR, payload["fname"])
+    dest = os.path.join(AVATAR_DIR, payload["fname"])
+    with SessionLocal() as db:
+        p = db.get(models.Player, payload["player_id"])
+        if p is None:
+            if os.path.exists(staged):
+                os.remove(staged)
+            return
+        if os.path.exists(staged):
+            shutil.move(staged, dest)
+        elif not os.path.exists(dest):
+            raise jobs.JobFailed(f"staged upload {payload['fname']} is missing")
+        p.avatar_path = dest
+        outbox.emit(db, "player.updated", {"player_id": p.id, "username": p.username})
+        db.commit()
+
+
+def _archived_player_history(player_id: int, month: str, limit: int, db: Session) -> Dict[str, Any]:
+    if not re.fullmatch(r"\d{4}-\d{2}", month):
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+    games = {g.game_id: g.name for g in db.query(models.Game).all()}
+    locations = {k.kiosk_id: k.location for k in db.query(models.Kiosk).all()}
+    sessions: List[Dict[str, Any]] = []
+    try:
+        records = list(retention.read_archive_month(month))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    for r in records:
+        for p in r["players"]:
+            if p["player_id"] != player_id:
+                continue
+            metrics = p.get("metrics") or {}
+            sessions.append(
+                {
+                    "session_id": r["session_id"],
+                    "game_id": r["game_id"],
+                    "game_name": games.get(r["game_id"]),
+                    "kiosk_id": r["kiosk_id"],
+                    "location": locations.get(r["kiosk_id"]),
+                    "started_at": r["started_at"],
+                    "ended_at": r["ended_at"],
+                    "status": r["status"],
+                    "mode": r.get("mode") or (r.get("meta") or {}).get("mode") or metrics.get("kiosk_mode") or "default",
+                    "score": p["score"],
+                    "play_time_sec": p["play_time_sec"],
+                    "metrics": metrics,
+                }
+            )
+    sessions.sort(key=lambda x: x["started_at"] or "", reverse=True)
+    return {"player_id": player_id, "month": month, "archived": True, "sessions": sessions[:limit]}
+
+
+def _history_rows(db: Session, player_id: int, limit: int) -> List[Any]:
+    SP, GS, G, K = models.SessionPlayer, models.GameSession, models.Game, models.Kiosk
+    return db.execute(
+        select(
+            GS.id, GS.started_at, GS.ended_at, GS.status, GS.mode, GS.meta,
+            G.game_id, G.name.label("game_name"), K.kiosk_id, K.location,
+            SP.score, SP.play_time_sec, SP.metrics,
+        )
+        .join(GS, SP.session_id == GS.id)
+        .join(G, GS.game_id == G.id)
+        .join(K, GS.kiosk_id == K.id)
+        .where(SP.player_id == player_id)
+        .order_by(GS.started_at.desc())
+        .limit(limit)
+    ).all()
 
 
 @router.get("/{player_id}/history")
-def player_history(player_id: int, limit: int = 100, db: Session = Depends(get_db)) -> Dict[str, Any]:
+@on_pool("io")
+def player_history(player_id: int, limit: int = 100, month: Optional[str] = None, db: Session = Depends(get_db)) -> Dict[str, Any]:
     """
     Return recent game sessions for a given player, grouped by sessions.
     Intended for use by kiosk UIs when a player taps their profile.
+    Pass month=YYYY-MM to read sessions that retention has archived.
     """
-    player = db.get(models.Player, player_id)
-    if not player:
+    if db.execute(select(models.Player.id).where(models.Player.id == player_id)).first() is None:
         raise HTTPException(status_code=404, detail="Player not found")
 
     limit = max(1, min(int(limit), 200))
-    rows = (
-        db.query(models.SessionPlayer, models.GameSession, models.Game, models.Kiosk)
-        .join(models.GameSession, models.SessionPlayer.session_id == models.GameSession.id)
-        .join(models.Game, models.GameSession.game_id == models.Game.id)
-        .join(models.Kiosk, models.GameSession.kiosk_id == models.Kiosk.id)
-        .filter(models.SessionPlayer.player_id == player_id)
-        .order_by(models.GameSession.started_at.desc())
-        .limit(limit)
-        .all()
-    )
+    if month:
+        return _archived_player_history(player_id, month, limit, db)
+    parts = shards.fan_out(_history_rows, player_id, limit, db=db)
+    rows = merge_sorted(parts, key=lambda r: (r.started_at is not None, r.started_at or datetime.min), limit=limit)
 
     sessions: List[Dict[str, Any]] = []
-    for sp, sess, game, kiosk in rows:
-        sess_meta = sess.meta or {}
-        sp_metrics = sp.metrics or {}
-        # Prefer explicit session.meta["mode"]; fall back to per-player metrics.kiosk_mode.
-        mode = sess_meta.get("mode") or sp_metrics.get("kiosk_mode") or "default"
+    for r in rows:
+        sp_metrics = r.metrics or {}
+        # Prefer the session's mode; fall back to legacy meta / per-player metrics.kiosk_mode.
+        mode = r.mode or (r.meta or {}).get("mode") or sp_metrics.get("kiosk_mode") or "default"
         sessions.append(
             {
-                "session_id": sess.id,
-                "game_id": game.game_id if game else None,
-                "game_name": game.name if game else None,
-                "kiosk_id": kiosk.kiosk_id if kiosk else None,
-                "location": kiosk.location if kiosk else None,
-                "started_at": sess.started_at.isoformat() if sess.started_at else None,
-                "ended_at": sess.ended_at.isoformat() if sess.ended_at else None,
-                "status": sess.status,
+                "session_id": r.id,
+                "game_id": r.game_id,
+                "game_name": r.game_name,
+                "kiosk_id": r.kiosk_id,
+                "location": r.location,
+                "started_at": r.started_at.isoformat() if r.started_at else None,
+                "ended_at": r.ended_at.isoformat() if r.ended_at else None,
+                "status": r.status,
                 "mode": mode,
-                "score": sp.score,
-                "play_time_sec": sp.play_time_sec,
+                "score": r.score,
+                "play_time_sec": r.play_time_sec,
                 "metrics": sp_metrics,
             }
         )
-    return {"player_id": player_id, "sessions": sessions}
+    return FastJSONResponse({"player_id": player_id, "sessions": sessions})
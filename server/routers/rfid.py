@@ -1,31 +1,132 @@
 
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
+from datetime import datetime, timezone
 from ..deps import get_db
 from .. import models
-from ..schemas import RFIDScanIn
+from ..schemas import RFIDScanIn, RFIDBulkScanIn
+from ..services import outbox
+from ..services.balancer import balancer
 from ..services.queue_manager import hub
+from ..services.rate_limit import limiter
+from ..services.throughput import counters
 from ..security import verify_kiosk_key
+from ..settings import settings
+from ..shards import shards
 
 router = APIRouter(prefix="/rfid", tags=["rfid"])
 
 @router.post("/scan")
 async def scan(data: RFIDScanIn, request: Request, db: Session = Depends(get_db)):
     verify_kiosk_key(request, data.kiosk_id)
+    shards.route(db, kiosk_id=data.kiosk_id)
+    limiter.record_scan(data.kiosk_id)
+    cached = limiter.debounced_scan(data.kiosk_id, data.rfid_uid)
+    if cached:
+        return cached
+    limiter.check("scan", data.kiosk_id)
 
     tag = db.query(models.RFIDTag).filter_by(uid=data.rfid_uid).first()
     if not tag:
-        return {"known": False, "message": "Unknown tag. Please visit the Profile Kiosk."}
+        result = {"known": False, "message": "Unknown tag. Please visit the Profile Kiosk."}
+        limiter.remember_scan(data.kiosk_id, data.rfid_uid, result)
+        return result
 
     kiosk = db.query(models.Kiosk).filter_by(kiosk_id=data.kiosk_id).first()
     if not kiosk:
         raise HTTPException(status_code=400, detail="Unknown kiosk")
 
-    exists = db.query(models.QueueEntry).filter_by(kiosk_id=kiosk.id, player_id=tag.player_id).first()
-    if not exists:
-        qe = models.QueueEntry(kiosk_id=kiosk.id, player_id=tag.player_id)
+    # A player holds one place per game: a rescan at any bay of it, including the
+    # scanned one or a sibling they were routed to, returns where they already are.
+    bays = dict(db.query(models.Kiosk.id, models.Kiosk.kiosk_id).filter_by(game_id=kiosk.game_id, venue=kiosk.venue).all())
+    placed = (
+        db.query(models.QueueEntry.kiosk_id)
+        .filter(models.QueueEntry.kiosk_id.in_(bays), models.QueueEntry.player_id == tag.player_id)
+        .first()
+    )
+    counters.add(kiosk.id, "scans")
+    result = {"known": True, "player_id": tag.player_id}
+    decision = None
+    if placed is not None and placed[0] != kiosk.id:
+        result["queued_at"] = bays[placed[0]]
+    elif placed is None:
+        balancer.ensure_loaded(db)
+        decision = balancer.choose(kiosk.id)
+        target_pk, target_id = kiosk.id, data.kiosk_id
+        if decision and settings.balance_mode == "route":
+            target_pk, target_id = decision["to_kiosk_pk"], decision["to_kiosk_id"]
+        qe = models.QueueEntry(kiosk_id=target_pk, player_id=tag.player_id)
         db.add(qe)
+        event = {"kiosk_id": target_id, "player_id": tag.player_id}
+        if target_pk != kiosk.id:
+            event["routed_from"] = data.kiosk_id
+        outbox.emit(db, "queue.joined", event)
         db.commit()
+        counters.add(target_pk, "queued")
+        balancer.queued(target_pk)
+        if target_pk != kiosk.id:
+            result["routed_to"] = target_id
+        elif decision:
+            result["suggestion"] = {k: decision[k] for k in ("to_kiosk_id", "expected_wait_sec", "saves_sec")}
 
-    await hub.broadcast("kiosk", data.kiosk_id, {"type": "queue_update"})
-    return {"known": True, "player_id": tag.player_id}
+    limiter.remember_scan(data.kiosk_id, data.rfid_uid, result)
+    if "routed_to" in result:
+        await hub.broadcast("kiosk", result["routed_to"], {"type": "queue_update"})
+    else:
+        await hub.broadcast("kiosk", data.kiosk_id, {"type": "queue_update"})
+    if decision:
+        msg = {
+            "type": "queue_routed" if "routed_to" in result else "balance_offer",
+            "player_id": tag.player_id,
+            **{k: decision[k] for k in ("from_kiosk_id", "to_kiosk_id", "expected_wait_sec", "saves_sec")},
+        }
+        await hub.broadcast("kiosk", decision["from_kiosk_id"], msg)
+        await hub.broadcast("kiosk", decision["to_kiosk_id"], msg)
+    return result
+
+
+@router.post("/scan/bulk")
+async def bulk_scan(data: RFIDBulkScanIn, request: Request, db: Session = Depends(get_db)):
+    """
+    Deliver scans the kiosk agent buffered while the server was unreachable.
+    Scans are applied in order in one transaction (queue position follows the
+    original scan time) and trigger a single queue_update broadcast.
+    """
+    verify_kiosk_key(request, data.kiosk_id)
+    shards.route(db, kiosk_id=data.kiosk_id)
+    # One token per batch: the agent paces its own flushes, and a batch is one transaction.
+    limiter.check("scan", data.kiosk_id)
+    kiosk = db.query(models.Kiosk).filter_by(kiosk_id=data.kiosk_id).first()
+    if not kiosk:
+        raise HTTPException(status_code=400, detail="Unknown kiosk")
+
+    uids = {s.rfid_uid for s in data.scans}
+    tags = {t.uid: t for t in db.query(models.RFIDTag).filter(models.RFIDTag.uid.in_(uids)).all()}
+    queued = {pid for (pid,) in db.query(models.QueueEntry.player_id).filter_by(kiosk_id=kiosk.id).all()}
+
+    results = []
+    events = []
+    added = 0
+    for s in data.scans:
+        tag = tags.get(s.rfid_uid)
+        if not tag:
+            results.append({"rfid_uid": s.rfid_uid, "known": False})
+            continue
+        if tag.player_id not in queued:
+            scanned_at = s.scanned_at or datetime.utcnow()
+            if scanned_at.tzinfo is not None:
+                scanned_at = scanned_at.astimezone(timezone.utc).replace(tzinfo=None)
+            db.add(models.QueueEntry(kiosk_id=kiosk.id, player_id=tag.player_id, created_at=scanned_at))
+            events.append(("queue.joined", {"kiosk_id": data.kiosk_id, "player_id": tag.player_id, "queued_at": scanned_at.isoformat()}))
+            queued.add(tag.player_id)
+            added += 1
+        results.append({"rfid_uid": s.rfid_uid, "known": True, "player_id": tag.player_id})
+    outbox.emit_many(db, events)
+    db.commit()
+    counters.add(kiosk.id, "scans", len(data.scans))
+    counters.add(kiosk.id, "queued", added)
+    balancer.queued(kiosk.id, added)
+
+    if added:
+        await hub.broadcast("kiosk", data.kiosk_id, {"type": "queue_update"})
+    return {"accepted": len(data.scans), "queued": added, "results": results}
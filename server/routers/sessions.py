@@ -5,14 +5,22 @@ from datetime import datetime
 from ..deps import get_db
 from .. import models
 from ..schemas import SessionStartIn, SessionEndIn, SessionOut
+from ..services import outbox
+from ..services.balancer import balancer
+from ..services.live_scores import live_scores
 from ..services.queue_manager import hub
 from ..security import verify_kiosk_key, verify_game_key
+from ..shards import shards
+from ..services import metrics as metric_store
+from ..services.rate_limit import limiter
+from ..services.throughput import counters
 
 router = APIRouter(prefix="/sessions", tags=["sessions"])
 
 @router.post("/start", response_model=SessionOut)
 async def start_session(data: SessionStartIn, request: Request, db: Session = Depends(get_db)):
     verify_kiosk_key(request, data.kiosk_id)
+    shards.route(db, kiosk_id=data.kiosk_id)
     kiosk = db.query(models.Kiosk).filter_by(kiosk_id=data.kiosk_id).first()
     if not kiosk:
         raise HTTPException(status_code=400, detail="Unknown kiosk")
@@ -24,18 +32,35 @@ async def start_session(data: SessionStartIn, request: Request, db: Session = De
     if not q_items:
         raise HTTPException(status_code=400, detail="Queue is empty")
 
-    session = models.GameSession(kiosk_id=kiosk.id, game_id=kiosk.game_id, status="running", started_at=datetime.utcnow())
+    now = datetime.utcnow()
+    session = models.GameSession(kiosk_id=kiosk.id, game_id=kiosk.game_id, status="running", started_at=now)
     session.meta = {"mode": data.mode} if data.mode else {}
+    session.mode = data.mode
     db.add(session); db.flush()
+    waits = []
     for qi in q_items:
-        sp = models.SessionPlayer(session_id=session.id, player_id=qi.player_id)
+        sp = models.SessionPlayer(session_id=session.id, player_id=qi.player_id, queued_at=qi.created_at)
         db.add(sp)
         db.delete(qi)
+        if qi.created_at:
+            waits.append((now - qi.created_at).total_seconds())
+    game = db.get(models.Game, kiosk.game_id)
+    outbox.emit(db, "session.started", {
+        "session_id": session.id,
+        "kiosk_id": data.kiosk_id,
+        "game_id": game.game_id,
+        "mode": data.mode,
+        "player_ids": [qi.player_id for qi in q_items],
+        "started_at": now.isoformat(),
+    })
     db.commit()
+    counters.session_started(kiosk.id, waits)
+    balancer.session_started(kiosk.id, now)
+    # Queued players were consumed; a rescan right away should queue them again.
+    limiter.forget_scans(data.kiosk_id)
 
     players_payload = [{"player_id": sp.player_id} for sp in session.players]
     await hub.broadcast("kiosk", data.kiosk_id, {"type": "session_started", "session_id": session.id})
-    game = db.get(models.Game, kiosk.game_id)
     await hub.broadcast("game", game.game_id, {
         "type": "session_started",
         "session_id": session.id,
@@ -48,6 +73,7 @@ async def start_session(data: SessionStartIn, request: Request, db: Session = De
 
 @router.post("/end")
 async def end_session(data: SessionEndIn, request: Request, db: Session = Depends(get_db)):
+    shards.route(db, row_id=data.session_id)
     session = db.get(models.GameSession, data.session_id)
     if not session or session.status != "running":
         raise HTTPException(status_code=400, detail="Invalid session")
@@ -55,18 +81,83 @@ async def end_session(data: SessionEndIn, request: Request, db: Session = Depend
     verify_game_key(request, game.game_id)
 
     sp_map = {sp.player_id: sp for sp in session.players}
+    defs = metric_store.load_defs(db, session.game_id)
     for p in data.players:
         pid = int(p.get("player_id"))
         if pid in sp_map:
             sp_map[pid].score = int(p.get("score", 0))
             sp_map[pid].play_time_sec = int(p.get("play_time_sec", 0))
             sp_map[pid].metrics = p.get("metrics", {})
+            metric_store.extract_metrics(db, session.game_id, sp_map[pid], sp_map[pid].metrics, defs)
     session.status = "ended"
     session.ended_at = datetime.utcnow()
-    session.meta = data.game_metrics or {}
+    # meta keeps what start_session stored (mode); game-level results go in their own field.
+    session.game_metrics = data.game_metrics or {}
+    kiosk = db.get(models.Kiosk, session.kiosk_id)
+    outbox.emit(db, "session.ended", {
+        "session_id": session.id,
+        "kiosk_id": kiosk.kiosk_id,
+        "game_id": game.game_id,
+        "mode": session.mode,
+        "started_at": session.started_at.isoformat() if session.started_at else None,
+        "ended_at": session.ended_at.isoformat(),
+        "players": [{"player_id": sp.player_id, "score": sp.score, "play_time_sec": sp.play_time_sec} for sp in session.players],
+        "game_metrics": session.game_metrics,
+    })
+    session_id, kiosk_pk, started_at, ended_at = session.id, session.kiosk_id, session.started_at, session.ended_at
     db.commit()
+    # In-memory state changes only once committed, so an end that fails and is retried counts once.
+    live_scores.end(session_id)  # final results replace whatever the live feed reported
+    counters.session_ended(kiosk_pk, started_at, ended_at)
+    balancer.session_ended(kiosk_pk, started_at, ended_at)
 
-    kiosk = db.get(models.Kiosk, session.kiosk_id)
-    await hub.broadcast("kiosk", kiosk.kiosk_id, {"type": "session_ended", "session_id": session.id})
-    await hub.broadcast("game", game.game_id, {"type": "session_ended", "session_id": session.id})
+    await hub.broadcast("kiosk", kiosk.kiosk_id, {"type": "session_ended", "session_id": session_id})
+    await hub.broadcast("game", game.game_id, {"type": "session_ended", "session_id": session_id})
+    await _offer_move_to(kiosk, db)
     return {"ok": True}
+
+
+@router.get("/{session_id}/live")
+def live_state(session_id: int, db: Session = Depends(get_db)):
+    """Latest live scores for a session (kiosks call this after reconnecting)."""
+    state = live_scores.get(session_id)
+    if state is not None:
+        return {**state, "live": True}
+    shards.route(db, row_id=session_id)
+    session = db.get(models.GameSession, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    kiosk = db.get(models.Kiosk, session.kiosk_id)
+    return {
+        "session_id": session.id,
+        "kiosk_id": kiosk.kiosk_id if kiosk else None,
+        "progress": None,
+        "players": [
+            {"player_id": sp.player_id, "username": sp.player.username if sp.player else None, "score": sp.score, "progress": None}
+            for sp in session.players
+        ],
+        "live": False,
+    }
+
+
+async def _offer_move_to(kiosk: models.Kiosk, db: Session):
+    """A bay just freed up: offer the newest player of a busier sibling bay a move here."""
+    balancer.ensure_loaded(db)
+    decision = balancer.donor(kiosk.id)
+    if not decision:
+        return
+    qe = (
+        db.query(models.QueueEntry)
+        .filter_by(kiosk_id=decision["from_kiosk_pk"])
+        .order_by(models.QueueEntry.created_at.desc())
+        .first()
+    )
+    if not qe:
+        return
+    msg = {
+        "type": "balance_offer",
+        "player_id": qe.player_id,
+        **{k: decision[k] for k in ("from_kiosk_id", "to_kiosk_id", "expected_wait_sec", "saves_sec")},
+    }
+    await hub.broadcast("kiosk", decision["from_kiosk_id"], msg)
+    await hub.broadcast("kiosk", decision["to_kiosk_id"], msg)
@@ -1,25 +1,70 @@
 
+import json
+from typing import Optional
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from ..services.live_scores import live_scores
 from ..services.queue_manager import hub
+from ..settings import settings
 
 router = APIRouter()
 
-@router.websocket("/ws/kiosk/{kiosk_id}")
-async def ws_kiosk(ws: WebSocket, kiosk_id: str):
+async def _serve(ws: WebSocket, group: str, key: str, since: Optional[int], epoch: Optional[str], pong: bool, api_key: Optional[str] = None):
+    """
+    Accept, register and keep the socket alive until the client goes away
+    or the hub's heartbeat reaper closes it. Clients that pass ?pong=1 must
+    answer pings (any inbound frame counts as a pong) or they are evicted
+    when silent; without it only a failed send drops the socket.
+
+    On connect the client gets {"type": "hello", "epoch", "seq"}. If it passed
+    ?since=<seq>&epoch=<epoch>, the events it missed are replayed next, or
+    {"type": "resync"} is sent when they are no longer buffered. Live events
+    published meanwhile are held by the hub and follow the replay in order.
+
+    Game clients that authenticate (X-API-Key header or ?key=) may also push
+    {"type": "score", ...} frames; see services/live_scores.py.
+    """
     await ws.accept()
-    await hub.register("kiosk", kiosk_id, ws)
+    if not await hub.register(group, key, ws, pong):
+        await ws.close(code=1013, reason="Too many connections")
+        return
+    # No await between register() and this snapshot, so nothing is missed.
+    seq = hub.current_seq(group, key)
+    missed = hub.backlog(group, key, since, epoch) if since is not None else []
     try:
+        await ws.send_json({"type": "hello", "epoch": hub.epoch, "seq": seq})
+        if missed is None:
+            await ws.send_json({"type": "resync", "seq": seq})
+        else:
+            for event in missed:
+                await ws.send_json(event)
+        await hub.release(ws)
+        expected = settings.game_keys.get(key) if group == "game" else None
+        accepts_scores = bool(expected) and (api_key or ws.headers.get("x-api-key")) == expected
         while True:
-            await ws.receive_text()
-    except WebSocketDisconnect:
-        await hub.unregister("kiosk", kiosk_id, ws)
+            text = await ws.receive_text()
+            hub.touch(ws)
+            if accepts_scores and '"score"' in text:
+                await _score_frame(ws, key, text)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        await hub.unregister(group, key, ws)
 
-@router.websocket("/ws/game/{game_id}")
-async def ws_game(ws: WebSocket, game_id: str):
-    await ws.accept()
-    await hub.register("game", game_id, ws)
+async def _score_frame(ws: WebSocket, game_id: str, text: str):
     try:
-        while True:
-            await ws.receive_text()
-    except WebSocketDisconnect:
-        await hub.unregister("game", game_id, ws)
+        msg = json.loads(text)
+    except ValueError:
+        return
+    if not isinstance(msg, dict) or msg.get("type") != "score":
+        return
+    error = await live_scores.update(game_id, msg)
+    if error:
+        await ws.send_json({"type": "error", "session_id": msg.get("session_id"), "detail": error})
+
+@router.websocket("/ws/kiosk/{kiosk_id}")
+async def ws_kiosk(ws: WebSocket, kiosk_id: str, since: Optional[int] = None, epoch: Optional[str] = None, pong: bool = False):
+    await _serve(ws, "kiosk", kiosk_id, since, epoch, pong)
+
+@router.websocket("/ws/game/{game_id}")
+async def ws_game(ws: WebSocket, game_id: str, since: Optional[int] = None, epoch: Optional[str] = None, pong: bool = False, key: Optional[str] = None):
+    await _serve(ws, "game", game_id, since, epoch, pong, key)
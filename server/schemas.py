@@ -1,6 +1,7 @@
 
 from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List, Dict, Any
+from datetime import datetime
 
 class PlayerCreate(BaseModel):
     email: Optional[EmailStr] = None
@@ -17,6 +18,14 @@ class PlayerOut(BaseModel):
     class Config:
         from_attributes = True
 
+class PlayerBulkIn(BaseModel):
+    # Rows are validated one by one in bulk_enroll() so a bad row is reported, not a 422.
+    players: List[Dict[str, Any]] = Field(..., max_length=10000)
+
+class PlayerSearchOut(BaseModel):
+    items: List[PlayerOut]
+    next_cursor: Optional[str] = None
+
 class PlayerUpdate(BaseModel):
     name: Optional[str] = None
     random_avatar: Optional[bool] = False
@@ -25,13 +34,30 @@ class RFIDScanIn(BaseModel):
     kiosk_id: str
     rfid_uid: str
 
+class RFIDBulkScanItem(BaseModel):
+    rfid_uid: str
+    scanned_at: Optional[datetime] = None  # UTC, when the agent read the tag
+
+class RFIDBulkScanIn(BaseModel):
+    kiosk_id: str
+    scans: List[RFIDBulkScanItem] = Field(max_length=500)
+
 class GameCreate(BaseModel):
     game_id: str
     name: str
+    max_session_sec: Optional[int] = None  # running sessions older than this are auto-ended
+    session_capacity: Optional[int] = None  # players per session, for queue balancing across kiosks
+
+class GameMetricDefIn(BaseModel):
+    name: str
+    kind: str = "float"  # int|float
+    unit: Optional[str] = None
+    indexed: bool = True
 
 class KioskCreate(BaseModel):
     kiosk_id: str
     location: Optional[str] = None
+    venue: Optional[str] = None  # one of VENUES; None -> home database
     game_id: str
     api_key: Optional[str] = None
     modes: Optional[Dict[str, Any]] = None  # {"list":[...]}
@@ -40,6 +66,7 @@ class KioskCreate(BaseModel):
 
 class KioskUpdate(BaseModel):
     location: Optional[str] = None
+    venue: Optional[str] = None  # send null to move back to the home database
     modes: Optional[Dict[str, Any]] = None  # {"list":[...]}
     objectives: Optional[List[str]] = None  # ["Hint 1", "Hint 2"]
     traits: Optional[Dict[str, Any]] = None  # {"physical":3,"mental":2,"skill":4}
@@ -47,6 +74,10 @@ class KioskUpdate(BaseModel):
 class QueueLeaveIn(BaseModel):
     player_id: int
 
+class QueueMoveIn(BaseModel):
+    player_id: int
+    to_kiosk_id: str
+
 class SessionStartIn(BaseModel):
     kiosk_id: str
     mode: Optional[str] = None
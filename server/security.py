@@ -10,6 +10,11 @@ def verify_kiosk_key(request: Request, kiosk_id: str):
     if not expected or api_key != expected:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid kiosk API key")
 
+def has_kiosk_key(request: Request, kiosk_id: str) -> bool:
+    """True if the request carries this kiosk's API key; for routes that also serve anonymous readers."""
+    expected = settings.kiosk_keys.get(kiosk_id)
+    return bool(expected) and request.headers.get("X-API-Key") == expected
+
 def verify_game_key(request: Request, game_id: str):
     api_key = request.headers.get("X-API-Key")
     expected = settings.game_keys.get(game_id)
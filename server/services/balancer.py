@@ -0,0 +1,261 @@
+
+"""
+Queue balancing across kiosks that front the same game (several bays).
+
+Each kiosk's load is held in memory: queue length, when its running session
+started, and a rolling (exponentially weighted) average session duration.
+The expected wait for someone joining a kiosk's queue is the remaining time
+of the running session plus one average session per full group already
+waiting (Game.session_capacity players per session, else
+BALANCE_SESSION_CAPACITY; 0 means a session takes the whole queue).
+
+On a scan, choose() compares the scanned kiosk with its siblings using only
+that state, so the decision costs the same no matter how big the queues or
+the history are. BALANCE_MODE decides what happens with a better sibling:
+"suggest" queues the player where they scanned and offers a move, "route"
+queues them at the sibling, "off" disables balancing. Offers and moves are
+broadcast to both kiosks.
+
+The in-memory counts are adjusted by the scan/queue/session paths and
+resynced from the database by a scheduler job, which also covers changes
+made by other workers. With VENUES, siblings are kiosks of the same game at
+the same venue (a player can't walk to another venue's bay), and the resync
+reads every venue database.
+"""
+import math
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal
+from ..settings import settings
+from ..shards import shards
+
+_EWMA_ALPHA = 0.2
+_HISTORY_SESSIONS = 20
+
+
+@dataclass
+class KioskLoad:
+    kiosk_pk: int
+    kiosk_id: str
+    game_pk: int
+    capacity: int
+    queued: int = 0
+    running_since: Optional[datetime] = None
+    avg_session_sec: Optional[float] = None
+    venue: Optional[str] = None
+
+    def expected_wait(self, now: datetime) -> float:
+        avg = self.avg_session_sec or settings.balance_default_session_sec
+        remaining = max(0.0, avg - (now - self.running_since).total_seconds()) if self.running_since else 0.0
+        groups_ahead = self.queued // self.capacity if self.capacity > 0 else 0
+        return remaining + groups_ahead * avg
+
+    def as_dict(self, now: datetime) -> Dict[str, Any]:
+        return {
+            "kiosk_id": self.kiosk_id,
+            "queued": self.queued,
+            "running": self.running_since is not None,
+            "avg_session_sec": round(self.avg_session_sec, 1) if self.avg_session_sec else None,
+            "expected_wait_sec": round(self.expected_wait(now)),
+        }
+
+
+class Balancer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kiosks: Dict[int, KioskLoad] = {}
+        self._by_game: Dict[int, List[int]] = {}
+        self.loaded = False
+
+    def sync(self, db: Optional[Session] = None) -> Dict[str, Any]:
+        """Rebuild kiosk loads from the database (startup, scheduler, after kiosk changes)."""
+        if db is None:
+            with SessionLocal() as db:
+                return self.sync(db)
+        games = {g.id: g for g in db.query(models.Game).all()}
+        kiosks = db.query(models.Kiosk.id, models.Kiosk.kiosk_id, models.Kiosk.game_id, models.Kiosk.venue).all()
+        with self._lock:
+            previous = dict(self._kiosks)
+        new = {pk for pk, *_ in kiosks if pk not in previous}
+        queued: Dict[int, int] = {}
+        running: Dict[int, datetime] = {}
+        avgs: Dict[int, float] = {}
+        for q, r, a in shards.fan_out(_shard_loads, new, db=db):
+            queued.update(q)
+            running.update(r)
+            avgs.update(a)
+        loads: Dict[int, KioskLoad] = {}
+        by_game: Dict[int, List[int]] = {}
+        for pk, kiosk_id, game_pk, venue in kiosks:
+            game = games.get(game_pk)
+            capacity = game.session_capacity if game and game.session_capacity is not None else settings.balance_session_capacity
+            prev = previous.get(pk)
+            avg = prev.avg_session_sec if prev is not None else avgs.get(pk)
+            loads[pk] = KioskLoad(pk, kiosk_id, game_pk, capacity, queued.get(pk, 0), running.get(pk), avg, venue)
+            by_game.setdefault(game_pk, []).append(pk)
+        with self._lock:
+            drifted = sum(
+                1 for pk, k in loads.items()
+                if pk in self._kiosks and (self._kiosks[pk].queued, self._kiosks[pk].running_since) != (k.queued, k.running_since)
+            )
+            self._kiosks, self._by_game, self.loaded = loads, by_game, True
+        return {"corrected_kiosks": drifted}
+
+    def ensure_loaded(self, db: Session):
+        if not self.loaded:
+            self.sync(db)
+
+    def queued(self, kiosk_pk: int, n: int = 1):
+        with self._lock:
+            k = self._kiosks.get(kiosk_pk)
+            if k is not None:
+                k.queued = max(0, k.queued + n)
+
+    def queue_cleared(self, kiosk_pk: int):
+        with self._lock:
+            k = self._kiosks.get(kiosk_pk)
+            if k is not None:
+                k.queued = 0
+
+    def session_started(self, kiosk_pk: int, at: datetime):
+        with self._lock:
+            k = self._kiosks.get(kiosk_pk)
+            if k is not None:
+                k.queued = 0
+                k.running_since = at
+
+    def session_ended(self, kiosk_pk: int, started_at: Optional[datetime], ended_at: datetime, completed: bool = True):
+        """Mark the kiosk free. Only completed sessions feed the average (resets and timeouts don't)."""
+        with self._lock:
+            k = self._kiosks.get(kiosk_pk)
+            if k is None:
+                return
+            k.running_since = None
+            if completed and started_at and ended_at > started_at:
+                d = (ended_at - started_at).total_seconds()
+                k.avg_session_sec = d if k.avg_session_sec is None else (1 - _EWMA_ALPHA) * k.avg_session_sec + _EWMA_ALPHA * d
+
+    def choose(self, kiosk_pk: int, now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        """
+        Best sibling for a player joining kiosk_pk's queue, or None if staying is
+        as good (within BALANCE_MIN_GAIN_SEC). Looks only at in-memory loads.
+        """
+        if settings.balance_mode == "off":
+            return None
+        now = now or datetime.utcnow()
+        with self._lock:
+            here = self._kiosks.get(kiosk_pk)
+            if here is None:
+                return None
+            wait_here = here.expected_wait(now)
+            best, best_wait = None, wait_here
+            for pk in self._by_game.get(here.game_pk, ()):
+                k = self._kiosks[pk]
+                if pk == kiosk_pk or k.venue != here.venue:
+                    continue
+                w = k.expected_wait(now)
+                if w < best_wait or (best is not None and w == best_wait and k.queued < best.queued):
+                    best, best_wait = k, w
+            if best is None or wait_here - best_wait < settings.balance_min_gain_sec:
+                return None
+            return {
+                "from_kiosk_id": here.kiosk_id,
+                "to_kiosk_id": best.kiosk_id,
+                "to_kiosk_pk": best.kiosk_pk,
+                "expected_wait_sec": math.ceil(best_wait),
+                "saves_sec": math.floor(wait_here - best_wait),
+            }
+
+    def donor(self, kiosk_pk: int, now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        """
+        For a kiosk that just freed up: the sibling whose newest queued player
+        would gain the most by moving here, as a choose()-style decision.
+        """
+        if settings.balance_mode == "off":
+            return None
+        now = now or datetime.utcnow()
+        with self._lock:
+            here = self._kiosks.get(kiosk_pk)
+            if here is None:
+                return None
+            wait_here = here.expected_wait(now)
+            best, best_gain = None, settings.balance_min_gain_sec
+            for pk in self._by_game.get(here.game_pk, ()):
+                k = self._kiosks[pk]
+                if pk == kiosk_pk or k.venue != here.venue or not k.queued:
+                    continue
+                # The newest player waits behind everyone else queued there.
+                k.queued -= 1
+                gain = k.expected_wait(now) - wait_here
+                k.queued += 1
+                if gain >= best_gain:
+                    best, best_gain = k, gain
+            if best is None:
+                return None
+            return {
+                "from_kiosk_id": best.kiosk_id,
+                "from_kiosk_pk": best.kiosk_pk,
+                "to_kiosk_id": here.kiosk_id,
+                "expected_wait_sec": math.ceil(wait_here),
+                "saves_sec": math.floor(best_gain),
+            }
+
+    def game_status(self, game_pk: int, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        now = now or datetime.utcnow()
+        with self._lock:
+            return [self._kiosks[pk].as_dict(now) for pk in self._by_game.get(game_pk, ())]
+
+
+def _shard_loads(db: Session, new_kiosks: Set[int]):
+    """Queue lengths, running-session starts and (for kiosks not seen before) history averages in one shard."""
+    queued = dict(
+        db.query(models.QueueEntry.kiosk_id, func.count(models.QueueEntry.id))
+        .group_by(models.QueueEntry.kiosk_id)
+        .all()
+    )
+    running = dict(
+        db.query(models.GameSession.kiosk_id, func.min(models.GameSession.started_at))
+        .filter(models.GameSession.status == "running")
+        .group_by(models.GameSession.kiosk_id)
+        .all()
+    )
+    avgs = {}
+    here = db.query(models.GameSession.kiosk_id).filter(models.GameSession.kiosk_id.in_(new_kiosks)).distinct() if new_kiosks else []
+    for (pk,) in here:
+        avg = _history_avg(db, pk)
+        if avg is not None:
+            avgs[pk] = avg
+    return queued, running, avgs
+
+
+def _history_avg(db: Session, kiosk_pk: int) -> Optional[float]:
+    rows = (
+        db.query(models.GameSession.started_at, models.GameSession.ended_at)
+        .filter(models.GameSession.kiosk_id == kiosk_pk, models.GameSession.status == "ended")
+        .filter(models.GameSession.started_at.isnot(None), models.GameSession.ended_at.isnot(None))
+        .order_by(models.GameSession.id.desc())
+        .limit(_HISTORY_SESSIONS)
+        .all()
+    )
+    avg = None
+    for started, ended in reversed(rows):
+        d = (ended - started).total_seconds()
+        if d <= 0:
+            continue
+        avg = d if avg is None else (1 - _EWMA_ALPHA) * avg + _EWMA_ALPHA * d
+    return avg
+
+
+balancer = Balancer()
+
+
+def sync() -> Dict[str, Any]:
+    """Scheduler entry point (every worker): correct drift from other workers and sweeps."""
+    return balancer.sync()
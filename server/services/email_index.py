@@ -0,0 +1,74 @@
+
+"""
+Backfill of players.email_bidx for rows created before the blind index.
+
+Walks players by id in batches (keyset, so memory and lock time stay
+bounded), decrypts each email once and writes its index. Rows whose email
+is already indexed on another player are left NULL and counted as
+duplicates; they need a human to merge the accounts. A rebuild walks every
+row the same way and overwrites it batch by batch.
+"""
+import logging
+from typing import Any, Dict, Optional
+
+from .. import models
+from ..database import SessionLocal
+from .encryption import dec, email_index
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def backfill(batch_size: int = 500, rebuild: bool = False) -> Dict[str, Any]:
+    """
+    Index emails that have none, or recompute all of them with rebuild=True
+    (e.g. after a key change). A rebuild overwrites each batch in place, so
+    lookups and duplicate checks keep working on every other row meanwhile.
+    """
+    P = models.Player
+    stats = {"indexed": 0, "duplicates": 0, "undecryptable": 0, "batches": 0}
+    last_id = 0
+    with SessionLocal() as db:
+        while True:
+            q = db.query(P.id, P.email_enc, P.email_bidx).filter(P.id > last_id, P.email_enc.isnot(None))
+            if not rebuild:
+                q = q.filter(P.email_bidx.is_(None))
+            batch = q.order_by(P.id.asc()).limit(batch_size).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+            current = {pid: bidx for pid, _, bidx in batch}
+            new: Dict[int, Optional[str]] = {}
+            wanted: Dict[str, int] = {}
+            for pid, email_enc, _ in batch:
+                bidx = email_index(dec(email_enc))
+                if bidx is None:
+                    stats["undecryptable"] += 1
+                    continue
+                if bidx in wanted:
+                    stats["duplicates"] += 1
+                    new[pid] = None
+                    continue
+                wanted[bidx] = pid
+                new[pid] = bidx
+            taken = {
+                b for (b,) in db.query(P.email_bidx)
+                .filter(P.email_bidx.in_(list(wanted)), P.id.not_in(list(current)))
+                .all()
+            }
+            for bidx in taken:
+                stats["duplicates"] += 1
+                new[wanted[bidx]] = None
+            changed = {pid: bidx for pid, bidx in new.items() if bidx != current[pid]}
+            if changed:
+                # Clear first so values can move between rows of this batch without
+                # tripping the unique index; it all commits together.
+                db.query(P).filter(P.id.in_(list(changed))).update({P.email_bidx: None}, synchronize_session=False)
+                for pid, bidx in changed.items():
+                    if bidx is not None:
+                        db.query(P).filter(P.id == pid).update({P.email_bidx: bidx}, synchronize_session=False)
+                        stats["indexed"] += 1
+            db.commit()
+            stats["batches"] += 1
+    if stats["duplicates"]:
+        logger.warning("Email index backfill: %d player(s) share an email with another player", stats["duplicates"])
+    return stats
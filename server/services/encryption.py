@@ -1,27 +1,125 @@
 
-from cryptography.fernet import Fernet, InvalidToken
+import hashlib
+import hmac
+import logging
+import unicodedata
+from typing import List, Optional
+
 from ..settings import settings
 
+logger = logging.getLogger("uvicorn.error")
+
+# The MultiFernet (and the cryptography import behind it) is built on first
+# use rather than at import time so a cold start doesn't pay for it before the
+# first request that actually touches an email. FERNET_KEY encrypts; it and
+# any FERNET_OLD_KEYS are tried in order when decrypting, so a key can be
+# rotated without breaking reads while services/key_rotation.py re-encrypts.
 _fernet = None
-if settings.fernet_key:
-    try:
-        _fernet = Fernet(settings.fernet_key.encode())
-    except Exception:
-        _fernet = None
+_primary = None
+_fernet_ready = False
+
+# Every Fernet token starts with version byte 0x80, i.e. "gAAAAA" in base64.
+_TOKEN_PREFIX = "gAAAAA"
+
+def _get_fernet():
+    global _fernet, _primary, _fernet_ready
+    if not _fernet_ready:
+        if settings.fernet_key:
+            from cryptography.fernet import Fernet, MultiFernet
+            keys = [settings.fernet_key] + [k.strip() for k in settings.fernet_old_keys.split(",") if k.strip()]
+            try:
+                fernets = [Fernet(k.encode()) for k in keys]
+                _fernet, _primary = MultiFernet(fernets), fernets[0]
+            except Exception:
+                logger.error("FERNET_KEY/FERNET_OLD_KEYS is not a valid Fernet key; emails will not be encrypted")
+                _fernet = _primary = None
+        _fernet_ready = True
+    return _fernet
+
+def key_fingerprint() -> str:
+    """Short, non-secret id of the current FERNET_KEY."""
+    return hashlib.sha256(settings.fernet_key.encode()).hexdigest()[:12]
+
+def is_token(value: str) -> bool:
+    return value.startswith(_TOKEN_PREFIX)
 
 def enc(value: str) -> str:
     if not value:
         return value
-    if not _fernet:
+    fernet = _get_fernet()
+    if not fernet:
         return value
-    return _fernet.encrypt(value.encode()).decode()
+    return fernet.encrypt(value.encode()).decode()
 
-def dec(value: str) -> str:
+def dec(value: str) -> Optional[str]:
+    """
+    Decrypt with the current or a previous key. Values stored before
+    encryption was enabled come back as-is; a token no configured key can
+    open returns None (and is logged) instead of leaking ciphertext to the UI.
+    """
     if not value:
         return value
-    if not _fernet:
+    fernet = _get_fernet()
+    if not fernet or not is_token(value):
         return value
+    from cryptography.fernet import InvalidToken
     try:
-        return _fernet.decrypt(value.encode()).decode()
+        return fernet.decrypt(value.encode()).decode()
     except InvalidToken:
-        return value
+        logger.warning("Could not decrypt a stored value with FERNET_KEY or FERNET_OLD_KEYS")
+        return None
+
+def reencrypt(value: str) -> Optional[str]:
+    """
+    Return `value` encrypted under the current key, or None if it already is.
+    Raises cryptography.fernet.InvalidToken if no configured key opens it.
+    """
+    fernet = _get_fernet()
+    if not value or not fernet:
+        return None
+    if not is_token(value):
+        return fernet.encrypt(value.encode()).decode()
+    from cryptography.fernet import InvalidToken
+    try:
+        _primary.decrypt(value.encode())
+        return None
+    except InvalidToken:
+        return fernet.rotate(value.encode()).decode()
+
+# Batches at least this big are sent to the "cpu" process pool (services/executors.py),
+# so bulk crypto doesn't hold the GIL the kiosk path needs.
+_POOL_BATCH_MIN = 64
+
+def enc_all(values: List[Optional[str]]) -> List[Optional[str]]:
+    return [enc(v) if v else None for v in values]
+
+def dec_all(values: List[Optional[str]]) -> List[Optional[str]]:
+    return [dec(v) if v else None for v in values]
+
+def enc_many(values: List[Optional[str]]) -> List[Optional[str]]:
+    """enc() over a list; big lists run on the cpu pool. Call from a worker thread, not the loop."""
+    if len(values) < _POOL_BATCH_MIN or not settings.fernet_key:
+        return enc_all(values)
+    from .executors import executors
+    return executors.call("cpu", enc_all, values)
+
+def dec_many(values: List[Optional[str]]) -> List[Optional[str]]:
+    """dec() over a list; big lists run on the cpu pool. Call from a worker thread, not the loop."""
+    if len(values) < _POOL_BATCH_MIN or not settings.fernet_key:
+        return dec_all(values)
+    from .executors import executors
+    return executors.call("cpu", dec_all, values)
+
+def normalize_email(value: str) -> str:
+    return unicodedata.normalize("NFKC", value).strip().lower()
+
+def email_index(value: Optional[str]) -> Optional[str]:
+    """
+    Keyed HMAC of the normalized email, stored next to the ciphertext so a
+    player can be found by email (and duplicates rejected) with an indexed
+    equality lookup. Changing EMAIL_INDEX_KEY requires a backfill --rebuild.
+    """
+    if not value:
+        return None
+    key = (settings.email_index_key or settings.secret_key).encode()
+    return hmac.new(key, normalize_email(value).encode(), hashlib.sha256).hexdigest()
@@ -0,0 +1,181 @@
+
+"""
+Named executor pools, so slow work can't take the threads the kiosk path needs.
+
+Sync routes normally share AnyIO's default thread pool. Routes decorated
+with @on_pool("io") run on that pool instead, and internal calls can use
+executors.run() (from async code) or executors.call() (from a worker
+thread). Pools come from EXECUTOR_POOLS, "name:workers[:process]" entries
+separated by commas. The default is
+    hot:8,io:8,cpu:2:process
+- hot: kiosk queue/status reads;
+- io: player CRUD, avatar uploads, history, kiosk admin;
+- cpu: a process pool for bulk Fernet work. Functions sent to a process
+  pool must be importable top-level functions with picklable arguments.
+  If a worker process dies, the call runs inline and the pool restarts.
+Each pool counts queued and running calls and keeps recent queue-wait and
+run times; GET /ui/executors reports them.
+"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import BrokenExecutor, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from ..settings import settings
+
+logger = logging.getLogger("uvicorn.error")
+
+_SAMPLES = 1024
+
+
+def _timed_call(func: Callable, submitted: float, args: tuple, kwargs: dict) -> Tuple[Any, float, float]:
+    """Runs in the worker (thread or process). Wall clock, so it is comparable across processes."""
+    started = time.time()
+    result = func(*args, **kwargs)
+    return result, started - submitted, time.time() - started
+
+
+def _ms_percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+
+class Pool:
+    def __init__(self, name: str, workers: int, process: bool = False):
+        self.name = name
+        self.workers = workers
+        self.process = process
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.waits: Deque[float] = deque(maxlen=_SAMPLES)
+        self.runs: Deque[float] = deque(maxlen=_SAMPLES)
+
+    @property
+    def executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.process:
+                    # spawn: forking a process that holds threads and DB connections is unsafe.
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                else:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix=f"pool-{self.name}")
+            return self._executor
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            self.submitted += 1
+        fut = self.executor.submit(_timed_call, func, time.time(), args, kwargs)
+        fut.add_done_callback(self._done)
+        return fut
+
+    def _done(self, fut: Future):
+        with self._lock:
+            self.completed += 1
+            if fut.cancelled() or fut.exception() is not None:
+                self.failed += 1
+                return
+            _, wait, run = fut.result()
+            self.waits.append(wait)
+            self.runs.append(run)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits, runs = list(self.waits), list(self.runs)
+            in_flight = self.submitted - self.completed
+        return {
+            "name": self.name,
+            "kind": "process" if self.process else "thread",
+            "workers": self.workers,
+            "in_flight": in_flight,
+            "queued": max(0, in_flight - self.workers),
+            "submitted": self.submitted,
+            "failed": self.failed,
+            "wait_p50_ms": _ms_percentile(waits, 0.5),
+            "wait_p99_ms": _ms_percentile(waits, 0.99),
+            "wait_max_ms": round(max(waits) * 1000, 2) if waits else None,
+            "run_p50_ms": _ms_percentile(runs, 0.5),
+            "run_p99_ms": _ms_percentile(runs, 0.99),
+        }
+
+    def broken(self):
+        """A worker process died: log, drop the executor (the next call starts a fresh one)."""
+        logger.error("Executor pool %s broke; running the call inline and restarting the pool", self.name)
+        self.shutdown()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_pools(spec: str) -> Dict[str, Pool]:
+    pools: Dict[str, Pool] = {}
+    for entry in (spec or "").split(","):
+        parts = [p.strip() for p in entry.split(":")]
+        if len(parts) < 2 or not parts[0]:
+            continue
+        pools[parts[0]] = Pool(parts[0], max(1, int(parts[1])), len(parts) > 2 and parts[2] == "process")
+    return pools
+
+
+class Executors:
+    def __init__(self, spec: str):
+        self.pools = parse_pools(spec)
+
+    def get(self, name: str) -> Optional[Pool]:
+        return self.pools.get(name)
+
+    async def run(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """Await func on the named pool (AnyIO's default pool if it isn't configured)."""
+        pool = self.pools.get(name)
+        if pool is None:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        try:
+            result, _, _ = await asyncio.wrap_future(pool.submit(func, *args, **kwargs))
+        except BrokenExecutor:
+            pool.broken()
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return result
+
+    def call(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """Blocking variant for code already on a worker thread."""
+        pool = self.pools.get(name)
+        if pool is None:
+            return func(*args, **kwargs)
+        try:
+            result, _, _ = pool.submit(func, *args, **kwargs).result()
+        except BrokenExecutor:
+            pool.broken()
+            return func(*args, **kwargs)
+        return result
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [p.stats() for p in self.pools.values()]
+
+    def shutdown(self):
+        for p in self.pools.values():
+            p.shutdown()
+
+
+executors = Executors(settings.executor_pools)
+
+
+def on_pool(name: str):
+    """Run a sync route on the named pool instead of AnyIO's default one."""
+    def decorate(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await executors.run(name, func, *args, **kwargs)
+        return wrapper
+    return decorate
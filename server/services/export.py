@@ -0,0 +1,187 @@
+
+"""
+Streaming export of session history (one row per session player).
+
+Rows are read in `chunk_size` batches and encoded incrementally, so memory
+stays flat no matter how large game_sessions/session_players grow. Postgres
+streams them through a server-side cursor (yield_per). SQLite pages by
+(session id, session player id), one short transaction per chunk: a read
+held open for the whole download would block kiosk writes. With VENUES the shards are read
+one after another, home first; each venue's ids sit above the previous
+one's (shards.id_base), so the stream stays ordered by session id.
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from sqlalchemy import and_, or_, select
+
+from .. import models
+from ..shards import shards
+
+EXPORT_COLUMNS = [
+    "session_id", "game_id", "game_name", "kiosk_id", "location", "mode", "status",
+    "started_at", "ended_at", "duration_sec",
+    "player_id", "username", "score", "play_time_sec", "metrics",
+]
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+_FLUSH_BYTES = 64 * 1024
+
+
+def iter_export_rows(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    game_id: Optional[str] = None,
+    chunk_size: int = 1000,
+) -> Iterator[Dict[str, Any]]:
+    """Yield export rows ordered by session then player. Opens its own DB session."""
+    GS, SP = models.GameSession, models.SessionPlayer
+    stmt = (
+        select(
+            GS.id, models.Game.game_id, models.Game.name, models.Kiosk.kiosk_id, models.Kiosk.location,
+            GS.mode, GS.meta, GS.status, GS.started_at, GS.ended_at,
+            SP.player_id, models.Player.username, SP.score, SP.play_time_sec, SP.metrics, SP.id,
+        )
+        .join(GS, SP.session_id == GS.id)
+        .join(models.Game, GS.game_id == models.Game.id)
+        .join(models.Kiosk, GS.kiosk_id == models.Kiosk.id)
+        .outerjoin(models.Player, SP.player_id == models.Player.id)
+        .order_by(GS.id, SP.id)
+    )
+    if start:
+        stmt = stmt.where(GS.started_at >= start)
+    if end:
+        stmt = stmt.where(GS.started_at < end)
+    if game_id:
+        stmt = stmt.where(models.Game.game_id == game_id)
+
+    for venue in shards.names():
+        yield from _shard_rows(venue, stmt, chunk_size)
+
+
+def _shard_rows(venue: Optional[str], stmt, chunk_size: int) -> Iterator[Dict[str, Any]]:
+    if shards.engine_for(venue).dialect.name != "sqlite":
+        with shards.session(venue) as db:
+            yield from _export_rows(db.execute(stmt.execution_options(yield_per=chunk_size)))
+        return
+    GS, SP = models.GameSession, models.SessionPlayer
+    after = None
+    while True:
+        page = stmt if after is None else stmt.where(or_(GS.id > after[0], and_(GS.id == after[0], SP.id > after[1])))
+        with shards.session(venue) as db:
+            rows = db.execute(page.limit(chunk_size)).all()
+        if not rows:
+            return
+        yield from _export_rows(rows)
+        after = (rows[-1][0], rows[-1][-1])
+
+
+def _export_rows(result) -> Iterator[Dict[str, Any]]:
+    for (sid, gid, gname, kid, loc, mode, meta, status, started, ended,
+         pid, username, score, play_time, metrics, _sp_id) in result:
+        yield {
+            "session_id": sid,
+            "game_id": gid,
+            "game_name": gname,
+            "kiosk_id": kid,
+            "location": loc,
+            "mode": mode or (meta or {}).get("mode") or (metrics or {}).get("kiosk_mode") or "default",
+            "status": status,
+            "started_at": started.isoformat() if started else None,
+            "ended_at": ended.isoformat() if ended else None,
+            "duration_sec": int((ended - started).total_seconds()) if started and ended else None,
+            "player_id": pid,
+            "username": username,
+            "score": score,
+            "play_time_sec": play_time,
+            "metrics": metrics or {},
+        }
+
+
+def iter_csv(rows: Iterator[Dict[str, Any]]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({**row, "metrics": json.dumps(row["metrics"])})
+        if buf.tell() >= _FLUSH_BYTES:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode()
+
+
+def iter_ndjson(rows: Iterator[Dict[str, Any]]) -> Iterator[bytes]:
+    parts = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= _FLUSH_BYTES:
+            yield "".join(parts).encode()
+            parts, size = [], 0
+    yield "".join(parts).encode()
+
+
+def iter_parquet(rows: Iterator[Dict[str, Any]], chunk_size: int = 1000) -> Iterator[bytes]:
+    """
+    Write one row group per chunk to a temp file, then stream the file.
+    Parquet needs its footer at the end, so the file can't be sent while
+    it is being written; the temp file keeps memory flat instead.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("session_id", pa.int64()), ("game_id", pa.string()), ("game_name", pa.string()),
+        ("kiosk_id", pa.string()), ("location", pa.string()), ("mode", pa.string()),
+        ("status", pa.string()), ("started_at", pa.string()), ("ended_at", pa.string()),
+        ("duration_sec", pa.int64()), ("player_id", pa.int64()), ("username", pa.string()),
+        ("score", pa.int64()), ("play_time_sec", pa.int64()), ("metrics", pa.string()),
+    ])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export.parquet")
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            batch = []
+            for row in rows:
+                batch.append({**row, "metrics": json.dumps(row["metrics"])})
+                if len(batch) >= chunk_size:
+                    writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                    batch = []
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(_FLUSH_BYTES)
+                if not data:
+                    break
+                yield data
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def iter_export(fmt: str, rows: Iterator[Dict[str, Any]], chunk_size: int = 1000) -> Iterator[bytes]:
+    if fmt == "csv":
+        return iter_csv(rows)
+    if fmt == "ndjson":
+        return iter_ndjson(rows)
+    if fmt == "parquet":
+        return iter_parquet(rows, chunk_size)
+    raise ValueError(f"Unknown export format: {fmt}")
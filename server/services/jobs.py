@@ -0,0 +1,308 @@
+
+"""
+Durable background job queue for work a request shouldn't wait for.
+
+A request handler calls enqueue(db, kind, payload) before its own commit.
+The job row commits with the rest of the request or not at all, and the
+request returns straight away. Handlers are sync functions registered with
+@handler("kind"). They run in a thread, open their own DB session, and are
+retried if they raise.
+
+Workers claim due jobs (status queued and run_at <= now, highest priority
+first). A claim is a compare-and-set UPDATE that takes a lease (locked_by,
+locked_until = now + JOBS_LEASE_SEC). On Postgres the candidate SELECT also
+uses FOR UPDATE SKIP LOCKED, so concurrent workers don't contend for the
+same rows. A job whose worker died is claimed again once its lease runs out.
+
+Each claim counts as an attempt. A failed job is requeued after
+JOBS_RETRY_BASE_SEC * 2^(attempts-1), capped at JOBS_RETRY_MAX_SEC. After
+max_attempts, or on JobFailed, it becomes "dead": it stays in the table
+with its last error, and POST /ui/jobs/{id}/retry requeues it.
+
+The worker runs inside the app (JOBS_WORKER=true, the default) or as a
+separate process with `python -m server.worker`. An in-process enqueue
+wakes the in-app worker; other workers notice on their next JOBS_POLL_SEC poll.
+"""
+import asyncio
+import importlib
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from sqlalchemy import and_, delete, event, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal, engine
+from ..settings import settings
+from .outbox import Signal
+
+logger = logging.getLogger("uvicorn.error")
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+# Modules whose import registers handlers; a standalone worker imports them up front.
+HANDLER_MODULES = ("server.routers.players",)
+
+_PENDING = "jobs_pending"
+_SAMPLES = 256
+
+_handlers: Dict[str, Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]] = {}
+signal = Signal()
+
+
+class JobFailed(Exception):
+    """Raise from a handler for failures a retry can't fix; the job goes straight to dead."""
+
+
+def handler(kind: str):
+    def decorate(func):
+        _handlers[kind] = func
+        return func
+    return decorate
+
+
+def load_handlers():
+    for name in HANDLER_MODULES:
+        importlib.import_module(name)
+
+
+def enqueue(
+    db: Session,
+    kind: str,
+    payload: Dict[str, Any],
+    priority: int = PRIORITY_NORMAL,
+    key: Optional[str] = None,
+    delay_sec: float = 0,
+    max_attempts: Optional[int] = None,
+) -> models.QueuedJob:
+    """
+    Add a job to the caller's transaction. With `key`, an unfinished job with
+    the same kind and key is returned instead of adding a duplicate.
+    """
+    J = models.QueuedJob
+    if key is not None:
+        existing = db.query(J).filter(J.kind == kind, J.key == key, J.status.in_(("queued", "running"))).first()
+        if existing is not None:
+            return existing
+    job = J(
+        kind=kind,
+        payload=payload,
+        key=key,
+        priority=priority,
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts or settings.jobs_max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay_sec),
+        created_at=datetime.utcnow(),
+    )
+    db.add(job)
+    db.flush()
+    db.info[_PENDING] = True
+    return job
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _after_commit(session: Session):
+    if session.info.pop(_PENDING, False):
+        signal.notify()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _after_rollback(session: Session):
+    session.info.pop(_PENDING, None)
+
+
+def _backoff(attempts: int) -> float:
+    return min(settings.jobs_retry_max_sec, settings.jobs_retry_base_sec * 2 ** max(0, attempts - 1))
+
+
+class Worker:
+    def __init__(self):
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.running: Dict[int, str] = {}
+        self.counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"done": 0, "retried": 0, "dead": 0})
+        self.run_times: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=_SAMPLES))
+        self._stopping = False
+
+    def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """Lease up to `limit` due jobs for this worker. Blocking; run off the loop."""
+        J = models.QueuedJob
+        now = datetime.utcnow()
+        due = or_(
+            and_(J.status == "queued", J.run_at <= now),
+            and_(J.status == "running", J.locked_until < now),
+        )
+        with SessionLocal() as db:
+            # A job whose worker died on its last attempt is dead, not retried forever.
+            db.execute(
+                update(J)
+                .where(J.status == "running", J.locked_until < now, J.attempts >= J.max_attempts)
+                .values(status="dead", locked_by=None, finished_at=now, last_error="lease expired on last attempt")
+            )
+            ids = db.execute(
+                select(J.id).where(due).order_by(J.priority.desc(), J.run_at, J.id).limit(limit).with_for_update(skip_locked=True)
+            ).scalars().all()
+            claimed = []
+            for job_id in ids:
+                n = db.execute(
+                    update(J)
+                    .where(J.id == job_id, due)
+                    .values(
+                        status="running",
+                        locked_by=self.holder,
+                        locked_until=now + timedelta(seconds=settings.jobs_lease_sec),
+                        attempts=J.attempts + 1,
+                        started_at=now,
+                    )
+                ).rowcount
+                if n:
+                    claimed.append(job_id)
+            db.commit()
+            if not claimed:
+                return []
+            return [
+                {"id": j.id, "kind": j.kind, "payload": j.payload or {}, "attempts": j.attempts, "max_attempts": j.max_attempts}
+                for j in db.query(J).filter(J.id.in_(claimed)).order_by(J.priority.desc(), J.run_at, J.id)
+            ]
+
+    def _finish(self, job: Dict[str, Any], error: Optional[str], permanent: bool = False) -> str:
+        J = models.QueuedJob
+        now = datetime.utcnow()
+        if error is None:
+            values = {"status": "done", "finished_at": now, "last_error": None}
+        elif permanent or job["attempts"] >= job["max_attempts"]:
+            values = {"status": "dead", "finished_at": now, "last_error": error[:2000]}
+        else:
+            values = {"status": "queued", "run_at": now + timedelta(seconds=_backoff(job["attempts"])), "last_error": error[:2000]}
+        with SessionLocal() as db:
+            db.execute(
+                update(J)
+                .where(J.id == job["id"], J.locked_by == self.holder)
+                .values(locked_by=None, locked_until=None, **values)
+            )
+            db.commit()
+        return values["status"]
+
+    def execute(self, job: Dict[str, Any]) -> str:
+        """Run one claimed job and record the outcome. Blocking."""
+        func = _handlers.get(job["kind"])
+        t0 = time.perf_counter()
+        if func is None:
+            status = self._finish(job, f"No handler for job kind {job['kind']!r}", permanent=True)
+        else:
+            try:
+                func(job["payload"])
+            except JobFailed as e:
+                status = self._finish(job, f"JobFailed: {e}", permanent=True)
+            except Exception as e:
+                logger.exception("Job %s (%s) failed on attempt %s", job["id"], job["kind"], job["attempts"])
+                status = self._finish(job, f"{type(e).__name__}: {e}")
+            else:
+                status = self._finish(job, None)
+        self.run_times[job["kind"]].append(time.perf_counter() - t0)
+        self.counters[job["kind"]]["retried" if status == "queued" else status] += 1
+        if status == "dead":
+            logger.error("Job %s (%s) dead-lettered after %s attempts", job["id"], job["kind"], job["attempts"])
+        return status
+
+    async def _run_one(self, job: Dict[str, Any], slots: asyncio.Semaphore):
+        try:
+            await asyncio.to_thread(self.execute, job)
+        except Exception:
+            logger.exception("Job %s bookkeeping failed; it will be retried after its lease expires", job["id"])
+        finally:
+            self.running.pop(job["id"], None)
+            slots.release()
+
+    async def run(self, concurrency: Optional[int] = None):
+        """Claim and run jobs until cancelled (in the app) or stop() (standalone)."""
+        concurrency = max(1, concurrency or settings.jobs_concurrency)
+        self._stopping = False
+        slots = asyncio.Semaphore(concurrency)
+        tasks = set()
+        try:
+            while not self._stopping:
+                free = concurrency - len(self.running)
+                jobs = []
+                if free > 0:
+                    try:
+                        jobs = await asyncio.to_thread(self.claim, free)
+                    except Exception:
+                        logger.exception("Claiming jobs failed")
+                for job in jobs:
+                    await slots.acquire()
+                    self.running[job["id"]] = job["kind"]
+                    task = asyncio.create_task(self._run_one(job, slots))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if not jobs or len(jobs) < free:
+                    await signal.wait(settings.jobs_poll_sec)
+                else:
+                    await asyncio.sleep(0)
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        self._stopping = True
+        signal.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        J = models.QueuedJob
+        with SessionLocal() as db:
+            by_status = defaultdict(dict)
+            for kind, status, n in db.query(J.kind, J.status, func.count(J.id)).group_by(J.kind, J.status):
+                by_status[kind][status] = n
+            oldest = db.query(func.min(J.run_at)).filter(J.status == "queued", J.run_at <= datetime.utcnow()).scalar()
+            dead = db.query(J).filter(J.status == "dead").order_by(J.finished_at.desc()).limit(20).all()
+        kinds = {}
+        for kind in set(by_status) | set(self.counters):
+            times = sorted(self.run_times.get(kind, ()))
+            pick = lambda p: round(times[min(len(times) - 1, int(p * len(times)))] * 1000, 2) if times else None
+            kinds[kind] = {"db": by_status.get(kind, {}), "this_worker": dict(self.counters.get(kind, {})), "run_p50_ms": pick(0.5), "run_p99_ms": pick(0.99)}
+        return {
+            "worker": self.holder,
+            "running_here": len(self.running),
+            "oldest_due_sec": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None,
+            "kinds": kinds,
+            "dead": [
+                {"id": j.id, "kind": j.kind, "attempts": j.attempts, "last_error": j.last_error, "finished_at": j.finished_at.isoformat() if j.finished_at else None}
+                for j in dead
+            ],
+        }
+
+
+worker = Worker()
+
+
+def retry(job_id: int) -> bool:
+    """Requeue a dead job with a fresh set of attempts."""
+    J = models.QueuedJob
+    with SessionLocal() as db:
+        n = db.execute(
+            update(J)
+            .where(J.id == job_id, J.status == "dead")
+            .values(status="queued", attempts=0, run_at=datetime.utcnow(), finished_at=None)
+        ).rowcount
+        db.info[_PENDING] = bool(n)
+        db.commit()
+    return bool(n)
+
+
+def prune(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Delete finished jobs older than JOBS_KEEP_DAYS (dead jobs stay for inspection)."""
+    if settings.jobs_keep_days <= 0:
+        return {"jobs_pruned": 0}
+    J = models.QueuedJob
+    cutoff = (now or datetime.utcnow()) - timedelta(days=settings.jobs_keep_days)
+    with engine.begin() as conn:
+        n = conn.execute(delete(J).where(J.status == "done", J.finished_at < cutoff)).rowcount
+    return {"jobs_pruned": n}
@@ -0,0 +1,213 @@
+
+"""
+Sampled request journal, for replaying real traffic as a benchmark.
+
+JournalMiddleware records a JOURNAL_SAMPLE_RATE fraction of HTTP requests.
+A request that isn't sampled costs one random() call. Each record holds:
+- route template and concrete path, method, path params and query;
+- body shape (keys and value types), plus the body itself when
+  JOURNAL_CAPTURE_BODY is on (needed to replay writes faithfully);
+- status, latency and timestamp.
+API keys, passwords and anything that looks like an email are redacted.
+The request only appends the record to an in-memory buffer. A background
+task writes buffered records every JOURNAL_FLUSH_SEC to
+JOURNAL_DIR/requests-YYYY-MM-DD[-N].jsonl (a new -N file once one passes
+JOURNAL_MAX_FILE_MB). Day files older than JOURNAL_KEEP_DAYS are deleted.
+If the writer falls behind, records beyond JOURNAL_BUFFER are dropped and
+counted instead of slowing requests down.
+
+scripts/replay_journal.py re-drives a recorded day against a server.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from ..settings import settings
+
+logger = logging.getLogger("uvicorn.error")
+
+_SKIP_PREFIXES = ("/static", "/ui/debug")
+_SECRET_KEY_RE = re.compile(r"key|token|secret|password|passwd|email", re.I)
+_EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+REDACTED = "[redacted]"
+
+
+def redact(value: Any, key: str = "") -> Any:
+    if key and _SECRET_KEY_RE.search(key):
+        return REDACTED
+    if isinstance(value, dict):
+        return {k: redact(v, str(k)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    if isinstance(value, str) and _EMAIL_RE.search(value):
+        return _EMAIL_RE.sub("[email]", value)
+    return value
+
+
+def shape(value: Any, depth: int = 0) -> Any:
+    """Structure of a JSON value without its contents (lists show their length and first item)."""
+    if isinstance(value, dict):
+        return {k: shape(v, depth + 1) for k, v in value.items()} if depth < 4 else "object"
+    if isinstance(value, list):
+        return {"list": len(value), "item": shape(value[0], depth + 1) if value else None}
+    if value is None:
+        return "null"
+    return type(value).__name__
+
+
+def _body_fields(body: bytes, content_type: str) -> Dict[str, Any]:
+    if not body:
+        return {"body_shape": None}
+    if "json" in content_type:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return {"body_shape": "invalid-json", "body_bytes": len(body)}
+        out: Dict[str, Any] = {"body_shape": shape(data)}
+        if settings.journal_capture_body:
+            out["body"] = redact(data)
+        return out
+    if "x-www-form-urlencoded" in content_type:
+        form = dict(parse_qsl(body.decode("latin-1")))
+        out = {"body_shape": {k: "str" for k in form}}
+        if settings.journal_capture_body:
+            out["form"] = redact(form)
+        return out
+    return {"body_shape": content_type.split(";")[0] or "bytes", "body_bytes": len(body)}
+
+
+class Journal:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        self.written = 0
+        self.dropped = 0
+
+    def record(self, rec: Dict[str, Any]):
+        with self._lock:
+            if len(self._buffer) >= settings.journal_buffer:
+                self.dropped += 1
+                return
+            self._buffer.append(rec)
+
+    def _path_for(self, day: str) -> str:
+        limit = settings.journal_max_file_mb * 1024 * 1024
+        n = 0
+        while True:
+            name = f"requests-{day}.jsonl" if n == 0 else f"requests-{day}-{n}.jsonl"
+            path = os.path.join(settings.journal_dir, name)
+            if not os.path.exists(path) or os.path.getsize(path) < limit:
+                return path
+            n += 1
+
+    def flush(self) -> Dict[str, Any]:
+        """Append buffered records to the day files. Blocking; run off the loop."""
+        with self._lock:
+            batch, self._buffer = self._buffer, deque()
+        if not batch:
+            return {"journal_records": 0}
+        os.makedirs(settings.journal_dir, exist_ok=True)
+        by_day: Dict[str, List[str]] = {}
+        for rec in batch:
+            by_day.setdefault(rec["ts"][:10], []).append(json.dumps(rec, default=str) + "\n")
+        for day, lines in by_day.items():
+            with open(self._path_for(day), "a", encoding="utf-8") as f:
+                f.writelines(lines)
+        self.written += len(batch)
+        return {"journal_records": len(batch), "journal_dropped": self.dropped}
+
+    def prune(self, now: Optional[datetime] = None) -> int:
+        if settings.journal_keep_days <= 0 or not os.path.isdir(settings.journal_dir):
+            return 0
+        cutoff = ((now or datetime.utcnow()) - timedelta(days=settings.journal_keep_days)).strftime("%Y-%m-%d")
+        removed = 0
+        for fname in os.listdir(settings.journal_dir):
+            if fname.startswith("requests-") and fname.endswith(".jsonl") and fname[9:19] < cutoff:
+                os.remove(os.path.join(settings.journal_dir, fname))
+                removed += 1
+        return removed
+
+    async def run(self):
+        """Background writer started from the app lifespan."""
+        last_prune = 0.0
+        while True:
+            await asyncio.sleep(settings.journal_flush_sec)
+            try:
+                await asyncio.to_thread(self.flush)
+                if time.monotonic() - last_prune > 3600:
+                    last_prune = time.monotonic()
+                    await asyncio.to_thread(self.prune)
+            except Exception:
+                logger.exception("Request journal write failed")
+
+
+journal = Journal()
+
+
+class JournalMiddleware:
+    """Pure ASGI middleware, so unsampled requests pass straight through."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        rate = settings.journal_sample_rate
+        if (
+            scope["type"] != "http"
+            or rate <= 0
+            or random.random() >= rate
+            or scope["path"].startswith(_SKIP_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        ts = datetime.utcnow()
+        body = bytearray()
+        status_code = 500
+        cap = settings.journal_max_body_bytes
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) <= cap:
+                body.extend(message.get("body", b"")[: cap + 1 - len(body)])
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            latency_ms = (time.perf_counter() - started) * 1000
+            headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+            route = scope.get("route")
+            rec = {
+                "ts": ts.isoformat(timespec="milliseconds"),
+                "method": scope["method"],
+                "route": getattr(route, "path", None),
+                "path": scope["path"],
+                "path_params": redact(scope.get("path_params") or {}),
+                "query": redact(dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))),
+                "auth": "api_key" if "x-api-key" in headers else ("basic" if headers.get("authorization", "").startswith("Basic ") else None),
+                "content_type": headers.get("content-type"),
+                "status": status_code,
+                "latency_ms": round(latency_ms, 2),
+            }
+            if len(body) > cap:
+                rec.update(body_shape="truncated", body_bytes=int(headers.get("content-length") or len(body)))
+            else:
+                rec.update(_body_fields(bytes(body), headers.get("content-type", "")))
+            journal.record(rec)
@@ -0,0 +1,120 @@
+
+"""
+Re-encrypt stored emails under the current FERNET_KEY.
+
+Rotation: put the new key in FERNET_KEY and the old one in FERNET_OLD_KEYS.
+Reads keep working through MultiFernet, and this job walks players by id in
+batches of KEY_ROTATION_BATCH_SIZE. Each batch is one short transaction that
+also saves the cursor in job_state, so the job can be stopped at any point
+and picks up where it left off. Rows are updated with a compare-and-set on
+the old ciphertext, so a row edited concurrently is not overwritten, and
+there is a pause between batches so kiosk traffic is never locked out for long.
+Once it reports done, FERNET_OLD_KEYS can be removed.
+"""
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import bindparam, func, update
+
+from .. import models
+from ..database import SessionLocal
+from ..settings import settings
+from .encryption import key_fingerprint, reencrypt
+
+
+def _state_name() -> str:
+    return f"key_rotation:{key_fingerprint()}"
+
+
+def run(
+    batch_size: Optional[int] = None,
+    max_batches: Optional[int] = None,
+    pause_ms: Optional[int] = None,
+    restart: bool = False,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Process up to max_batches batches (None = until done). Returns cumulative progress."""
+    from cryptography.fernet import InvalidToken  # not at import: the app loads this module at startup
+
+    batch_size = batch_size or settings.key_rotation_batch_size
+    pause = (settings.key_rotation_pause_ms if pause_ms is None else pause_ms) / 1000
+    P = models.Player
+    stmt = (
+        update(P.__table__)
+        .where(P.__table__.c.id == bindparam("pid"), P.__table__.c.email_enc == bindparam("old"))
+        .values(email_enc=bindparam("new"))
+    )
+
+    with SessionLocal() as db:
+        state = db.get(models.JobState, _state_name())
+        if state is None or restart:
+            if state is None:
+                state = models.JobState(name=_state_name())
+                db.add(state)
+            state.cursor, state.done, state.started_at = 0, False, datetime.utcnow()
+            state.stats = {"scanned": 0, "rotated": 0, "conflicts": 0, "failed": 0}
+            db.commit()
+        if state.done:
+            return {"done": True, **state.stats}
+        max_id = db.query(func.max(P.id)).scalar() or 0
+        stats = dict(state.stats)
+        t0 = time.perf_counter()
+        scanned_this_run = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            rows = (
+                db.query(P.id, P.email_enc)
+                .filter(P.id > state.cursor, P.email_enc.isnot(None))
+                .order_by(P.id.asc())
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                state.done = True
+                state.updated_at = datetime.utcnow()
+                db.commit()
+                break
+            params = []
+            for pid, old in rows:
+                try:
+                    new = reencrypt(old)
+                except InvalidToken:
+                    stats["failed"] += 1
+                    continue
+                if new is not None:
+                    params.append({"pid": pid, "old": old, "new": new})
+            if params:
+                changed = db.connection().execute(stmt, params).rowcount
+                stats["rotated"] += changed
+                stats["conflicts"] += len(params) - changed
+            stats["scanned"] += len(rows)
+            scanned_this_run += len(rows)
+            state.cursor = rows[-1].id
+            state.stats = dict(stats)
+            state.updated_at = datetime.utcnow()
+            db.commit()
+            batches += 1
+            if progress:
+                progress(_report(state, stats, max_id, scanned_this_run, t0))
+            if pause:
+                time.sleep(pause)
+        return _report(state, stats, max_id, scanned_this_run, t0)
+
+
+def _report(state: models.JobState, stats: Dict[str, Any], max_id: int, scanned: int, t0: float) -> Dict[str, Any]:
+    elapsed = time.perf_counter() - t0
+    return {
+        "done": state.done,
+        **stats,
+        "cursor": state.cursor,
+        "percent": 100.0 if state.done or not max_id else round(100.0 * min(state.cursor, max_id) / max_id, 1),
+        "rows_per_sec": round(scanned / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def scheduled() -> Dict[str, Any]:
+    """Scheduler entry point: a bounded slice of work, only while old keys are configured."""
+    if not settings.fernet_key or not settings.fernet_old_keys.strip():
+        return {}
+    return run(max_batches=50)
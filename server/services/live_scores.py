@@ -0,0 +1,229 @@
+
+"""
+Live scores for running sessions, pushed by game clients over /ws/game/{game_id}.
+
+A game client sends frames like
+    {"type": "score", "session_id": 12, "progress": 0.4,
+     "players": [{"player_id": 3, "score": 120, "progress": 0.5}]}
+as often as it likes. Each frame is checked against the running session
+(game, status, players; looked up once and then cached) and merged into the
+latest state in memory. Two clocks drain that state:
+
+- every 1/LIVE_SCORE_FPS seconds, sessions that changed get one score_update
+  frame to their kiosk (not sequenced or replayed; a reconnecting kiosk reads
+  GET /sessions/{id}/live instead);
+- every LIVE_SCORE_FLUSH_SEC, changed scores are written to session_players
+  in one batched UPDATE, so a crash loses at most that much progress.
+
+/sessions/end stays authoritative: it drops the live state first, and the
+batched UPDATE only touches sessions that are still running. With VENUES the
+rows are grouped by the shard their ids belong to (shards.py).
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, bindparam, select, update
+
+from .. import models
+from ..settings import settings
+from ..shards import shards
+from .queue_manager import hub
+
+logger = logging.getLogger("uvicorn.error")
+
+_REJECT_TTL_SEC = 5.0
+_MAX_REJECTED = 1024
+_IDLE_EVICT_SEC = 300.0  # drop state for sessions whose feed went quiet (after flushing it)
+
+
+class LiveSession:
+    def __init__(self, session_id: int, game_id: str, kiosk_id: str, players: Dict[int, Dict[str, Any]]):
+        self.session_id = session_id
+        self.game_id = game_id
+        self.kiosk_id = kiosk_id
+        # player_id -> {"sp_id", "username", "score", "progress"}
+        self.players = players
+        self.progress: Optional[float] = None
+        self.updates = 0
+        self.last_frame = time.monotonic()
+        self.fanout_dirty = False
+        self.db_dirty = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "kiosk_id": self.kiosk_id,
+            "progress": self.progress,
+            "players": [
+                {"player_id": pid, "username": p["username"], "score": p["score"], "progress": p["progress"]}
+                for pid, p in self.players.items()
+            ],
+        }
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    return value
+
+
+class LiveScores:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[int, LiveSession] = {}
+        self._rejected: Dict[int, float] = {}
+        self.counters: Dict[str, int] = {"frames": 0, "rejected": 0, "fanouts": 0, "db_rows": 0}
+
+    def _load(self, session_id: int, game_id: str) -> Optional[LiveSession]:
+        with shards.session(shards.venue_for(row_id=session_id)) as db:
+            row = (
+                db.query(models.GameSession, models.Game.game_id, models.Kiosk.kiosk_id)
+                .join(models.Game, models.GameSession.game_id == models.Game.id)
+                .join(models.Kiosk, models.GameSession.kiosk_id == models.Kiosk.id)
+                .filter(models.GameSession.id == session_id)
+                .first()
+            )
+            if row is None or row[0].status != "running" or row[1] != game_id:
+                return None
+            players = {
+                pid: {"sp_id": sp_id, "username": username, "score": score or 0, "progress": None}
+                for sp_id, pid, score, username in (
+                    db.query(models.SessionPlayer.id, models.SessionPlayer.player_id, models.SessionPlayer.score, models.Player.username)
+                    .join(models.Player, models.Player.id == models.SessionPlayer.player_id)
+                    .filter(models.SessionPlayer.session_id == session_id)
+                    .all()
+                )
+            }
+        return LiveSession(session_id, game_id, row[2], players)
+
+    async def update(self, game_id: str, msg: Dict[str, Any]) -> Optional[str]:
+        """Merge one score frame. Returns an error string for frames that don't fit the session."""
+        sid = msg.get("session_id")
+        if not isinstance(sid, int):
+            return "session_id must be an integer"
+        with self._lock:
+            live = self._sessions.get(sid)
+            rejected_until = self._rejected.get(sid, 0.0)
+        if live is None:
+            if rejected_until > time.monotonic():
+                self.counters["rejected"] += 1
+                return "Session is not running for this game"
+            live = await asyncio.to_thread(self._load, sid, game_id)
+            with self._lock:
+                if live is None:
+                    if len(self._rejected) >= _MAX_REJECTED:
+                        now = time.monotonic()
+                        self._rejected = {k: v for k, v in self._rejected.items() if v > now}
+                    self._rejected[sid] = time.monotonic() + _REJECT_TTL_SEC
+                    self.counters["rejected"] += 1
+                    return "Session is not running for this game"
+                live = self._sessions.setdefault(sid, live)
+        if live.game_id != game_id:
+            self.counters["rejected"] += 1
+            return "Session is not running for this game"
+
+        entries = msg.get("players") or []
+        if not isinstance(entries, list):
+            return "players must be a list"
+        with self._lock:
+            for p in entries:
+                if not isinstance(p, dict):
+                    continue
+                state = live.players.get(p.get("player_id"))
+                if state is None:
+                    continue
+                score = _number(p.get("score"))
+                if score is not None and int(score) != state["score"]:
+                    state["score"] = int(score)
+                    live.db_dirty = True
+                progress = _number(p.get("progress"))
+                if progress is not None:
+                    state["progress"] = progress
+            progress = _number(msg.get("progress"))
+            if progress is not None:
+                live.progress = progress
+            live.updates += 1
+            live.last_frame = time.monotonic()
+            live.fanout_dirty = True
+        self.counters["frames"] += 1
+        return None
+
+    def end(self, session_id: int):
+        """Forget a session's live state (it ended; its final results win)."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def get(self, session_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            live = self._sessions.get(session_id)
+            return live.snapshot() if live else None
+
+    async def fanout(self):
+        with self._lock:
+            frames = []
+            for live in self._sessions.values():
+                if live.fanout_dirty:
+                    live.fanout_dirty = False
+                    frames.append((live.kiosk_id, {"type": "score_update", **live.snapshot()}))
+        for kiosk_id, frame in frames:
+            await hub.send_transient("kiosk", kiosk_id, frame)
+        self.counters["fanouts"] += len(frames)
+
+    def flush(self) -> Dict[str, Any]:
+        """Write changed scores to session_players (only for sessions still running)."""
+        with self._lock:
+            rows, flushed = [], []
+            idle_before = time.monotonic() - _IDLE_EVICT_SEC
+            for sid in [sid for sid, live in self._sessions.items() if live.last_frame < idle_before and not live.db_dirty]:
+                del self._sessions[sid]
+            for live in self._sessions.values():
+                if live.db_dirty:
+                    live.db_dirty = False
+                    flushed.append(live)
+                    rows.extend({"sp_id": p["sp_id"], "new_score": p["score"]} for p in live.players.values())
+        if not rows:
+            return {"live_rows": 0}
+        SP, GS = models.SessionPlayer.__table__, models.GameSession.__table__
+        running = select(GS.c.id).where(GS.c.status == "running")
+        stmt = (
+            update(SP)
+            .where(and_(SP.c.id == bindparam("sp_id"), SP.c.session_id.in_(running)))
+            .values(score=bindparam("new_score"))
+        )
+        by_shard: Dict[Optional[str], List[Dict[str, Any]]] = defaultdict(list)
+        for row in rows:
+            by_shard[shards.venue_for(row_id=row["sp_id"])].append(row)
+        try:
+            for venue, part in by_shard.items():
+                with shards.session(venue) as db:
+                    db.connection().execute(stmt, part)
+                    db.commit()
+        except Exception:
+            with self._lock:
+                for live in flushed:
+                    live.db_dirty = True
+            raise
+        self.counters["db_rows"] += len(rows)
+        return {"live_rows": len(rows)}
+
+    async def run(self):
+        """Background loop started from the app lifespan."""
+        interval = 1.0 / max(settings.live_score_fps, 0.1)
+        next_flush = time.monotonic() + settings.live_score_flush_sec
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.fanout()
+                if time.monotonic() >= next_flush:
+                    next_flush = time.monotonic() + settings.live_score_flush_sec
+                    await asyncio.to_thread(self.flush)
+            except Exception:
+                logger.exception("Live score flush failed")
+
+
+live_scores = LiveScores()
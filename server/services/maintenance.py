@@ -0,0 +1,142 @@
+
+"""
+Periodic maintenance jobs run by the in-process scheduler.
+
+- stale_sessions: cancel running sessions past the game's max duration
+  (Game.max_session_sec, else SESSION_MAX_SEC), e.g. after a game server
+  crashed before calling /sessions/end, so the kiosk can start again.
+- queue_ttl: drop queue entries older than QUEUE_TTL_SEC (opt-in; 0 keeps them).
+  Both sweeps cover the home and every venue database (shards.py).
+- db_analyze / db_vacuum: refresh planner stats and reclaim space (each
+  venue file too on SQLite).
+- retention: archive old session history (see retention.py), if enabled.
+- email_index: fill players.email_bidx for rows that predate it.
+- key_rotation: re-encrypt emails under FERNET_KEY while FERNET_OLD_KEYS is set.
+- balance_sync: resync the queue balancer's kiosk loads (every worker).
+- throughput_flush: write this worker's throughput counters (every worker).
+- outbox_prune: relay venue events, then drop delivered change events older
+  than OUTBOX_KEEP_DAYS.
+- jobs_prune: drop finished background jobs older than JOBS_KEEP_DAYS.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+from .. import models
+from ..database import engine
+from ..settings import settings
+from ..shards import shards
+from .rate_limit import limiter
+from . import balancer, email_index, jobs, key_rotation, outbox, retention, throughput
+from .live_scores import live_scores
+
+
+def _end_stale(db, now: datetime):
+    events = []
+    ended = []
+    rows = (
+        db.query(models.GameSession, models.Game, models.Kiosk)
+        .join(models.Game, models.GameSession.game_id == models.Game.id)
+        .join(models.Kiosk, models.GameSession.kiosk_id == models.Kiosk.id)
+        .filter(models.GameSession.status == "running")
+        .all()
+    )
+    for s, game, kiosk in rows:
+        limit = game.max_session_sec or settings.session_max_sec
+        if limit <= 0 or s.started_at is None or (now - s.started_at).total_seconds() < limit:
+            continue
+        s.status = "cancelled"
+        s.ended_at = now
+        throughput.counters.session_ended(kiosk.id, s.started_at, now)
+        balancer.balancer.session_ended(kiosk.id, s.started_at, now, completed=False)
+        live_scores.end(s.id)
+        outbox.emit(db, "session.cancelled", {"session_id": s.id, "kiosk_id": kiosk.kiosk_id, "game_id": game.game_id, "reason": "timeout"})
+        ended.append(s.id)
+        msg = {"type": "session_ended", "session_id": s.id, "reason": "timeout"}
+        events.append(("kiosk", kiosk.kiosk_id, msg))
+        events.append(("game", game.game_id, {**msg, "kiosk_id": kiosk.kiosk_id}))
+    db.commit()
+    return ended, events
+
+
+def end_stale_sessions(now: Optional[datetime] = None) -> Dict[str, Any]:
+    now = now or datetime.utcnow()
+    events = []
+    ended = []
+    for shard_ended, shard_events in shards.fan_out(_end_stale, now):
+        ended.extend(shard_ended)
+        events.extend(shard_events)
+    return {"cancelled_sessions": ended, "events": events}
+
+
+def _expire_queue(db, cutoff: datetime):
+    rows = (
+        db.query(models.QueueEntry.id, models.Kiosk.kiosk_id, models.QueueEntry.player_id)
+        .join(models.Kiosk, models.QueueEntry.kiosk_id == models.Kiosk.id)
+        .filter(models.QueueEntry.created_at < cutoff)
+        .all()
+    )
+    if rows:
+        db.query(models.QueueEntry).filter(models.QueueEntry.id.in_([r[0] for r in rows])).delete(synchronize_session=False)
+        outbox.emit_many(db, [("queue.expired", {"kiosk_id": kiosk_id, "player_id": pid}) for _, kiosk_id, pid in rows])
+        db.commit()
+    return rows
+
+
+def expire_queue_entries(now: Optional[datetime] = None) -> Dict[str, Any]:
+    if settings.queue_ttl_sec <= 0:
+        return {"expired_entries": 0}
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=settings.queue_ttl_sec)
+    by_kiosk = defaultdict(list)
+    rows = [r for shard_rows in shards.fan_out(_expire_queue, cutoff) for r in shard_rows]
+    for qe_id, kiosk_id, _ in rows:
+        by_kiosk[kiosk_id].append(qe_id)
+    for kiosk_id in by_kiosk:
+        limiter.forget_scans(kiosk_id)
+    return {
+        "expired_entries": len(rows),
+        "events": [("kiosk", kiosk_id, {"type": "queue_update"}) for kiosk_id in by_kiosk],
+    }
+
+
+def _run_autocommit(sql: str, eng=None):
+    # VACUUM can't run inside a transaction on either SQLite or Postgres.
+    with (eng or engine).connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(sql))
+
+
+def _venue_engines():
+    # On SQLite each venue is its own file; on Postgres the home run covers every schema.
+    if engine.dialect.name != "sqlite":
+        return []
+    return [shards.engine_for(v) for v in shards.venues]
+
+
+def db_analyze() -> Dict[str, Any]:
+    _run_autocommit("ANALYZE")
+    for eng in _venue_engines():
+        _run_autocommit("ANALYZE main", eng)
+    return {"analyzed": True}
+
+
+def db_vacuum() -> Dict[str, Any]:
+    _run_autocommit("VACUUM")
+    for eng in _venue_engines():
+        _run_autocommit("VACUUM main", eng)
+    return {"vacuumed": True}
+
+
+def register(scheduler):
+    scheduler.add("stale_sessions", settings.sweep_interval_sec, end_stale_sessions)
+    scheduler.add("queue_ttl", settings.sweep_interval_sec, expire_queue_entries)
+    scheduler.add("db_analyze", settings.db_analyze_interval_sec, db_analyze)
+    scheduler.add("db_vacuum", settings.db_vacuum_interval_sec, db_vacuum)
+    scheduler.add("retention", settings.retention_interval_sec, retention.run_retention)
+    scheduler.add("email_index", settings.email_index_interval_sec, email_index.backfill)
+    scheduler.add("key_rotation", settings.key_rotation_interval_sec, key_rotation.scheduled)
+    scheduler.add("outbox_prune", 3600, outbox.prune)
+    scheduler.add("jobs_prune", 3600, jobs.prune)
+    scheduler.add("balance_sync", settings.sweep_interval_sec, balancer.sync, leased=False)
+    scheduler.add("throughput_flush", settings.throughput_flush_sec, throughput.flush, leased=False)
@@ -0,0 +1,200 @@
+
+"""
+Per-game metric registry and the narrow session_player_metrics table.
+
+SessionPlayer.metrics keeps the raw JSON a game posts. At ingest every
+numeric value is also written as a (session_player, metric, value) row, so
+aggregates by game/mode/metric run in SQL instead of parsing blobs.
+Metrics a game has not declared are registered automatically the first
+time they show up, until the game has METRIC_AUTO_DEFS_MAX defs; set
+indexed=False on a def to stop extracting it. Values are stored as given:
+an "int" def that receives a fraction becomes "float".
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..settings import settings
+from ..shards import shards
+
+logger = logging.getLogger("uvicorn.error")
+
+METRIC_KINDS = {"int", "float"}
+
+
+def _is_number(v: Any) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def load_defs(db: Session, game_id: int) -> Dict[str, models.GameMetricDef]:
+    return {d.name: d for d in db.query(models.GameMetricDef).filter_by(game_id=game_id).all()}
+
+
+def extract_metrics(
+    db: Session,
+    game_id: int,
+    sp: models.SessionPlayer,
+    metrics: Dict[str, Any],
+    defs: Dict[str, models.GameMetricDef],
+) -> int:
+    """Add SessionPlayerMetric rows for the numeric values in `metrics`. Returns rows added."""
+    added = 0
+    for name, value in (metrics or {}).items():
+        if not _is_number(value):
+            continue
+        d = defs.get(name)
+        if d is None:
+            if len(defs) >= settings.metric_auto_defs_max:
+                logger.warning("game %s: not registering metric %r, it already has %d defs", game_id, name, len(defs))
+                continue
+            d = _register_def(db, game_id, name, "int" if isinstance(value, int) else "float")
+            defs[name] = d
+        if not d.indexed:
+            continue
+        if d.kind == "int" and not float(value).is_integer():
+            # Kind only describes the values; a fraction widens it rather than being truncated.
+            logger.info("game %s: metric %r reported %r, widening it to float", game_id, name, value)
+            d.kind = "float"
+        db.add(models.SessionPlayerMetric(session_player_id=sp.id, game_id=game_id, metric=name, value=float(value)))
+        added += 1
+    return added
+
+
+def _register_def(db: Session, game_id: int, name: str, kind: str) -> models.GameMetricDef:
+    d = models.GameMetricDef(game_id=game_id, name=name, kind=kind, indexed=True)
+    db.flush()  # keep the caller's pending changes out of the savepoint
+    try:
+        with db.begin_nested():
+            db.add(d)
+    except IntegrityError:
+        # A concurrent request registered the same name first; use its def.
+        d = db.query(models.GameMetricDef).filter_by(game_id=game_id, name=name).one()
+    return d
+
+
+def _metric_totals(
+    db: Session,
+    game_id: int,
+    metric: str,
+    mode: Optional[str],
+    start: Optional[datetime],
+    end: Optional[datetime],
+    by_mode: bool,
+) -> List[tuple]:
+    """(mode, count, sum, min, max) rows from one shard."""
+    M, SP, GS = models.SessionPlayerMetric, models.SessionPlayer, models.GameSession
+    cols = [func.count(M.value), func.sum(M.value), func.min(M.value), func.max(M.value)]
+    q = (
+        db.query(GS.mode, *cols) if by_mode else db.query(*cols)
+    ).select_from(M).join(SP, M.session_player_id == SP.id).join(GS, SP.session_id == GS.id)
+    q = q.filter(M.game_id == game_id, M.metric == metric)
+    if mode:
+        q = q.filter(GS.mode == mode)
+    if start:
+        q = q.filter(GS.started_at >= start)
+    if end:
+        q = q.filter(GS.started_at < end)
+    if by_mode:
+        q = q.group_by(GS.mode)
+        return [tuple(row) for row in q.all()]
+    return [(mode, *row) for row in q.all()]
+
+
+def metric_stats(
+    db: Session,
+    game_id: int,
+    metric: str,
+    mode: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    by_mode: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    count/avg/min/max/sum of one metric for a game, optionally filtered or
+    grouped by mode. Each venue database aggregates its own rows; the
+    partial totals are combined here.
+    """
+    merged: Dict[Optional[str], List[Any]] = {}
+    for rows in shards.fan_out(_metric_totals, game_id, metric, mode, start, end, by_mode, db=db):
+        for row_mode, count, total, vmin, vmax in rows:
+            acc = merged.get(row_mode)
+            if acc is None:
+                merged[row_mode] = [count, total, vmin, vmax]
+                continue
+            acc[0] += count
+            if total is not None:
+                acc[1] = total if acc[1] is None else acc[1] + total
+                acc[2] = vmin if acc[2] is None else min(acc[2], vmin)
+                acc[3] = vmax if acc[3] is None else max(acc[3], vmax)
+
+    out = []
+    for row_mode in sorted(merged, key=lambda m: (m is not None, m or "")):
+        count, total, vmin, vmax = merged[row_mode]
+        out.append({
+            "mode": row_mode,
+            "count": count,
+            "avg": float(total) / count if count and total is not None else None,
+            "min": vmin,
+            "max": vmax,
+            "sum": total,
+        })
+    return out
+
+
+def backfill(db: Session, batch_size: int = 500) -> Dict[str, int]:
+    """
+    One-off migration for rows written before mode/game_metrics/metric rows
+    existed. Sessions: meta["mode"] -> mode; an ended session whose meta has no
+    "mode" had it overwritten by end_session, so meta is its game_metrics.
+    Session players: extract numeric metrics if none were extracted yet.
+    """
+    stats = {"sessions": 0, "metric_rows": 0}
+    last_id = 0
+    while True:
+        batch = (
+            db.query(models.GameSession)
+            .filter(models.GameSession.id > last_id, models.GameSession.mode.is_(None))
+            .order_by(models.GameSession.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for s in batch:
+            meta = s.meta or {}
+            if "mode" in meta:
+                s.mode = meta["mode"]
+            elif s.status == "ended" and s.game_metrics is None:
+                s.game_metrics = meta
+            if s.mode is None:
+                modes = {(sp.metrics or {}).get("kiosk_mode") for sp in s.players} - {None}
+                s.mode = modes.pop() if len(modes) == 1 else "default"
+            stats["sessions"] += 1
+        last_id = batch[-1].id
+        db.commit()
+
+    defs_by_game: Dict[int, Dict[str, models.GameMetricDef]] = {}
+    last_id = 0
+    has_rows = db.query(models.SessionPlayerMetric.session_player_id).distinct()
+    while True:
+        batch = (
+            db.query(models.SessionPlayer, models.GameSession.game_id)
+            .join(models.GameSession, models.SessionPlayer.session_id == models.GameSession.id)
+            .filter(models.SessionPlayer.id > last_id, models.SessionPlayer.id.not_in(has_rows))
+            .order_by(models.SessionPlayer.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for sp, game_id in batch:
+            defs = defs_by_game.setdefault(game_id, load_defs(db, game_id))
+            stats["metric_rows"] += extract_metrics(db, game_id, sp, sp.metrics or {}, defs)
+        last_id = batch[-1][0].id
+        db.commit()
+    return stats
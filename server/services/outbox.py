@@ -0,0 +1,215 @@
+
+"""
+Transactional outbox: change events written in the same transaction as the
+change they describe, so a committed change always has its event and a
+rolled-back one never does.
+
+Write paths call emit(db, topic, data) (or emit_many) before db.commit().
+Topics:
+- queue.joined / queue.left / queue.moved / queue.cleared / queue.expired
+- session.started / session.ended / session.cancelled
+- player.created / player.updated / player.deleted
+Payloads carry ids and usernames, never emails.
+
+Events are read back in id order by GET /changes?after=<id> (optionally
+long-polling) and by the webhook dispatcher (services/webhooks.py). A commit
+that wrote events wakes both in this process. Other workers' commits are
+picked up by polling. Readers only see events older than settle_ms(), so
+an id that commits after a higher one (Postgres) isn't skipped. Delivered
+events older than OUTBOX_KEEP_DAYS are pruned by the outbox_prune
+maintenance job.
+
+With VENUES (see shards.py) a venue's writes emit into that venue's own
+outbox_events. relay() moves them into the home table, in order and in one
+transaction per batch, where they get ordinary home ids. read() relays
+first, so consumers only ever see the home feed.
+"""
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import MetaData, delete, event, func, insert, select
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal, engine
+from ..settings import settings
+
+logger = logging.getLogger("uvicorn.error")
+
+_PENDING = "outbox_pending"
+_RELAY_BATCH = 500
+_relay_lock = threading.Lock()  # one relay per process; other processes are held off by the row locks
+
+
+def emit(db: Session, topic: str, data: Dict[str, Any]):
+    """Add one event to the caller's transaction."""
+    db.add(models.OutboxEvent(topic=topic, payload=data, created_at=datetime.utcnow()))
+    db.info[_PENDING] = True
+
+
+def emit_many(db: Session, events: Iterable[Tuple[str, Dict[str, Any]]]):
+    now = datetime.utcnow()
+    rows = [{"topic": topic, "payload": data, "created_at": now} for topic, data in events]
+    if rows:
+        db.execute(insert(models.OutboxEvent), rows)
+        db.info[_PENDING] = True
+
+
+class Signal:
+    """Wakes coroutines waiting for new events; notify() may be called from any thread."""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+
+    def _wake(self):
+        if self._event is not None:
+            self._event.set()
+            self._event = None
+
+    def notify(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._wake()
+        else:
+            loop.call_soon_threadsafe(self._wake)
+
+    async def wait(self, timeout: float) -> bool:
+        self._loop = asyncio.get_running_loop()
+        if self._event is None:
+            self._event = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+signal = Signal()
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _after_commit(session: Session):
+    if session.info.pop(_PENDING, False):
+        signal.notify()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _after_rollback(session: Session):
+    session.info.pop(_PENDING, None)
+
+
+def _row(e: models.OutboxEvent) -> Dict[str, Any]:
+    return {"id": e.id, "topic": e.topic, "created_at": e.created_at.isoformat() if e.created_at else None, "data": e.payload or {}}
+
+
+def relay() -> int:
+    """Move events emitted in venue databases into the home outbox. Returns how many moved."""
+    from ..shards import shards
+
+    moved = 0
+    if not shards.venues:
+        return moved
+    E = models.OutboxEvent
+    home = E.__table__.to_metadata(MetaData(), schema=shards.home_namespace())
+    with _relay_lock:
+        for venue in shards.venues:
+            moved += _relay_venue(shards.engine_for(venue), home)
+    return moved
+
+
+def _relay_venue(venue_engine, home) -> int:
+    E = models.OutboxEvent
+    moved = 0
+    while True:
+        # One transaction on the venue engine covers both databases (the
+        # ATTACHed home file or the public schema), so a batch is moved
+        # exactly once; FOR UPDATE makes a concurrent relay wait and skip it.
+        with SessionLocal(bind=venue_engine) as db:
+            rows = db.execute(
+                select(E.id, E.topic, E.payload).order_by(E.id).limit(_RELAY_BATCH).with_for_update()
+            ).all()
+            if not rows:
+                break
+            # Stamped with the relay time: the settle window in read() is measured from when a row enters the home feed.
+            now = datetime.utcnow()
+            db.execute(insert(home), [{"topic": r.topic, "payload": r.payload, "created_at": now} for r in rows])
+            db.execute(delete(E).where(E.id.in_([r.id for r in rows])))
+            db.info[_PENDING] = True
+            db.commit()
+        moved += len(rows)
+        if len(rows) < _RELAY_BATCH:
+            break
+    return moved
+
+
+def settle_ms() -> int:
+    """
+    How old an event must be before readers see it. Readers advance an id
+    cursor, so an id that commits after a higher one would be skipped. On
+    Postgres sequence ids do commit out of order; SQLite has one writer.
+    """
+    if settings.outbox_settle_ms is not None:
+        return settings.outbox_settle_ms
+    return 2000 if engine.dialect.name == "postgresql" else 0
+
+
+def read(after: int, limit: int) -> List[Dict[str, Any]]:
+    """Events with id > after, oldest first. Blocking; run off the loop."""
+    try:
+        relay()
+    except Exception:
+        # A venue database that is down (or a relay in another process) holds back only its own events.
+        logger.exception("Outbox relay failed")
+    E = models.OutboxEvent
+    stmt = select(E).where(E.id > after).order_by(E.id).limit(limit)
+    settle = settle_ms()
+    if settle > 0:
+        stmt = stmt.where(E.created_at < datetime.utcnow() - timedelta(milliseconds=settle))
+    with SessionLocal() as db:
+        return [_row(e) for e in db.execute(stmt).scalars()]
+
+
+def latest_id() -> int:
+    with SessionLocal() as db:
+        return db.execute(select(func.max(models.OutboxEvent.id))).scalar() or 0
+
+
+async def changes(after: int, limit: int, wait: float) -> List[Dict[str, Any]]:
+    """read(), waiting up to `wait` seconds for the first event if there is none yet."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        events = await asyncio.to_thread(read, after, limit)
+        remaining = deadline - loop.time()
+        if events or remaining <= 0:
+            return events
+        # Commits in other workers don't notify this one, so re-check at least once a second.
+        await signal.wait(min(remaining, 1.0))
+
+
+def prune(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Delete events older than OUTBOX_KEEP_DAYS that every webhook endpoint has acknowledged."""
+    relayed = relay()
+    if settings.outbox_keep_days <= 0:
+        return {"outbox_relayed": relayed, "outbox_pruned": 0}
+    from .webhooks import min_cursor
+
+    E = models.OutboxEvent
+    cutoff = (now or datetime.utcnow()) - timedelta(days=settings.outbox_keep_days)
+    stmt = delete(E).where(E.created_at < cutoff)
+    floor = min_cursor()
+    if floor is not None:
+        stmt = stmt.where(E.id <= floor)
+    with engine.begin() as conn:
+        n = conn.execute(stmt).rowcount
+    return {"outbox_relayed": relayed, "outbox_pruned": n}
@@ -0,0 +1,145 @@
+
+"""
+Player directory search.
+
+SQLite: an external-content FTS5 table (trigram tokenizer) over
+players.username/name, kept in sync by triggers. Postgres: pg_trgm GIN
+indexes on the same columns. Results are keyset-paginated with an opaque
+cursor so deep pages cost the same as the first.
+"""
+import base64
+import json
+import logging
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("uvicorn.error")
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS players_fts USING fts5("
+    " username, name, content='players', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS players_fts_ai AFTER INSERT ON players BEGIN"
+    " INSERT INTO players_fts(rowid, username, name) VALUES (new.id, new.username, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS players_fts_ad AFTER DELETE ON players BEGIN"
+    " INSERT INTO players_fts(players_fts, rowid, username, name) VALUES ('delete', old.id, old.username, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS players_fts_au AFTER UPDATE OF username, name ON players BEGIN"
+    " INSERT INTO players_fts(players_fts, rowid, username, name) VALUES ('delete', old.id, old.username, old.name);"
+    " INSERT INTO players_fts(rowid, username, name) VALUES (new.id, new.username, new.name); END",
+    "INSERT INTO players_fts(players_fts) VALUES ('rebuild')",
+]
+
+_POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_players_username_trgm ON players USING gin (username gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_players_name_trgm ON players USING gin (name gin_trgm_ops)",
+]
+
+_has_index: Optional[bool] = None
+
+
+def ensure_index(engine: Engine):
+    """Create the search index for the current dialect. Called from init_schema()."""
+    global _has_index
+    ddl = _POSTGRES_DDL if engine.dialect.name == "postgresql" else _SQLITE_DDL
+    try:
+        with engine.begin() as conn:
+            for stmt in ddl:
+                conn.execute(text(stmt))
+        _has_index = True
+    except (OperationalError, ProgrammingError) as e:
+        # e.g. SQLite < 3.34 (no trigram tokenizer) or no rights to CREATE EXTENSION
+        logger.warning("Player search index unavailable, falling back to LIKE: %s", e)
+        _has_index = False
+
+
+def _index_available(db: Session) -> bool:
+    global _has_index
+    if _has_index is None:
+        if db.bind.dialect.name == "postgresql":
+            _has_index = True
+        else:
+            row = db.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'players_fts'")).first()
+            _has_index = row is not None
+    return _has_index
+
+
+def encode_cursor(sort_value: Any, player_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort_value, player_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    sort_value, player_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return sort_value, int(player_id)
+
+
+def _like_escape(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _trigrams(q: str) -> List[str]:
+    q = q.lower()
+    return sorted({q[i:i + 3] for i in range(len(q) - 2)})
+
+
+def search_player_ids(
+    db: Session, q: str, limit: int, cursor: Optional[str] = None, fuzzy: bool = False
+) -> Tuple[List[int], Optional[str]]:
+    """
+    Return (player_ids, next_cursor) for a query against username/name.
+
+    Default mode: case-insensitive substring match (which includes prefixes),
+    ordered by username. fuzzy=True: rank by trigram overlap so typos still
+    match, best first.
+    """
+    q = q.strip()
+    after = decode_cursor(cursor) if cursor else None
+    params: dict = {"limit": limit + 1}
+    dialect = db.bind.dialect.name
+
+    if fuzzy and len(q) >= 3 and _index_available(db):
+        if dialect == "postgresql":
+            base = (
+                "SELECT id, -GREATEST(similarity(username, :q), similarity(coalesce(name, ''), :q)) AS score"
+                " FROM players WHERE username % :q OR name % :q"
+            )
+        else:
+            base = "SELECT rowid AS id, bm25(players_fts) AS score FROM players_fts WHERE players_fts MATCH :m"
+            params["m"] = " OR ".join('"%s"' % t.replace('"', '""') for t in _trigrams(q))
+        params["q"] = q
+        sql = f"SELECT id, score FROM ({base}) s"
+        if after:
+            sql += " WHERE score > :after_v OR (score = :after_v AND id > :after_id)"
+            params.update(after_v=after[0], after_id=after[1])
+        sql += " ORDER BY score, id LIMIT :limit"
+    else:
+        pat = f"%{_like_escape(q)}%" if len(q) >= 3 else f"{_like_escape(q)}%"
+        conds = []
+        source = "players"
+        if dialect == "postgresql":
+            conds.append("(username ILIKE :pat ESCAPE '\\' OR name ILIKE :pat ESCAPE '\\')")
+            params["pat"] = pat
+        elif len(q) >= 3 and _index_available(db):
+            # A quoted phrase on the trigram table is an index-backed substring match
+            source = "(SELECT rowid AS id, username, name FROM players_fts WHERE players_fts MATCH :m)"
+            params["m"] = '"%s"' % q.replace('"', '""')
+        else:
+            conds.append("(username LIKE :pat ESCAPE '\\' OR name LIKE :pat ESCAPE '\\')")
+            params["pat"] = pat
+        if after:
+            conds.append("(username > :after_v OR (username = :after_v AND id > :after_id))")
+            params.update(after_v=after[0], after_id=after[1])
+        sql = f"SELECT id, username AS score FROM {source} p"
+        if conds:
+            sql += " WHERE " + " AND ".join(conds)
+        sql += " ORDER BY username, id LIMIT :limit"
+
+    rows = db.execute(text(sql), params).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    return [r[0] for r in rows], next_cursor
@@ -0,0 +1,195 @@
+
+"""
+In-process diagnostics for a live server (admin endpoints under /ui/debug).
+
+sample(): a background thread reads every thread's current stack with
+sys._current_frames() PROFILE_SAMPLE_HZ times a second and counts identical
+stacks. The output is collapsed stacks ("thread;outer;...;inner count"),
+which flamegraph.pl, speedscope and similar tools read directly. The thread
+running the event loop is labelled "event-loop". In the same window a probe
+task measures how late the loop wakes up from short sleeps (event-loop lag).
+Sampling only reads frames, so its cost is a few microseconds per sample.
+
+Memory: tracemalloc is started on demand. Each snapshot is compared with the
+previous one, so two snapshots a few minutes apart show what grew.
+"""
+import asyncio
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from ..settings import settings
+
+_LAG_PROBE_SEC = 0.01
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})"
+
+
+def _thread_names() -> Dict[int, str]:
+    return {t.ident: t.name for t in threading.enumerate() if t.ident is not None}
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, hz: float, loop_thread: Optional[int]):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = 1.0 / hz
+        self.loop_thread = loop_thread
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.overhead_sec = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        names = _thread_names()
+        while not self._stop_event.wait(self.interval):
+            t0 = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = _thread_names()
+                parts = []
+                while frame is not None:
+                    parts.append(_frame_label(frame))
+                    frame = frame.f_back
+                root = "event-loop" if ident == self.loop_thread else names.get(ident, f"thread-{ident}")
+                parts.append(root)
+                self.stacks[";".join(reversed(parts))] += 1
+            self.samples += 1
+            self.overhead_sec += time.perf_counter() - t0
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+async def _probe_lag(until: float) -> List[float]:
+    lags = []
+    loop = asyncio.get_running_loop()
+    while loop.time() < until:
+        t0 = loop.time()
+        await asyncio.sleep(_LAG_PROBE_SEC)
+        lags.append(max(0.0, loop.time() - t0 - _LAG_PROBE_SEC))
+    return lags
+
+
+def _lag_stats(lags: List[float]) -> Dict[str, Any]:
+    if not lags:
+        return {"probes": 0}
+    ordered = sorted(lags)
+    pick = lambda p: round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+    return {
+        "probes": len(lags),
+        "avg_ms": round(sum(lags) / len(lags) * 1000, 2),
+        "p50_ms": pick(0.5),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+_profile_lock = asyncio.Lock()
+
+
+def busy() -> bool:
+    return _profile_lock.locked()
+
+
+async def sample(seconds: float, hz: Optional[float] = None) -> Dict[str, Any]:
+    """Sample all threads for `seconds` while probing event-loop lag. One run at a time."""
+    hz = hz or settings.profile_sample_hz
+    async with _profile_lock:
+        loop = asyncio.get_running_loop()
+        sampler = _Sampler(hz, threading.get_ident())
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            lags = await _probe_lag(loop.time() + seconds)
+        finally:
+            sampler.stop()
+        elapsed = time.perf_counter() - started
+    return {
+        "seconds": round(elapsed, 2),
+        "hz": hz,
+        "samples": sampler.samples,
+        "sampler_overhead_pct": round(100 * sampler.overhead_sec / elapsed, 2) if elapsed else None,
+        "event_loop_lag": _lag_stats(lags),
+        "stacks": sampler.stacks,
+    }
+
+
+def collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in stacks.most_common())
+
+
+def top_frames(stacks: Counter, limit: int = 25) -> List[Dict[str, Any]]:
+    """Leaf frames by sample count (self time), across threads."""
+    leaves: Counter = Counter()
+    for stack, n in stacks.items():
+        leaves[stack.rsplit(";", 1)[-1]] += n
+    total = sum(leaves.values()) or 1
+    return [{"frame": f, "samples": n, "pct": round(100 * n / total, 1)} for f, n in leaves.most_common(limit)]
+
+
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+]
+
+
+def memory_start(frames: int = 1) -> Dict[str, Any]:
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        _last_snapshot = None
+    return memory_status()
+
+
+def memory_stop() -> Dict[str, Any]:
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+    return memory_status()
+
+
+def memory_status() -> Dict[str, Any]:
+    tracing = tracemalloc.is_tracing()
+    current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+    return {
+        "tracing": tracing,
+        "frames": tracemalloc.get_traceback_limit() if tracing else None,
+        "traced_kb": round(current / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def memory_snapshot(top: int = 25, group_by: str = "lineno") -> Dict[str, Any]:
+    """Top allocation sites now, and the change since the previous snapshot. Blocking; run off the loop."""
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not running")
+    snap = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+    fmt = lambda tb: " <- ".join(f"{f.filename.rsplit('/', 1)[-1]}:{f.lineno}" for f in tb)
+    out = {
+        **memory_status(),
+        "top": [
+            {"site": fmt(s.traceback), "size_kb": round(s.size / 1024, 1), "count": s.count}
+            for s in snap.statistics(group_by)[:top]
+        ],
+        "diff": None,
+    }
+    if _last_snapshot is not None:
+        out["diff"] = [
+            {"site": fmt(d.traceback), "size_diff_kb": round(d.size_diff / 1024, 1), "count_diff": d.count_diff, "size_kb": round(d.size / 1024, 1)}
+            for d in snap.compare_to(_last_snapshot, group_by)[:top]
+        ]
+    _last_snapshot = snap
+    return out
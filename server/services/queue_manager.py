@@ -1,37 +1,262 @@
 
-from typing import Dict, Set
+from typing import Dict, Set, List, Any, Deque, Optional, Tuple
+from collections import deque
 from starlette.websockets import WebSocket
 from asyncio import Lock
+import asyncio
 import json
+import time
+import uuid
+
+from ..settings import settings
+
+# Event types that may be merged within the WS_COALESCE_MS window, per group.
+# Anything else (session_started, session_ended, ...) is delivered immediately.
+COALESCE_TYPES: Dict[str, Set[str]] = {
+    "kiosk": {"queue_update"},
+    "game": {"game_ready", "admin_reset"},
+}
 
 class WebSocketHub:
     def __init__(self):
         self.kiosk_clients: Dict[str, Set[WebSocket]] = {}
         self.game_clients: Dict[str, Set[WebSocket]] = {}
+        # ws -> {"group", "key", "connected_at", "last_seen", "pong"} (monotonic seconds)
+        self._conn_info: Dict[WebSocket, Dict[str, Any]] = {}
+        # (group, key) -> last assigned seq / ring buffer of recent sequenced events
+        self._seq: Dict[Tuple[str, str], int] = {}
+        self._buffers: Dict[Tuple[str, str], Deque[dict]] = {}
+        # Clients echo the epoch back with ?since=; a mismatch means seqs were reset.
+        self.epoch = "db" if settings.ws_event_persist else uuid.uuid4().hex[:12]
+        # (group, key) -> {(type, kiosk_id): latest message} awaiting a coalesced flush
+        self._pending: Dict[Tuple[str, str], Dict[Tuple[Any, Any], dict]] = {}
+        self._flush_handles: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        self._flush_tasks: Set[asyncio.Task] = set()
         self._lock = Lock()
 
-    async def register(self, group: str, key: str, ws: WebSocket):
+    def _target(self, group: str) -> Dict[str, Set[WebSocket]]:
+        return self.kiosk_clients if group == "kiosk" else self.game_clients
+
+    async def register(self, group: str, key: str, ws: WebSocket, pong: bool = False) -> bool:
+        """
+        Track a connection. Returns False (without registering) when the
+        per-key or global connection cap is reached. pong=True means the
+        client answers pings, so silence alone gets it evicted.
+        """
         async with self._lock:
-            target = self.kiosk_clients if group == "kiosk" else self.game_clients
+            target = self._target(group)
+            if len(self._conn_info) >= settings.ws_max_connections:
+                return False
+            if len(target.get(key, ())) >= settings.ws_max_per_key:
+                return False
             target.setdefault(key, set()).add(ws)
+            now = time.monotonic()
+            # "held" collects frames for this socket until release(), so they
+            # can't overtake the hello/replay that _serve sends first.
+            self._conn_info[ws] = {"group": group, "key": key, "connected_at": now, "last_seen": now, "pong": pong, "held": []}
+            return True
+
+    async def release(self, ws: WebSocket):
+        """Send the frames held since register(), then deliver live frames directly."""
+        info = self._conn_info.get(ws)
+        if info is None:
+            return
+        held = info["held"]
+        while held:
+            await ws.send_text(held.pop(0))
+        info["held"] = None
+
+    async def _send(self, ws: WebSocket, payload: str):
+        info = self._conn_info.get(ws)
+        if info is not None and info["held"] is not None:
+            info["held"].append(payload)
+            return
+        await ws.send_text(payload)
 
     async def unregister(self, group: str, key: str, ws: WebSocket):
         async with self._lock:
-            target = self.kiosk_clients if group == "kiosk" else self.game_clients
+            target = self._target(group)
             conns = target.get(key, set())
             if ws in conns:
                 conns.remove(ws)
             if not conns:
                 target.pop(key, None)
+            self._conn_info.pop(ws, None)
+
+    def touch(self, ws: WebSocket):
+        """Record inbound traffic (pong or any other frame) from a client."""
+        info = self._conn_info.get(ws)
+        if info is not None:
+            info["last_seen"] = time.monotonic()
+
+    async def _drop(self, group: str, key: str, ws: WebSocket):
+        try: await ws.close()
+        except Exception: pass
+        await self.unregister(group, key, ws)
+
+    def current_seq(self, group: str, key: str) -> int:
+        return self._seq.get((group, key), 0)
+
+    def _record(self, group: str, key: str, message: dict) -> dict:
+        channel = (group, key)
+        seq = self._seq.get(channel, 0) + 1
+        self._seq[channel] = seq
+        event = {**message, "seq": seq}
+        buf = self._buffers.get(channel)
+        if buf is None:
+            buf = self._buffers[channel] = deque(maxlen=settings.ws_replay_buffer)
+        buf.append(event)
+        return event
+
+    def backlog(self, group: str, key: str, since: int, epoch: Optional[str] = None) -> Optional[List[dict]]:
+        """
+        Events on the channel with seq > since, or None when the client must
+        do a full resync (different epoch, or the gap fell out of the buffer).
+        """
+        current = self.current_seq(group, key)
+        if (epoch and epoch != self.epoch) or since > current:
+            return None
+        if since == current:
+            return []
+        buf = self._buffers.get((group, key))
+        if not buf or buf[0]["seq"] > since + 1:
+            return None
+        return [e for e in buf if e["seq"] > since]
 
     async def broadcast(self, group: str, key: str, message: dict):
-        target = self.kiosk_clients if group == "kiosk" else self.game_clients
+        """
+        Send a message to every socket on the channel. Coalescable types are
+        held for WS_COALESCE_MS and a repeat of the same (type, kiosk_id)
+        replaces the held copy, so a burst turns into one delivery. Other
+        types flush anything held on the channel first, keeping order.
+        """
+        window = settings.ws_coalesce_ms / 1000
+        channel = (group, key)
+        if window > 0 and message.get("type") in COALESCE_TYPES.get(group, ()):
+            pending = self._pending.setdefault(channel, {})
+            pending[(message.get("type"), message.get("kiosk_id"))] = message
+            if channel not in self._flush_handles:
+                loop = asyncio.get_running_loop()
+                self._flush_handles[channel] = loop.call_later(window, self._schedule_flush, group, key)
+            return
+        await self.flush_channel(group, key)
+        await self._deliver(group, key, message)
+
+    async def send_transient(self, group: str, key: str, message: dict):
+        """
+        Deliver without a seq or replay buffering, for high-rate state
+        snapshots that a reconnecting client re-reads instead of replaying.
+        """
+        payload = json.dumps(message)
+        for ws in list(self._target(group).get(key, set())):
+            try:
+                await self._send(ws, payload)
+            except Exception:
+                await self._drop(group, key, ws)
+
+    def _schedule_flush(self, group: str, key: str):
+        task = asyncio.ensure_future(self.flush_channel(group, key))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush_channel(self, group: str, key: str):
+        handle = self._flush_handles.pop((group, key), None)
+        if handle is not None:
+            handle.cancel()
+        pending = self._pending.pop((group, key), None)
+        for message in (pending or {}).values():
+            await self._deliver(group, key, message)
+
+    async def flush_all(self):
+        for group, key in list(self._pending):
+            await self.flush_channel(group, key)
+
+    async def _deliver(self, group: str, key: str, message: dict):
+        # _record and the target snapshot must not be separated by an await,
+        # otherwise a client registering in between could miss or double the event.
+        event = self._record(group, key, message)
+        target = self._target(group)
+        payload = json.dumps(event)
         for ws in list(target.get(key, set())):
             try:
-                await ws.send_text(json.dumps(message))
+                await self._send(ws, payload)
+            except Exception:
+                await self._drop(group, key, ws)
+        if settings.ws_event_persist:
+            await asyncio.to_thread(self._persist, group, key, event)
+
+    def _persist(self, group: str, key: str, event: dict):
+        from ..database import SessionLocal
+        from .. import models
+        with SessionLocal() as db:
+            db.add(models.HubEvent(group_name=group, channel_key=key, seq=event["seq"], payload=event))
+            db.commit()
+
+    def load_persisted(self):
+        """
+        Restore seq counters and ring buffers from hub_events at startup and
+        prune rows that no longer fit in the buffer. Sync; call off the loop.
+        """
+        from sqlalchemy import func
+        from ..database import SessionLocal
+        from .. import models
+        HE = models.HubEvent
+        with SessionLocal() as db:
+            channels = (
+                db.query(HE.group_name, HE.channel_key, func.max(HE.seq))
+                .group_by(HE.group_name, HE.channel_key)
+                .all()
+            )
+            for group, key, max_seq in channels:
+                floor = max_seq - settings.ws_replay_buffer
+                db.query(HE).filter(HE.group_name == group, HE.channel_key == key, HE.seq <= floor).delete(synchronize_session=False)
+                rows = (
+                    db.query(HE.payload)
+                    .filter(HE.group_name == group, HE.channel_key == key)
+                    .order_by(HE.seq.asc())
+                    .all()
+                )
+                self._seq[(group, key)] = max_seq
+                self._buffers[(group, key)] = deque((r[0] for r in rows), maxlen=settings.ws_replay_buffer)
+            db.commit()
+
+    async def heartbeat_once(self):
+        """
+        Ping every connection and evict those whose send fails or stalls.
+        Clients that connected with ?pong=1 answer with {"type": "pong"} and
+        are also evicted once silent longer than interval + timeout; the
+        others (listen-only dashboards, scripts) never have to speak.
+        """
+        now = time.monotonic()
+        deadline = settings.ws_ping_interval + settings.ws_ping_timeout
+        ping = json.dumps({"type": "ping"})
+        for ws, info in list(self._conn_info.items()):
+            if info["pong"] and now - info["last_seen"] > deadline:
+                await self._drop(info["group"], info["key"], ws)
+                continue
+            try:
+                await asyncio.wait_for(self._send(ws, ping), timeout=settings.ws_ping_timeout)
             except Exception:
-                try: await ws.close()
-                except Exception: pass
-                await self.unregister(group, key, ws)
+                await self._drop(info["group"], info["key"], ws)
+
+    async def run_heartbeat(self):
+        """Background loop started from the app lifespan."""
+        while True:
+            await asyncio.sleep(settings.ws_ping_interval)
+            await self.heartbeat_once()
+
+    def connection_stats(self, group: str, key: str) -> List[Dict[str, float]]:
+        """Age and idle time (seconds) for each live connection under group/key."""
+        now = time.monotonic()
+        out = []
+        for ws in list(self._target(group).get(key, ())):
+            info = self._conn_info.get(ws)
+            if info is None:
+                continue
+            out.append({
+                "age_sec": round(now - info["connected_at"], 1),
+                "idle_sec": round(now - info["last_seen"], 1),
+            })
+        return out
 
 hub = WebSocketHub()
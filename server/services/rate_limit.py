@@ -0,0 +1,156 @@
+
+"""
+Admission control for kiosk endpoints.
+
+Every kiosk gets a token bucket per endpoint class ("scan", "queue"), and
+each class also has a global bucket shared by all kiosks. A request that
+finds either bucket empty is rejected with 429 and a Retry-After hint, so
+one stuck reader or runaway tab can't starve the rest of the floor. On the
+kiosk read routes (queue, status) only requests that carry the kiosk's API
+key draw on its bucket; anonymous readers all share the ANONYMOUS bucket
+(and the global one), so they can't drain a kiosk's bucket but are still
+shed under load.
+
+Repeat scans of the same tag at the same kiosk inside SCAN_DEBOUNCE_SEC
+are answered from memory (no DB work, no broadcast). Scan attempts are
+counted per kiosk over a sliding minute; kiosks above SCAN_ANOMALY_PER_MIN
+are logged and flagged in the admin kiosk details.
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from ..settings import settings
+
+logger = logging.getLogger("uvicorn.error")
+
+_MAX_KEYS = 1024
+ANONYMOUS = "?"  # bucket key shared by unauthenticated callers; "*" is the global bucket
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Consume one token. Returns 0 on success, else seconds until one is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def idle_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class RateLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._recent_scans: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+        self._scan_times: Dict[str, Deque[float]] = {}
+        self._flagged: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {"allowed": 0, "limited": 0, "debounced": 0}
+
+    def _limits(self, cls: str) -> Tuple[float, float, float]:
+        if cls == "scan":
+            return settings.rate_scan_per_sec, settings.rate_scan_burst, settings.rate_scan_global_per_sec
+        return settings.rate_queue_per_sec, settings.rate_queue_burst, settings.rate_queue_global_per_sec
+
+    def _bucket(self, cls: str, key: str, rate: float, burst: float) -> TokenBucket:
+        b = self._buckets.get((cls, key))
+        if b is None:
+            if len(self._buckets) >= _MAX_KEYS:
+                now = time.monotonic()
+                self._buckets = {k: v for k, v in self._buckets.items() if not v.idle_full(now)}
+            b = self._buckets[(cls, key)] = TokenBucket(rate, burst)
+        return b
+
+    def check(self, cls: str, kiosk_id: str):
+        """Admit one request of class `cls` for `kiosk_id`, or raise 429 with Retry-After."""
+        rate, burst, global_rate = self._limits(cls)
+        now = time.monotonic()
+        with self._lock:
+            wait = 0.0
+            if rate > 0:
+                wait = self._bucket(cls, kiosk_id, rate, burst).take(now)
+            if not wait and global_rate > 0:
+                wait = self._bucket(cls, "*", global_rate, global_rate).take(now)
+            if wait:
+                self.counters["limited"] += 1
+            else:
+                self.counters["allowed"] += 1
+        if wait:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+    def record_scan(self, kiosk_id: str):
+        """Count a scan attempt (admitted or not) and flag kiosks with an abnormal rate."""
+        now = time.monotonic()
+        threshold = settings.scan_anomaly_per_min
+        with self._lock:
+            times = self._scan_times.setdefault(kiosk_id, deque())
+            times.append(now)
+            while times and now - times[0] > 60.0:
+                times.popleft()
+            rate = len(times)
+            newly_flagged = threshold > 0 and rate > threshold and kiosk_id not in self._flagged
+            if newly_flagged:
+                self._flagged[kiosk_id] = now
+            elif kiosk_id in self._flagged and rate <= threshold // 2:
+                del self._flagged[kiosk_id]
+        if newly_flagged:
+            logger.warning("Kiosk %s scan rate anomalous: %d scans in the last minute (threshold %d)", kiosk_id, rate, threshold)
+
+    def debounced_scan(self, kiosk_id: str, uid: str) -> Optional[Dict[str, Any]]:
+        """Return the cached response if this tag was just scanned at this kiosk."""
+        window = settings.scan_debounce_sec
+        if window <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            hit = self._recent_scans.get((kiosk_id, uid))
+            if hit and now - hit[0] < window:
+                self.counters["debounced"] += 1
+                return {**hit[1], "debounced": True}
+        return None
+
+    def remember_scan(self, kiosk_id: str, uid: str, response: Dict[str, Any]):
+        window = settings.scan_debounce_sec
+        if window <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._recent_scans) >= _MAX_KEYS:
+                self._recent_scans = {k: v for k, v in self._recent_scans.items() if now - v[0] < window}
+            self._recent_scans[(kiosk_id, uid)] = (now, response)
+
+    def forget_scans(self, kiosk_id: str):
+        """Drop cached scan responses for a kiosk (its queue changed underneath them)."""
+        with self._lock:
+            self._recent_scans = {k: v for k, v in self._recent_scans.items() if k[0] != kiosk_id}
+
+    def kiosk_stats(self, kiosk_id: str) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            times = self._scan_times.get(kiosk_id) or ()
+            return {
+                "scans_last_min": sum(1 for t in times if now - t <= 60.0),
+                "scan_rate_anomalous": kiosk_id in self._flagged,
+            }
+
+
+limiter = RateLimiter()
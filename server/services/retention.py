@@ -0,0 +1,195 @@
+
+"""
+Session history retention.
+
+Finished sessions older than RETENTION_DAYS are rolled up into
+session_daily_summaries, appended to a compressed NDJSON archive per month
+(ARCHIVE_DIR/sessions-YYYY-MM.ndjson.zst, or .gz without zstandard), and
+then deleted in bounded batches. Each batch is one transaction, and the
+archive is written before the delete commits, so an interrupted run can
+only leave duplicates in the archive (readers drop them), never lose rows.
+With VENUES each venue database is swept in turn (shards.py).
+"""
+import gzip
+import io
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy.orm import Session, selectinload
+
+from .. import models
+from ..database import SessionLocal
+from ..settings import settings
+from ..shards import shards
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def archive_path(month: str, ext: Optional[str] = None) -> str:
+    if ext is None:
+        ext = ".zst" if _zstd() else ".gz"
+    return os.path.join(settings.archive_dir, f"sessions-{month}.ndjson{ext}")
+
+
+def _append_compressed(path: str, lines: List[str]):
+    """Append one compressed frame/member; both zstd and gzip readers concatenate them."""
+    data = "".join(lines).encode()
+    if path.endswith(".zst"):
+        data = _zstd().ZstdCompressor(level=10).compress(data)
+    else:
+        data = gzip.compress(data)
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def archived_months() -> List[str]:
+    if not os.path.isdir(settings.archive_dir):
+        return []
+    months = set()
+    for fname in os.listdir(settings.archive_dir):
+        if fname.startswith("sessions-") and ".ndjson" in fname:
+            months.add(fname[len("sessions-"):len("sessions-") + 7])
+    return sorted(months)
+
+
+def read_archive_month(month: str) -> Iterator[Dict[str, Any]]:
+    """Yield archived session records for YYYY-MM (deduplicated by session_id)."""
+    seen = set()
+    for ext in (".zst", ".gz"):
+        path = archive_path(month, ext)
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as raw:
+            if ext == ".zst":
+                zstd = _zstd()
+                if zstd is None:
+                    raise RuntimeError("Reading .zst archives requires the zstandard package")
+                stream = zstd.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+            else:
+                stream = gzip.GzipFile(fileobj=raw)
+            for line in io.TextIOWrapper(stream, encoding="utf-8"):
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                if rec["session_id"] in seen:
+                    continue
+                seen.add(rec["session_id"])
+                yield rec
+
+
+def _archive_record(s: models.GameSession, games: Dict[int, str], kiosks: Dict[int, str]) -> Dict[str, Any]:
+    return {
+        "session_id": s.id,
+        "game_id": games.get(s.game_id),
+        "kiosk_id": kiosks.get(s.kiosk_id),
+        "status": s.status,
+        "started_at": s.started_at.isoformat() if s.started_at else None,
+        "ended_at": s.ended_at.isoformat() if s.ended_at else None,
+        "meta": s.meta or {},
+        "mode": s.mode,
+        "game_metrics": s.game_metrics or {},
+        "players": [
+            {
+                "player_id": sp.player_id,
+                "score": sp.score,
+                "play_time_sec": sp.play_time_sec,
+                "metrics": sp.metrics or {},
+            }
+            for sp in s.players
+        ],
+    }
+
+
+def _rollup(db: Session, sessions: List[models.GameSession]):
+    totals: Dict[tuple, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for s in sessions:
+        key = ((s.started_at or s.ended_at).date(), s.game_id, s.kiosk_id)
+        t = totals[key]
+        t["sessions"] += 1
+        for sp in s.players:
+            t["player_slots"] += 1
+            t["total_score"] += sp.score or 0
+            t["total_play_time_sec"] += sp.play_time_sec or 0
+            t["max_score"] = max(t["max_score"], sp.score or 0)
+    for (day, game_id, kiosk_id), t in totals.items():
+        row = db.query(models.SessionDailySummary).filter_by(day=day, game_id=game_id, kiosk_id=kiosk_id).first()
+        if row is None:
+            row = models.SessionDailySummary(
+                day=day, game_id=game_id, kiosk_id=kiosk_id,
+                sessions=0, player_slots=0, total_score=0, max_score=0, total_play_time_sec=0,
+            )
+            db.add(row)
+        row.sessions += t["sessions"]
+        row.player_slots += t["player_slots"]
+        row.total_score += t["total_score"]
+        row.total_play_time_sec += t["total_play_time_sec"]
+        row.max_score = max(row.max_score, t["max_score"])
+
+
+def run_retention(
+    horizon_days: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    max_batches: Optional[int] = None,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Archive and delete finished sessions older than the horizon. Returns run stats."""
+    horizon_days = settings.retention_days if horizon_days is None else horizon_days
+    batch_size = batch_size or settings.retention_batch_size
+    stats = {"archived_sessions": 0, "archived_players": 0, "batches": 0, "months": []}
+    if horizon_days <= 0:
+        return stats
+    cutoff = (now or datetime.utcnow()) - timedelta(days=horizon_days)
+    os.makedirs(settings.archive_dir, exist_ok=True)
+    months = set()
+
+    with SessionLocal() as db:
+        games = {g.id: g.game_id for g in db.query(models.Game).all()}
+        kiosks = {k.id: k.kiosk_id for k in db.query(models.Kiosk).all()}
+    # Each shard is swept in turn; the rollups land in the home summaries table.
+    for venue in shards.names():
+        with shards.session(venue) as db:
+            while max_batches is None or stats["batches"] < max_batches:
+                batch = (
+                    db.query(models.GameSession)
+                    .options(selectinload(models.GameSession.players))
+                    .filter(models.GameSession.status != "running")
+                    .filter(models.GameSession.started_at < cutoff)
+                    .order_by(models.GameSession.id.asc())
+                    .limit(batch_size)
+                    .all()
+                )
+                if not batch:
+                    break
+                by_month: Dict[str, List[str]] = defaultdict(list)
+                for s in batch:
+                    month = s.started_at.strftime("%Y-%m")
+                    by_month[month].append(json.dumps(_archive_record(s, games, kiosks)) + "\n")
+                for month, lines in by_month.items():
+                    _append_compressed(archive_path(month), lines)
+                    months.add(month)
+
+                _rollup(db, batch)
+                ids = [s.id for s in batch]
+                sp_ids = db.query(models.SessionPlayer.id).filter(models.SessionPlayer.session_id.in_(ids))
+                db.query(models.SessionPlayerMetric).filter(models.SessionPlayerMetric.session_player_id.in_(sp_ids)).delete(synchronize_session=False)
+                n_players = db.query(models.SessionPlayer).filter(models.SessionPlayer.session_id.in_(ids)).delete(synchronize_session=False)
+                db.query(models.GameSession).filter(models.GameSession.id.in_(ids)).delete(synchronize_session=False)
+                db.commit()
+                db.expunge_all()
+
+                stats["batches"] += 1
+                stats["archived_sessions"] += len(ids)
+                stats["archived_players"] += n_players
+    stats["months"] = sorted(months)
+    return stats
@@ -0,0 +1,173 @@
+
+"""
+In-process scheduler for periodic maintenance jobs.
+
+Jobs are plain sync functions run in a worker thread (they do DB work) so
+the event loop keeps serving requests. Before each run the scheduler takes
+a lease row in job_leases for roughly one interval; with several uvicorn
+workers (or machines on one database) only the lease holder runs a job,
+and another worker takes over once a lease expires unrenewed.
+
+A job first runs one interval after startup, so a restart doesn't trigger
+VACUUM while kiosks are busy. With MAINTENANCE_HOUR set, jobs with an
+interval of a day or more first run at that UTC hour instead. Leases held
+by a process are released when it shuts down.
+
+Jobs that flush per-process state register with leased=False and run on
+every worker. A job may return {"events": [(group, key, payload), ...]}
+alongside its stats; those are sent through the hub after the job commits.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from .. import models
+from ..database import SessionLocal
+from ..settings import settings
+from .queue_manager import hub
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _first_run(interval: float) -> float:
+    """Monotonic time of a job's first run."""
+    hour = settings.maintenance_hour
+    if hour is None or interval < 86400:
+        return time.monotonic() + interval
+    now = datetime.utcnow()
+    at = now.replace(hour=hour % 24, minute=0, second=0, microsecond=0)
+    if at <= now:
+        at += timedelta(days=1)
+    return time.monotonic() + (at - now).total_seconds()
+
+
+class Job:
+    def __init__(self, name: str, interval: float, func: Callable[[], Dict[str, Any]], leased: bool = True):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.leased = leased
+        self.next_run = _first_run(interval)
+        self.running = False
+        self.runs = 0
+        self.last_started_at: Optional[datetime] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+        self.last_skipped: Optional[str] = None
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def add(self, name: str, interval_sec: float, func: Callable[[], Dict[str, Any]], leased: bool = True):
+        """Register a job. leased=False runs it on every worker (for per-process state)."""
+        if interval_sec > 0:
+            self.jobs[name] = Job(name, interval_sec, func, leased)
+
+    def _acquire(self, job: Job) -> Optional[str]:
+        return self.lease(job.name, job.interval * 0.9)
+
+    def lease(self, name: str, ttl_sec: float) -> Optional[str]:
+        """Take or renew the named lease. Returns None on success, else the current holder."""
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=ttl_sec)
+        L = models.JobLease
+        with SessionLocal() as db:
+            n = (
+                db.query(L)
+                .filter(L.name == name, or_(L.expires_at < now, L.holder == self.holder))
+                .update({"holder": self.holder, "expires_at": expires}, synchronize_session=False)
+            )
+            if not n:
+                lease = db.get(L, name)
+                if lease is not None:
+                    return lease.holder
+                db.add(L(name=name, holder=self.holder, expires_at=expires))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                lease = db.get(L, name)
+                return lease.holder if lease else "unknown"
+        return None
+
+    def release(self, keep=()):
+        """Give up this process's leases (except `keep`) so a restarted worker can take them at once."""
+        L = models.JobLease
+        with SessionLocal() as db:
+            db.query(L).filter(L.holder == self.holder, L.name.not_in(list(keep))).delete(synchronize_session=False)
+            db.commit()
+
+    async def run_job(self, name: str) -> Dict[str, Any]:
+        job = self.jobs.get(name)
+        if job is None:
+            raise KeyError(name)
+        if job.running:
+            return {"skipped": "already running"}
+        job.next_run = time.monotonic() + job.interval
+        job.running = True
+        try:
+            holder = await asyncio.to_thread(self._acquire, job) if job.leased else None
+            if holder is not None:
+                job.last_skipped = f"lease held by {holder}"
+                return {"skipped": job.last_skipped}
+            job.last_started_at = datetime.utcnow()
+            t0 = time.perf_counter()
+            try:
+                result = await asyncio.to_thread(job.func) or {}
+            except Exception as e:
+                job.last_error = f"{type(e).__name__}: {e}"
+                logger.exception("Maintenance job %s failed", name)
+                return {"error": job.last_error}
+            finally:
+                job.last_duration_ms = round((time.perf_counter() - t0) * 1000, 2)
+                job.runs += 1
+            events = result.pop("events", [])
+            for group, key, payload in events:
+                await hub.broadcast(group, key, payload)
+            job.last_result, job.last_error, job.last_skipped = result, None, None
+            if any(result.values()):
+                logger.info("Maintenance job %s: %s", name, result)
+            return result
+        finally:
+            job.running = False
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            for job in list(self.jobs.values()):
+                if job.next_run <= now:
+                    await self.run_job(job.name)
+            await asyncio.sleep(1.0)
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "name": j.name,
+                "interval_sec": j.interval,
+                "running": j.running,
+                "runs": j.runs,
+                "next_run_in_sec": max(0, round(j.next_run - now)),
+                "last_started_at": j.last_started_at.isoformat() if j.last_started_at else None,
+                "last_duration_ms": j.last_duration_ms,
+                "last_result": j.last_result,
+                "last_error": j.last_error,
+                "last_skipped": j.last_skipped,
+            }
+            for j in self.jobs.values()
+        ]
+
+
+scheduler = Scheduler()
@@ -0,0 +1,219 @@
+
+"""
+Venue throughput counters.
+
+The scan, session start and session end paths bump per-kiosk, per-minute
+counters held in memory. A scheduler job flushes them into
+kiosk_throughput_minutes, adding to rows that already exist, so several
+workers can flush into the same minute. Queue wait times are kept as a
+fixed-bucket histogram, which lets percentiles be merged across minutes
+and workers without storing individual waits.
+
+summarize() answers any window from the rollup plus whatever this worker
+has not flushed yet. It never reads game_sessions or queue_entries.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from .. import models
+from ..database import SessionLocal
+from ..settings import settings
+
+# Upper bounds (seconds) of the queue-wait histogram buckets; one overflow bucket follows.
+WAIT_BOUNDS = [10, 30, 60, 120, 180, 300, 600, 900, 1800, 3600]
+COUNTERS = ("scans", "queued", "sessions_started", "sessions_ended", "players_started")
+_MAX_BUSY_MINUTES = 24 * 60
+
+
+def _minute(ts: datetime) -> datetime:
+    return ts.replace(second=0, microsecond=0)
+
+
+def _ceil_minute(ts: datetime) -> datetime:
+    m = _minute(ts)
+    return m if m == ts else m + timedelta(minutes=1)
+
+
+def _empty() -> Dict[str, Any]:
+    return {**{c: 0 for c in COUNTERS}, "busy_sec": 0.0, "wait_sum_sec": 0.0, "wait_hist": [0] * (len(WAIT_BOUNDS) + 1)}
+
+
+def _wait_bucket(sec: float) -> int:
+    for i, bound in enumerate(WAIT_BOUNDS):
+        if sec <= bound:
+            return i
+    return len(WAIT_BOUNDS)
+
+
+class ThroughputCounters:
+    """Unflushed per-minute buckets, a bounded ring per kiosk (oldest minutes drop first)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[int, "OrderedDict[datetime, Dict[str, Any]]"] = {}
+        self.dropped = 0
+
+    def _bucket(self, kiosk_pk: int, ts: datetime) -> Dict[str, Any]:
+        ring = self._buckets.setdefault(kiosk_pk, OrderedDict())
+        minute = _minute(ts)
+        b = ring.get(minute)
+        if b is None:
+            b = ring[minute] = _empty()
+            if len(ring) > settings.throughput_buffer_minutes:
+                ring.popitem(last=False)
+                self.dropped += 1
+        return b
+
+    def add(self, kiosk_pk: int, counter: str, n: int = 1, at: Optional[datetime] = None):
+        if not n:
+            return
+        with self._lock:
+            self._bucket(kiosk_pk, at or datetime.utcnow())[counter] += n
+
+    def session_started(self, kiosk_pk: int, waits_sec: Iterable[float], at: Optional[datetime] = None):
+        waits = list(waits_sec)
+        with self._lock:
+            b = self._bucket(kiosk_pk, at or datetime.utcnow())
+            b["sessions_started"] += 1
+            b["players_started"] += len(waits)
+            for w in waits:
+                w = max(0.0, w)
+                b["wait_sum_sec"] += w
+                b["wait_hist"][_wait_bucket(w)] += 1
+
+    def session_ended(self, kiosk_pk: int, started_at: Optional[datetime], ended_at: datetime):
+        """Count the end, and spread the session's running time over the minutes it covered."""
+        with self._lock:
+            self._bucket(kiosk_pk, ended_at)["sessions_ended"] += 1
+            if not started_at or started_at >= ended_at:
+                return
+            start = max(started_at, ended_at - timedelta(minutes=_MAX_BUSY_MINUTES))
+            t = start
+            while t < ended_at:
+                nxt = min(_minute(t) + timedelta(minutes=1), ended_at)
+                self._bucket(kiosk_pk, t)["busy_sec"] += (nxt - t).total_seconds()
+                t = nxt
+
+    def drain(self) -> List[Tuple[int, datetime, Dict[str, Any]]]:
+        with self._lock:
+            out = [(k, m, b) for k, ring in self._buckets.items() for m, b in ring.items()]
+            self._buckets = {}
+        return out
+
+    def restore(self, items: List[Tuple[int, datetime, Dict[str, Any]]]):
+        """Put buckets back after a failed flush so they are retried next time."""
+        with self._lock:
+            for kiosk_pk, minute, b in items:
+                cur = self._bucket(kiosk_pk, minute)
+                _merge(cur, b)
+
+    def pending(self, start: datetime, end: datetime) -> List[Tuple[int, Dict[str, Any]]]:
+        with self._lock:
+            return [
+                (k, dict(b, wait_hist=list(b["wait_hist"])))
+                for k, ring in self._buckets.items()
+                for m, b in ring.items()
+                if start <= m < end
+            ]
+
+
+def _merge(into: Dict[str, Any], b: Dict[str, Any]):
+    for c in COUNTERS:
+        into[c] += b[c]
+    into["busy_sec"] += b["busy_sec"]
+    into["wait_sum_sec"] += b["wait_sum_sec"]
+    into["wait_hist"] = [x + y for x, y in zip(into["wait_hist"], b["wait_hist"])]
+
+
+counters = ThroughputCounters()
+
+
+def _upsert(db, kiosk_pk: int, minute: datetime, b: Dict[str, Any]):
+    row = db.query(models.KioskThroughputMinute).filter_by(kiosk_id=kiosk_pk, minute=minute).first()
+    if row is None:
+        row = models.KioskThroughputMinute(kiosk_id=kiosk_pk, minute=minute, **_empty())
+        db.add(row)
+        db.flush()
+    for c in COUNTERS:
+        setattr(row, c, getattr(row, c) + b[c])
+    row.busy_sec += b["busy_sec"]
+    row.wait_sum_sec += b["wait_sum_sec"]
+    row.wait_hist = [x + y for x, y in zip(row.wait_hist or [0] * len(b["wait_hist"]), b["wait_hist"])]
+
+
+def flush() -> Dict[str, Any]:
+    """Write unflushed buckets to kiosk_throughput_minutes. Run by the scheduler on every worker."""
+    items = counters.drain()
+    if not items:
+        return {"flushed_minutes": 0}
+    try:
+        with SessionLocal() as db:
+            for kiosk_pk, minute, b in items:
+                try:
+                    with db.begin_nested():
+                        _upsert(db, kiosk_pk, minute, b)
+                except IntegrityError:
+                    # Another worker inserted the same minute first; add to its row.
+                    _upsert(db, kiosk_pk, minute, b)
+            db.commit()
+    except Exception:
+        counters.restore(items)
+        raise
+    return {"flushed_minutes": len(items), "dropped_minutes": counters.dropped}
+
+
+def _percentile(hist: List[int], p: float) -> Optional[float]:
+    total = sum(hist)
+    if not total:
+        return None
+    target = p * total
+    seen = 0
+    lower = 0.0
+    for i, n in enumerate(hist):
+        upper = WAIT_BOUNDS[i] if i < len(WAIT_BOUNDS) else WAIT_BOUNDS[-1]
+        if n and seen + n >= target:
+            # Interpolate inside the bucket; the overflow bucket reports its lower bound.
+            return round(lower + (upper - lower) * (target - seen) / n, 1)
+        seen += n
+        lower = upper
+    return float(WAIT_BOUNDS[-1])
+
+
+def summarize(start: datetime, end: datetime, kiosk_pk: Optional[int] = None) -> Dict[int, Dict[str, Any]]:
+    """Per-kiosk throughput, wait percentiles and utilization for [start, end)."""
+    # Align to whole minutes, keeping the window length (the current minute counts).
+    start, end = _ceil_minute(start), _ceil_minute(end)
+    totals: Dict[int, Dict[str, Any]] = {}
+    with SessionLocal() as db:
+        q = db.query(models.KioskThroughputMinute).filter(
+            models.KioskThroughputMinute.minute >= start, models.KioskThroughputMinute.minute < end
+        )
+        if kiosk_pk is not None:
+            q = q.filter(models.KioskThroughputMinute.kiosk_id == kiosk_pk)
+        for row in q.all():
+            b = {c: getattr(row, c) for c in COUNTERS}
+            b.update(busy_sec=row.busy_sec, wait_sum_sec=row.wait_sum_sec, wait_hist=list(row.wait_hist or [0] * (len(WAIT_BOUNDS) + 1)))
+            _merge(totals.setdefault(row.kiosk_id, _empty()), b)
+    for k, b in counters.pending(start, end):
+        if kiosk_pk is None or k == kiosk_pk:
+            _merge(totals.setdefault(k, _empty()), b)
+
+    window = (end - start).total_seconds()
+    out = {}
+    for k, t in totals.items():
+        hist = t["wait_hist"]
+        n_waits = sum(hist)
+        out[k] = {
+            **{c: t[c] for c in COUNTERS},
+            "sessions_per_hour": round(t["sessions_started"] * 3600 / window, 2) if window else None,
+            "utilization": round(min(1.0, t["busy_sec"] / window), 3) if window else None,
+            "wait_avg_sec": round(t["wait_sum_sec"] / n_waits, 1) if n_waits else None,
+            "wait_p50_sec": _percentile(hist, 0.5),
+            "wait_p90_sec": _percentile(hist, 0.9),
+            "wait_p99_sec": _percentile(hist, 0.99),
+        }
+    return out
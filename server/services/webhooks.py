@@ -0,0 +1,192 @@
+
+"""
+Webhook delivery of outbox events (see services/outbox.py).
+
+WEBHOOKS lists endpoints as name=url pairs. Each endpoint has its own cursor
+(last acknowledged event id) in job_state under "webhook:<name>". A new
+endpoint starts at the newest event, not at the beginning of the outbox.
+Each round, for each endpoint, the dispatcher:
+- reads up to WEBHOOK_BATCH_SIZE x WEBHOOK_CONCURRENCY events after the cursor;
+- POSTs them as up to WEBHOOK_CONCURRENCY batches in parallel, as
+  {"endpoint": name, "events": [...]};
+- moves the cursor past the leading batches that got a 2xx.
+A failed batch is retried from the first unacknowledged event, after a delay
+that doubles per consecutive failure up to WEBHOOK_MAX_BACKOFF_SEC. Delivery
+is at-least-once, so receivers should skip event ids they have already
+seen. Batches in flight together may arrive in any order; each batch is in
+id order, and WEBHOOK_CONCURRENCY=1 delivers strictly in order. Endpoints never skip events on their own; an
+admin can move a cursor with POST /ui/webhooks/{name}/cursor.
+
+Bodies are signed with HMAC-SHA256 (WEBHOOK_SECRET, else SECRET_KEY) in
+X-Outbox-Signature: sha256=<hex>. With several workers only the holder of
+the "webhooks" lease delivers. scripts/webhook_receiver.py is a local
+stand-in receiver for trying this out.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import random
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .. import models
+from ..database import SessionLocal
+from ..settings import settings
+from . import outbox
+from .scheduler import scheduler
+
+logger = logging.getLogger("uvicorn.error")
+
+_LEASE = "webhooks"
+
+
+def _state_name(name: str) -> str:
+    return f"webhook:{name}"
+
+
+def sign(body: bytes) -> str:
+    key = (settings.webhook_secret or settings.secret_key).encode()
+    return "sha256=" + hmac.new(key, body, hashlib.sha256).hexdigest()
+
+
+def _post(name: str, url: str, events: List[Dict[str, Any]]) -> Tuple[bool, Optional[int], Optional[str]]:
+    body = json.dumps({"endpoint": name, "events": events}, default=str).encode()
+    req = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        "User-Agent": "kiosk-outbox",
+        "X-Outbox-Endpoint": name,
+        "X-Outbox-Signature": sign(body),
+    })
+    try:
+        with urllib.request.urlopen(req, timeout=settings.webhook_timeout_sec) as resp:
+            resp.read()
+            return 200 <= resp.status < 300, resp.status, None
+    except urllib.error.HTTPError as e:
+        return False, e.code, f"HTTP {e.code}"
+    except Exception as e:
+        return False, None, f"{type(e).__name__}: {e}"
+
+
+def _load(name: str) -> Tuple[int, Dict[str, Any]]:
+    with SessionLocal() as db:
+        row = db.get(models.JobState, _state_name(name))
+        if row is None:
+            row = models.JobState(name=_state_name(name), cursor=outbox.latest_id(), stats={})
+            db.add(row)
+            db.commit()
+        return row.cursor, dict(row.stats or {})
+
+
+def _save(name: str, cursor: int, stats: Dict[str, Any]):
+    with SessionLocal() as db:
+        row = db.get(models.JobState, _state_name(name))
+        row.cursor = cursor
+        row.stats = stats
+        row.updated_at = datetime.utcnow()
+        db.commit()
+
+
+def min_cursor() -> Optional[int]:
+    """Lowest cursor among configured endpoints (events above it are still owed to someone)."""
+    names = [_state_name(n) for n in settings.webhooks]
+    if not names:
+        return None
+    with SessionLocal() as db:
+        cursors = [c for (c,) in db.query(models.JobState.cursor).filter(models.JobState.name.in_(names)).all()]
+    return min(cursors) if cursors else None
+
+
+class Dispatcher:
+    def __init__(self):
+        self._retry_at: Dict[str, float] = {}
+
+    async def deliver(self, name: str, url: str) -> bool:
+        """One round for one endpoint. Returns True if more events are waiting."""
+        cursor, stats = await asyncio.to_thread(_load, name)
+        size = max(1, settings.webhook_batch_size)
+        events = await asyncio.to_thread(outbox.read, cursor, size * max(1, settings.webhook_concurrency))
+        if not events:
+            return False
+        batches = [events[i:i + size] for i in range(0, len(events), size)]
+        results = await asyncio.gather(*(asyncio.to_thread(_post, name, url, b) for b in batches))
+
+        delivered = 0
+        failed: Optional[Tuple[Optional[int], Optional[str]]] = None
+        for batch, (ok, status, error) in zip(batches, results):
+            if not ok:
+                failed = failed or (status, error)
+                continue
+            if failed is None:
+                cursor = batch[-1]["id"]
+                delivered += len(batch)
+                stats["last_status"] = status
+
+        stats["delivered"] = stats.get("delivered", 0) + delivered
+        if failed:
+            n = stats.get("consecutive_failures", 0) + 1
+            delay = min(settings.webhook_max_backoff_sec, 2 ** (n - 1)) * random.uniform(0.8, 1.2)
+            self._retry_at[name] = time.monotonic() + delay
+            stats.update(
+                consecutive_failures=n,
+                failures=stats.get("failures", 0) + 1,
+                last_status=failed[0],
+                last_error=failed[1],
+                last_failure_at=datetime.utcnow().isoformat(),
+            )
+            logger.warning("Webhook %s failed (%s); retrying in %.1fs", name, failed[1], delay)
+        else:
+            self._retry_at.pop(name, None)
+            stats["consecutive_failures"] = 0
+        stats["last_delivery_at"] = datetime.utcnow().isoformat() if delivered else stats.get("last_delivery_at")
+        await asyncio.to_thread(_save, name, cursor, stats)
+        return not failed and len(events) == len(batches) * size
+
+    async def run(self):
+        """Background loop started from the app lifespan."""
+        more = False
+        while True:
+            if not more:
+                await outbox.signal.wait(settings.webhook_poll_sec)
+            more = False
+            endpoints = settings.webhooks
+            if not endpoints:
+                continue
+            try:
+                lease_ttl = max(30.0, 3 * settings.webhook_timeout_sec)
+                if await asyncio.to_thread(scheduler.lease, _LEASE, lease_ttl) is not None:
+                    continue
+                now = time.monotonic()
+                due = [(n, u) for n, u in endpoints.items() if self._retry_at.get(n, 0.0) <= now]
+                results = await asyncio.gather(*(self.deliver(n, u) for n, u in due))
+                more = any(results)
+            except Exception:
+                logger.exception("Webhook dispatch failed")
+
+    def status(self) -> List[Dict[str, Any]]:
+        latest = outbox.latest_id()
+        now = time.monotonic()
+        out = []
+        for name, url in settings.webhooks.items():
+            cursor, stats = _load(name)
+            out.append({
+                "name": name,
+                "url": url,
+                "cursor": cursor,
+                "pending": max(0, latest - cursor),
+                "retry_in_sec": round(max(0.0, self._retry_at.get(name, 0.0) - now), 1),
+                **stats,
+            })
+        return out
+
+    def set_cursor(self, name: str, cursor: int):
+        _, stats = _load(name)
+        _save(name, cursor, {**stats, "consecutive_failures": 0})
+        self._retry_at.pop(name, None)
+
+
+dispatcher = Dispatcher()
@@ -1,18 +1,94 @@
 
 from pydantic_settings import BaseSettings
 from pydantic import Field
-from typing import Dict
+from typing import Dict, List, Optional
 import os
 
 class Settings(BaseSettings):
     database_url: str = Field(default="sqlite:///./kiosk.db", alias="DATABASE_URL")
     secret_key: str = Field(default="dev-secret", alias="SECRET_KEY")
     fernet_key: str = Field(default="", alias="FERNET_KEY")
+    fernet_old_keys: str = Field(default="", alias="FERNET_OLD_KEYS")  # comma-separated; still accepted for decryption
+    email_index_key: str = Field(default="", alias="EMAIL_INDEX_KEY")  # HMAC key for players.email_bidx; "" -> SECRET_KEY
     server_host: str = Field(default="http://127.0.0.1:8000", alias="SERVER_HOST")
     kiosk_keys_raw: str = Field(default="", alias="KIOSK_KEYS")
     game_keys_raw: str = Field(default="", alias="GAME_KEYS")
     admin_username: str = Field(default="admin", alias="ADMIN_USER")
     admin_password: str = Field(default="changeme", alias="ADMIN_PASSWORD")
+    ws_ping_interval: float = Field(default=20.0, alias="WS_PING_INTERVAL")  # seconds between server pings
+    ws_ping_timeout: float = Field(default=10.0, alias="WS_PING_TIMEOUT")  # grace after a missed ping before eviction
+    ws_max_per_key: int = Field(default=8, alias="WS_MAX_PER_KEY")  # sockets per kiosk_id / game_id
+    ws_max_connections: int = Field(default=500, alias="WS_MAX_CONNECTIONS")
+    ws_replay_buffer: int = Field(default=256, alias="WS_REPLAY_BUFFER")  # recent events kept per channel for ?since= resume
+    ws_event_persist: bool = Field(default=False, alias="WS_EVENT_PERSIST")  # also write events to hub_events
+    ws_coalesce_ms: int = Field(default=75, alias="WS_COALESCE_MS")  # 0 disables broadcast coalescing
+    retention_days: int = Field(default=365, alias="RETENTION_DAYS")  # sessions older than this are archived; 0 disables
+    retention_batch_size: int = Field(default=500, alias="RETENTION_BATCH_SIZE")
+    archive_dir: str = Field(default="./archive", alias="ARCHIVE_DIR")
+    template_cache_dir: str = Field(default="", alias="TEMPLATE_CACHE_DIR")  # "" -> <tmp>/kiosk-jinja-cache
+    rate_scan_per_sec: float = Field(default=2.0, alias="RATE_SCAN_PER_SEC")  # per kiosk; 0 disables
+    rate_scan_burst: float = Field(default=6.0, alias="RATE_SCAN_BURST")
+    rate_scan_global_per_sec: float = Field(default=50.0, alias="RATE_SCAN_GLOBAL_PER_SEC")  # all kiosks together
+    rate_queue_per_sec: float = Field(default=5.0, alias="RATE_QUEUE_PER_SEC")  # queue/status reads and edits, per kiosk
+    rate_queue_burst: float = Field(default=15.0, alias="RATE_QUEUE_BURST")
+    rate_queue_global_per_sec: float = Field(default=200.0, alias="RATE_QUEUE_GLOBAL_PER_SEC")
+    scan_debounce_sec: float = Field(default=2.0, alias="SCAN_DEBOUNCE_SEC")  # repeat scans of a tag at a kiosk
+    scan_anomaly_per_min: int = Field(default=60, alias="SCAN_ANOMALY_PER_MIN")  # log + flag kiosks above this
+    scheduler_enabled: bool = Field(default=True, alias="SCHEDULER_ENABLED")
+    session_max_sec: int = Field(default=3600, alias="SESSION_MAX_SEC")  # default per-game cap on a running session
+    queue_ttl_sec: int = Field(default=0, alias="QUEUE_TTL_SEC")  # queue entries older than this are dropped; 0 (default) keeps them
+    sweep_interval_sec: int = Field(default=60, alias="SWEEP_INTERVAL_SEC")  # stale session / queue sweeps
+    db_analyze_interval_sec: int = Field(default=86400, alias="DB_ANALYZE_INTERVAL_SEC")  # 0 disables
+    db_vacuum_interval_sec: int = Field(default=604800, alias="DB_VACUUM_INTERVAL_SEC")  # 0 disables
+    maintenance_hour: Optional[int] = Field(default=None, alias="MAINTENANCE_HOUR")  # UTC hour for the first run of daily+ jobs; unset -> one interval after start
+    retention_interval_sec: int = Field(default=0, alias="RETENTION_INTERVAL_SEC")  # run retention in-process; 0 = script only
+    key_rotation_interval_sec: int = Field(default=300, alias="KEY_ROTATION_INTERVAL_SEC")  # re-encrypt while FERNET_OLD_KEYS is set
+    key_rotation_batch_size: int = Field(default=200, alias="KEY_ROTATION_BATCH_SIZE")  # rows per transaction
+    key_rotation_pause_ms: int = Field(default=50, alias="KEY_ROTATION_PAUSE_MS")  # sleep between batches
+    email_index_interval_sec: int = Field(default=3600, alias="EMAIL_INDEX_INTERVAL_SEC")  # backfill players.email_bidx; 0 disables
+    balance_mode: str = Field(default="suggest", alias="BALANCE_MODE")  # off | suggest | route, for games with several kiosks
+    balance_min_gain_sec: int = Field(default=120, alias="BALANCE_MIN_GAIN_SEC")  # only offer/route if it saves this much wait
+    balance_session_capacity: int = Field(default=0, alias="BALANCE_SESSION_CAPACITY")  # players per session when the game has none; 0 = whole queue
+    balance_default_session_sec: int = Field(default=600, alias="BALANCE_DEFAULT_SESSION_SEC")  # assumed duration before a kiosk has history
+    live_score_fps: float = Field(default=4.0, alias="LIVE_SCORE_FPS")  # score_update frames per second per kiosk
+    live_score_flush_sec: float = Field(default=2.0, alias="LIVE_SCORE_FLUSH_SEC")  # live scores -> session_players
+    profile_sample_hz: float = Field(default=100.0, alias="PROFILE_SAMPLE_HZ")  # /ui/debug/profile stack samples per second
+    profile_max_sec: float = Field(default=60.0, alias="PROFILE_MAX_SEC")  # longest allowed profiling run
+    journal_sample_rate: float = Field(default=0.0, alias="JOURNAL_SAMPLE_RATE")  # fraction of requests recorded; 0 disables
+    journal_dir: str = Field(default="./journal", alias="JOURNAL_DIR")
+    journal_capture_body: bool = Field(default=False, alias="JOURNAL_CAPTURE_BODY")  # store redacted bodies, not just their shape
+    journal_max_body_bytes: int = Field(default=16384, alias="JOURNAL_MAX_BODY_BYTES")
+    journal_flush_sec: float = Field(default=2.0, alias="JOURNAL_FLUSH_SEC")
+    journal_buffer: int = Field(default=10000, alias="JOURNAL_BUFFER")  # unwritten records kept before dropping
+    journal_max_file_mb: int = Field(default=64, alias="JOURNAL_MAX_FILE_MB")  # start a new file for the day past this
+    journal_keep_days: int = Field(default=14, alias="JOURNAL_KEEP_DAYS")  # 0 keeps everything
+    executor_pools: str = Field(default="hot:8,io:8,cpu:2:process", alias="EXECUTOR_POOLS")  # name:workers[:process], see services/executors.py
+    gzip_min_bytes: int = Field(default=1024, alias="GZIP_MIN_BYTES")  # gzip responses at least this big; 0 disables
+    gzip_level: int = Field(default=5, alias="GZIP_LEVEL")  # 1-9; higher costs more CPU per response
+    outbox_keep_days: int = Field(default=7, alias="OUTBOX_KEEP_DAYS")  # delivered change events kept this long; 0 keeps everything
+    outbox_settle_ms: Optional[int] = Field(default=None, alias="OUTBOX_SETTLE_MS")  # hold back the newest events; unset -> 0 on SQLite, 2000 on Postgres (commits land out of id order)
+    changes_max_wait_sec: float = Field(default=30.0, alias="CHANGES_MAX_WAIT_SEC")  # longest /changes long-poll
+    webhooks_raw: str = Field(default="", alias="WEBHOOKS")  # name=url,name=url
+    webhook_secret: str = Field(default="", alias="WEBHOOK_SECRET")  # HMAC key for X-Outbox-Signature; "" -> SECRET_KEY
+    webhook_batch_size: int = Field(default=100, alias="WEBHOOK_BATCH_SIZE")  # events per POST
+    webhook_concurrency: int = Field(default=2, alias="WEBHOOK_CONCURRENCY")  # batches in flight per endpoint
+    webhook_timeout_sec: float = Field(default=10.0, alias="WEBHOOK_TIMEOUT_SEC")
+    webhook_max_backoff_sec: float = Field(default=300.0, alias="WEBHOOK_MAX_BACKOFF_SEC")  # retry delay doubles up to this
+    webhook_poll_sec: float = Field(default=2.0, alias="WEBHOOK_POLL_SEC")  # check for new events at least this often
+    jobs_worker: bool = Field(default=True, alias="JOBS_WORKER")  # run the job worker in the app; false when using python -m server.worker
+    jobs_concurrency: int = Field(default=4, alias="JOBS_CONCURRENCY")  # jobs run at once per worker
+    jobs_poll_sec: float = Field(default=1.0, alias="JOBS_POLL_SEC")  # check for due jobs at least this often
+    jobs_max_attempts: int = Field(default=5, alias="JOBS_MAX_ATTEMPTS")  # then the job is dead-lettered
+    jobs_retry_base_sec: float = Field(default=2.0, alias="JOBS_RETRY_BASE_SEC")  # retry delay doubles per attempt
+    jobs_retry_max_sec: float = Field(default=600.0, alias="JOBS_RETRY_MAX_SEC")
+    jobs_lease_sec: float = Field(default=120.0, alias="JOBS_LEASE_SEC")  # a running job is reclaimed after this
+    jobs_keep_days: int = Field(default=7, alias="JOBS_KEEP_DAYS")  # finished jobs kept this long; dead jobs are kept
+    venues_raw: str = Field(default="", alias="VENUES")  # comma-separated venue names, each with its own database; see shards.py
+    venue_db_dir: str = Field(default="./venues", alias="VENUE_DB_DIR")  # SQLite: <venue>.db files live here
+    venue_fanout_workers: int = Field(default=8, alias="VENUE_FANOUT_WORKERS")  # threads for cross-venue reads
+    metric_auto_defs_max: int = Field(default=50, alias="METRIC_AUTO_DEFS_MAX")  # metric defs a game may create just by reporting new names
+    throughput_flush_sec: int = Field(default=60, alias="THROUGHPUT_FLUSH_SEC")  # in-memory counters -> kiosk_throughput_minutes
+    throughput_buffer_minutes: int = Field(default=180, alias="THROUGHPUT_BUFFER_MINUTES")  # unflushed minutes kept per kiosk
 
     @property
     def kiosk_keys(self) -> Dict[str, str]:
@@ -32,6 +108,19 @@ class Settings(BaseSettings):
                 res[k.strip()] = v.strip()
         return res
 
+    @property
+    def webhooks(self) -> Dict[str, str]:
+        res: Dict[str, str] = {}
+        for pair in (self.webhooks_raw or "").split(","):
+            if "=" in pair:
+                k,v = pair.split("=",1)
+                res[k.strip()] = v.strip()
+        return res
+
+    @property
+    def venues(self) -> List[str]:
+        return [v.strip() for v in (self.venues_raw or "").split(",") if v.strip()]
+
     class Config:
         env_file = os.path.join(os.path.dirname(__file__), "..", ".env")
 
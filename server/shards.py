@@ -0,0 +1,286 @@
+
+"""
+Per-venue databases for multi-venue deployments.
+
+DATABASE_URL stays the home database. It holds players, tags, games, the
+kiosk registry, jobs, leases and everything else that is shared. Each venue
+in VENUES gets its own copy of the tables that take a venue's write traffic
+(VENUE_TABLES: queue entries, sessions, session players and their metrics,
+and the outbox those writes emit into):
+
+- SQLite: VENUE_DB_DIR/<venue>.db, with the home file ATTACHed to every
+  connection, so a venue's writes take its own file's lock;
+- Postgres: schema venue_<venue> in the same database, with search_path
+  "venue_<venue>, public".
+
+In both cases an unqualified table name resolves to the venue's copy first
+and to the home table otherwise. The same queries therefore run against any
+shard, and a venue session can still read players, games and kiosks.
+
+Kiosk.venue (None = home) says where a kiosk's queue and sessions live.
+Routes that act on one kiosk bind their session to its shard before the
+first query: route(db, kiosk_id=...), or the get_kiosk_db dependency.
+Venue tables number their rows from the venue's own id range (id_base), so
+a session id alone names its shard: route(db, row_id=...). Reads across
+venues go through fan_out(). It runs the same function against every shard
+concurrently on the "fanout" executor pool, and the caller merges the
+results.
+
+The kiosk -> venue map is cached for _REGISTRY_TTL_SEC and reloaded on a
+miss. Changing a kiosk's venue needs an empty queue and no running session.
+Its ended sessions stay where they were written, and fan-out reads still
+find them. Events emitted in a venue are moved into the home outbox by
+outbox.relay() before anyone reads them, so feed ids stay one sequence.
+
+Venue ids run past 2**31, so these tables use BIGINT ids on Postgres.
+"""
+import heapq
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import MetaData, create_engine, event, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .database import Base, SessionLocal, add_missing_columns, engine
+from .services.executors import Pool, executors
+from .settings import settings
+
+logger = logging.getLogger("uvicorn.error")
+
+VENUE_TABLES = ("queue_entries", "game_sessions", "session_players", "session_player_metrics", "outbox_events")
+ID_SPAN = 10 ** 9  # ids per venue table; bases stay below 2**53 for JavaScript clients
+
+_REGISTRY_TTL_SEC = 60.0
+_RELOAD_MIN_SEC = 1.0  # unknown kiosk ids reload the registry at most this often
+_VENUE_NAME = re.compile(r"^[a-z0-9_]+$")
+
+
+def id_base(venue: Optional[str]) -> int:
+    """Ids in a venue's tables start above this (0 for home). Depends only on the name."""
+    if venue is None:
+        return 0
+    return (zlib.crc32(venue.encode()) % 999_999 + 1) * ID_SPAN
+
+
+def merge_sorted(parts: List[List[Any]], key: Callable[[Any], Any], limit: int, reverse: bool = True) -> List[Any]:
+    """Merge per-shard lists that are each already sorted by `key` (newest first by default)."""
+    return list(itertools.islice(heapq.merge(*parts, key=key, reverse=reverse), limit))
+
+
+class Shards:
+    def __init__(self, venues: List[str]):
+        for v in venues:
+            if not _VENUE_NAME.match(v):
+                raise RuntimeError(f"Venue name {v!r} must be lowercase letters, digits and underscores")
+        by_range: Dict[int, str] = {}
+        for v in venues:
+            other = by_range.setdefault(id_base(v) // ID_SPAN, v)
+            if other != v:
+                raise RuntimeError(f"Venues {other!r} and {v!r} hash to the same id range; rename one")
+        self.venues: List[str] = sorted(set(venues), key=id_base)
+        self._by_range = by_range
+        self._engines: Dict[Optional[str], Engine] = {None: engine}
+        self._kiosks: Dict[str, Optional[str]] = {}
+        self._kiosk_pks: Dict[int, Optional[str]] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.pool: Optional[Pool] = None
+        if self.venues:
+            self.pool = executors.pools.setdefault("fanout", Pool("fanout", max(1, settings.venue_fanout_workers)))
+            for v in self.venues:
+                self._engines[v] = self._create_engine(v)
+
+    def _create_engine(self, venue: str) -> Engine:
+        dialect = engine.dialect.name
+        if dialect == "sqlite":
+            home = engine.url.database
+            if not home or home == ":memory:":
+                raise RuntimeError("VENUES needs a file-backed SQLite DATABASE_URL")
+            home = os.path.abspath(home)
+            path = os.path.abspath(os.path.join(settings.venue_db_dir, f"{venue}.db"))
+            eng = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False}, pool_pre_ping=True)
+
+            @event.listens_for(eng, "connect")
+            def _attach_home(dbapi_conn, _record):
+                dbapi_conn.execute("ATTACH DATABASE ? AS home", (home,))
+
+            return eng
+        if dialect == "postgresql":
+            return create_engine(
+                settings.database_url,
+                connect_args={"options": f"-csearch_path={self.namespace(venue)},public"},
+                pool_pre_ping=True,
+            )
+        raise RuntimeError(f"VENUES is not supported on {dialect}")
+
+    def namespace(self, venue: str) -> str:
+        """Where a venue's tables live on its engine: SQLite's main file or a Postgres schema."""
+        return "main" if engine.dialect.name == "sqlite" else f"venue_{venue}"
+
+    def home_namespace(self) -> str:
+        """How a venue engine names the home database: the ATTACHed file or the public schema."""
+        return "home" if engine.dialect.name == "sqlite" else "public"
+
+    def names(self) -> List[Optional[str]]:
+        """Every shard, home (None) first, then venues in id-range order."""
+        return [None, *self.venues]
+
+    # -- routing --
+
+    def _load_registry(self):
+        from . import models
+
+        with SessionLocal() as db:
+            rows = db.execute(select(models.Kiosk.id, models.Kiosk.kiosk_id, models.Kiosk.venue)).all()
+        with self._lock:
+            self._kiosks = {kiosk_id: venue for _, kiosk_id, venue in rows}
+            self._kiosk_pks = {pk: venue for pk, _, venue in rows}
+            self._loaded_at = time.monotonic()
+
+    def forget(self):
+        """Drop the cached kiosk -> venue map (after kiosks are added, moved or deleted)."""
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def _lookup(self, table: str, key: Any) -> Optional[str]:
+        age = time.monotonic() - self._loaded_at
+        found = key in getattr(self, table)
+        if age > _REGISTRY_TTL_SEC or (not found and age > _RELOAD_MIN_SEC):
+            self._load_registry()
+        return getattr(self, table).get(key)
+
+    def venue_for(self, kiosk_id: Optional[str] = None, kiosk_pk: Optional[int] = None, row_id: Optional[int] = None) -> Optional[str]:
+        """The venue holding a kiosk's data or a venue-table row; None is home (also for unknown kiosks)."""
+        if not self.venues:
+            return None
+        if row_id is not None:
+            return self._by_range.get(row_id // ID_SPAN)
+        venue = self._lookup("_kiosks", kiosk_id) if kiosk_id is not None else self._lookup("_kiosk_pks", kiosk_pk)
+        if venue is not None and venue not in self._engines:
+            raise LookupError(f"Kiosk is assigned to venue {venue!r}, which is not in VENUES")
+        return venue
+
+    def engine_for(self, venue: Optional[str]) -> Engine:
+        return self._engines[venue]
+
+    def session(self, venue: Optional[str] = None) -> Session:
+        return SessionLocal(bind=self._engines[venue])
+
+    def route(self, db: Session, kiosk_id: Optional[str] = None, kiosk_pk: Optional[int] = None, row_id: Optional[int] = None) -> Optional[str]:
+        """Bind an unused session to the shard for a kiosk or row. Returns the venue."""
+        venue = self.venue_for(kiosk_id=kiosk_id, kiosk_pk=kiosk_pk, row_id=row_id)
+        if venue is not None:
+            if db.in_transaction():
+                raise RuntimeError("shards.route() must be called before the session runs a query")
+            db.bind = self._engines[venue]
+        return venue
+
+    # -- cross-venue reads --
+
+    def fan_out(self, fn: Callable[..., Any], *args, db: Optional[Session] = None) -> List[Any]:
+        """
+        fn(session, *args) on every shard, concurrently; results in names()
+        order. `db` is reused for the home shard unless it was routed to a
+        venue. fn must not call fan_out itself.
+        """
+        def on(venue: Optional[str]):
+            with self.session(venue) as s:
+                return fn(s, *args)
+
+        if db is not None and db.bind is not engine:
+            db = None
+        if not self.venues:
+            return [fn(db, *args) if db is not None else on(None)]
+        futures = [self.pool.submit(on, v) for v in self.venues]
+        home = fn(db, *args) if db is not None else on(None)
+        return [home, *(f.result()[0] for f in futures)]
+
+    # -- schema --
+
+    def _metadata(self, ns: str, sqlite: bool) -> MetaData:
+        """Base.metadata with the venue tables moved into `ns`; other tables keep resolving to home."""
+        md = MetaData()
+
+        def referred(table, to_schema, constraint, referred_schema):
+            target = constraint.elements[0].target_fullname.split(".")[0]
+            return to_schema if target in VENUE_TABLES else referred_schema
+
+        for t in Base.metadata.sorted_tables:
+            if t.name not in VENUE_TABLES:
+                t.to_metadata(md)
+                continue
+            copy = t.to_metadata(md, schema=ns, referred_schema_fn=referred)
+            if sqlite:
+                # AUTOINCREMENT keeps ids in the venue's range even after every row is deleted.
+                copy.dialect_kwargs["sqlite_autoincrement"] = True
+        return md
+
+    def init_schema(self, force: bool = False) -> List[str]:
+        """Create venue tables that are missing (and new columns with force). Returns venues that got DDL."""
+        changed = []
+        for venue in self.venues:
+            eng = self._engines[venue]
+            ns = self.namespace(venue)
+            sqlite = eng.dialect.name == "sqlite"
+            if sqlite:
+                os.makedirs(settings.venue_db_dir, exist_ok=True)
+            else:
+                with eng.begin() as conn:
+                    conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{ns}"'))
+            missing = [t for t in VENUE_TABLES if t not in set(inspect(eng).get_table_names(schema=ns))]
+            if not missing and not force:
+                continue
+            md = self._metadata(ns, sqlite)
+            tables = [md.tables[f"{ns}.{t}"] for t in VENUE_TABLES]
+            base = id_base(venue)
+            with eng.begin() as conn:
+                md.create_all(conn, tables=tables)
+                for t in missing:
+                    if sqlite:
+                        conn.execute(text("INSERT INTO main.sqlite_sequence (name, seq) VALUES (:t, :base)"), {"t": t, "base": base})
+                    else:
+                        conn.execute(text("SELECT setval(pg_get_serial_sequence(:t, 'id'), :base)"), {"t": f'"{ns}".{t}', "base": base})
+            add_missing_columns(eng, tables, schema=ns)
+            logger.info("Venue %s: schema %s%s", venue, ns, f", created {', '.join(missing)}" if missing else " updated")
+            changed.append(venue)
+        return changed
+
+    def status(self) -> List[Dict[str, Any]]:
+        """Per shard: where it lives, its id range, kiosks, queue length and running sessions."""
+        from . import models
+
+        def counts(db: Session):
+            return (
+                db.query(models.QueueEntry).count(),
+                db.query(models.GameSession).filter_by(status="running").count(),
+            )
+
+        with SessionLocal() as db:
+            kiosks: Dict[Optional[str], int] = dict(
+                db.query(models.Kiosk.venue, func.count(models.Kiosk.id)).group_by(models.Kiosk.venue).all()
+            )
+        out = []
+        for venue, (queued, running) in zip(self.names(), self.fan_out(counts)):
+            eng = self._engines[venue]
+            where = eng.url.render_as_string(hide_password=True)
+            if venue is not None and eng.dialect.name != "sqlite":
+                where = f"schema {self.namespace(venue)}"
+            out.append({
+                "venue": venue,
+                "database": where,
+                "id_base": id_base(venue),
+                "kiosks": kiosks.get(venue, 0),
+                "queued": queued,
+                "running_sessions": running,
+            })
+        return out
+
+
+shards = Shards(settings.venues)
@@ -142,7 +142,12 @@
   }
 
   async function refreshModes(){
-    const resp = await fetch(`/kiosks/${encodeURIComponent(kioskId)}/status`);
+    const resp = await fetch(`/kiosks/${encodeURIComponent(kioskId)}/status`, {headers: headers({'Content-Type': undefined})});
+    if (resp.status === 429){
+      const retry = parseInt(resp.headers.get('Retry-After') || '1', 10);
+      setTimeout(refreshModes, retry * 1000);
+      return;
+    }
     if (!resp.ok) return;
     const data = await resp.json();
     modeList.innerHTML = '';
@@ -225,6 +230,12 @@
 
 async function refreshQueue() {
   const resp = await fetch(`/kiosks/${encodeURIComponent(kioskId)}/queue`, {headers: headers({'Content-Type': undefined})});
+  if (resp.status === 429){
+    // Server is shedding load; try again once it says we may.
+    const retry = parseInt(resp.headers.get('Retry-After') || '1', 10);
+    setTimeout(refreshQueue, retry * 1000);
+    return;
+  }
   if (!resp.ok) return;
   const data = await resp.json();
   const maxSlots = 6;
@@ -280,7 +291,12 @@ async function refreshQueue() {
   window.refreshQueue = refreshQueue;
 
   async function refreshStatus(){
-    const resp = await fetch(`/kiosks/${encodeURIComponent(kioskId)}/status`);
+    const resp = await fetch(`/kiosks/${encodeURIComponent(kioskId)}/status`, {headers: headers({'Content-Type': undefined})});
+    if (resp.status === 429){
+      const retry = parseInt(resp.headers.get('Retry-After') || '1', 10);
+      setTimeout(refreshStatus, retry * 1000);
+      return;
+    }
     if(!resp.ok) return;
     const data = await resp.json();
     kioskStatus = data.status === 'running' ? 'running' : 'idle';
@@ -294,16 +310,83 @@ async function refreshQueue() {
       if (startBtn) { startBtn.disabled = false; startBtn.title = 'Start Game'; }
     }
 
+    // score_update frames are not replayed, so pick up the current scoreboard here.
+    if (data.status === 'running' && data.session_id) {
+      fetch(`/sessions/${data.session_id}/live`)
+        .then(r => r.ok ? r.json() : null)
+        .then(s => { if (s && s.live) renderLiveScores(s); });
+    } else {
+      renderLiveScores(null);
+    }
+
     updateStartPulse(visibleQueueCount, kioskStatus);
   }
 
-  const ws = new WebSocket(`${location.protocol === 'https:' ? 'wss' : 'ws'}://${location.host}/ws/kiosk/${encodeURIComponent(kioskId)}`);
-  ws.onmessage = (ev) => {
-    const msg = JSON.parse(ev.data);
-    if (msg.type === 'queue_update' || msg.type === 'session_started' || msg.type === 'session_ended') {
-      refreshQueue(); refreshStatus();
-    }
-  };
+  // Hub events carry a per-channel seq; on reconnect we ask for ?since=<lastSeq>
+  // so only missed events are replayed, or get {type:'resync'} and refetch.
+  let hubEpoch = null;
+  let lastSeq = 0;
+  function connectHub(){
+    let url = `${location.protocol === 'https:' ? 'wss' : 'ws'}://${location.host}/ws/kiosk/${encodeURIComponent(kioskId)}?pong=1`;
+    if (hubEpoch) url += `&since=${lastSeq}&epoch=${encodeURIComponent(hubEpoch)}`;
+    const ws = new WebSocket(url);
+    ws.onmessage = (ev) => {
+      const msg = JSON.parse(ev.data);
+      if (msg.type === 'ping') { ws.send(JSON.stringify({type: 'pong'})); return; }
+      if (msg.type === 'hello') {
+        if (!hubEpoch) lastSeq = Math.max(lastSeq, msg.seq);
+        hubEpoch = msg.epoch;
+        return;
+      }
+      if (msg.type === 'resync') {
+        lastSeq = msg.seq;
+        refreshQueue(); refreshStatus();
+        return;
+      }
+      if (msg.seq) {
+        if (msg.seq <= lastSeq) return;
+        lastSeq = msg.seq;
+      }
+      if (msg.type === 'queue_update' || msg.type === 'session_started' || msg.type === 'session_ended') {
+        refreshQueue(); refreshStatus();
+      }
+      if (msg.type === 'score_update') renderLiveScores(msg);
+      if (msg.type === 'session_ended') renderLiveScores(null);
+      if (msg.type === 'balance_offer' && msg.from_kiosk_id === kioskId) showBalanceOffer(msg);
+      if (msg.type === 'queue_routed' && msg.to_kiosk_id === kioskId) {
+        statusEl.textContent = `Player #${msg.player_id} joined from ${msg.from_kiosk_id} (shorter wait here).`;
+      }
+    };
+    ws.onclose = () => setTimeout(connectHub, 1000 + Math.random() * 2000);
+  }
+  connectHub();
+
+  const liveScoresEl = document.getElementById('liveScores');
+  function renderLiveScores(state){
+    if (!liveScoresEl) return;
+    if (!state) { liveScoresEl.textContent = ''; return; }
+    const rows = [...state.players].sort((a, b) => b.score - a.score);
+    liveScoresEl.textContent = rows.map(p => `${p.username || '#' + p.player_id}: ${p.score}`).join('   ');
+  }
+
+  // Another bay of this game is free sooner: offer to move the player there.
+  function showBalanceOffer(offer){
+    const mins = Math.max(1, Math.round(offer.saves_sec / 60));
+    statusEl.textContent = `Player #${offer.player_id}: ${offer.to_kiosk_id} is free about ${mins} min sooner. `;
+    const btn = document.createElement('button');
+    btn.textContent = `Move to ${offer.to_kiosk_id}`;
+    btn.addEventListener('click', async () => {
+      const resp = await fetch(`/kiosks/${encodeURIComponent(kioskId)}/queue/move`, {
+        method: 'POST',
+        headers: headers(),
+        body: JSON.stringify({ player_id: offer.player_id, to_kiosk_id: offer.to_kiosk_id })
+      });
+      const data = await resp.json().catch(()=>({}));
+      statusEl.textContent = data.ok ? `Moved player #${offer.player_id} to ${offer.to_kiosk_id}.` : ((data && data.detail) || 'Could not move player.');
+      refreshQueue();
+    });
+    statusEl.appendChild(btn);
+  }
 
   let agentWS = null;
   try {
@@ -331,8 +414,17 @@ async function refreshQueue() {
       statusEl.textContent = `Unauthorized kiosk (API key). Check configuration.`;
       return;
     }
+    if (resp.status === 429){
+      statusEl.textContent = `Too many scans. Please wait ${resp.headers.get('Retry-After') || 1}s and try again.`;
+      return;
+    }
+    if (data.debounced) return;
     if (data.known) {
-      statusEl.textContent = `Queued player #${data.player_id}`;
+      statusEl.textContent = data.routed_to
+        ? `Player #${data.player_id}: queued at ${data.routed_to}, it is free sooner.`
+        : data.queued_at
+          ? `Player #${data.player_id} is already queued at ${data.queued_at}.`
+          : `Queued player #${data.player_id}`;
       const p = await fetchPlayer(data.player_id);
       if (p) { showSplash(p); animateCoinForPlayer(p); }
       refreshQueue();
@@ -0,0 +1,40 @@
+"""
+Standalone background job worker (see services/jobs.py).
+
+    python -m server.worker --concurrency 8
+
+Run it next to the web app with JOBS_WORKER=false on the app, or alongside
+the in-app worker for extra capacity. It claims jobs from the same table,
+so any number of workers can share one database. SIGINT/SIGTERM stop it
+after the running jobs finish.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+
+from .database import init_schema
+from .services import jobs
+from .settings import settings
+
+
+async def _main(concurrency: int):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, jobs.worker.stop)
+    await jobs.worker.run(concurrency)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concurrency", type=int, default=settings.jobs_concurrency)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    init_schema()
+    jobs.load_handlers()
+    logging.getLogger("uvicorn.error").info("Job worker %s started (concurrency %s)", jobs.worker.holder, args.concurrency)
+    asyncio.run(_main(args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
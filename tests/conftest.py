@@ -0,0 +1,34 @@
+"""
+Shared setup: point the server at a throwaway SQLite database before any
+server module is imported (settings are read once, at import).
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+project_root = Path(__file__).resolve().parents[1]
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+_tmp = tempfile.mkdtemp(prefix="kiosk-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_tmp}/test.db",
+    "ARCHIVE_DIR": os.path.join(_tmp, "archive"),
+    "SCHEDULER_ENABLED": "false",
+    "JOBS_WORKER": "false",
+    "ADMIN_USER": "admin",
+    "ADMIN_PASSWORD": "changeme",
+    "KIOSK_KEYS": "k1:kk",
+    "GAME_KEYS": "g1:gk",
+})
+os.environ.pop("VENUES", None)
+
+
+@pytest.fixture(scope="session")
+def schema():
+    from server.database import init_schema
+
+    init_schema()
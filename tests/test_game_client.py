@@ -0,0 +1,196 @@
+"""GameClient (game_client/sdk.py) against a local stand-in kiosk server."""
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from game_client import ConfigError, GameClient, ResultSpool, backoff_delay
+
+
+class StandIn:
+    """
+    Records /sessions/end posts and answers with statuses[session_id]
+    (default 200). Each WebSocket connection gets the next script from
+    `scripts` (a list of frames), then is closed unless the script ends in None.
+    """
+
+    def __init__(self):
+        self.statuses = {}
+        self.received = []
+        self.posts = 0
+        self.scripts = []
+        self.connects = []
+        self.pongs = 0
+        app = Starlette(routes=[
+            Route("/sessions/end", self.end, methods=["POST"]),
+            WebSocketRoute("/ws/game/{game_id}", self.ws),
+        ])
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def end(self, request: Request):
+        payload = await request.json()
+        self.posts += 1
+        status = self.statuses.get(payload["session_id"], 200)
+        if status == 200:
+            self.received.append(payload["session_id"])
+        return JSONResponse({"ok": status == 200}, status_code=status)
+
+    async def ws(self, ws: WebSocket):
+        await ws.accept()
+        self.connects.append(dict(ws.query_params))
+        script = self.scripts.pop(0) if self.scripts else [None]
+        for frame in script:
+            if frame is None:
+                try:
+                    while True:
+                        if (await ws.receive_json()).get("type") == "pong":
+                            self.pongs += 1
+                except WebSocketDisconnect:
+                    return
+            await ws.send_json(frame)
+        await ws.close()
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            assert time.monotonic() < deadline, "stand-in server did not start"
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(10)
+
+
+@pytest.fixture
+def standin():
+    with StandIn() as s:
+        yield s
+
+
+@pytest.fixture
+def spool_path(tmp_path):
+    return str(tmp_path / "spool.db")
+
+
+def _client(url, spool_path, **kw):
+    kw = {"backoff_base": 0.01, "backoff_max": 0.05, "flush_interval": 60, **kw}
+    return GameClient(url, "g1", "gk", spool_path=spool_path, **kw)
+
+
+def test_backoff_delay_is_capped_full_jitter():
+    for attempt in range(12):
+        d = backoff_delay(attempt, 0.5, 30.0)
+        assert 0 <= d <= min(30.0, 0.5 * 2 ** attempt)
+
+
+def test_events_reconnect_and_resume_from_last_seq(standin, spool_path):
+    standin.scripts = [
+        [{"type": "hello", "epoch": "e1", "seq": 0}, {"type": "session_started", "session_id": 1, "seq": 1}],
+        # The replay repeats seq 1; the client must skip it and answer the ping.
+        [{"type": "hello", "epoch": "e1", "seq": 1}, {"type": "session_started", "session_id": 1, "seq": 1},
+         {"type": "ping"}, {"type": "session_ended", "session_id": 1, "seq": 2}, None],
+    ]
+
+    async def run():
+        seen = []
+        async with _client(standin.url, spool_path) as client:
+            async for event in client.events():
+                seen.append((event["type"], event["seq"]))
+                if len(seen) == 2:
+                    return seen
+
+    assert asyncio.run(asyncio.wait_for(run(), 10)) == [("session_started", 1), ("session_ended", 2)]
+    assert standin.connects[0] == {"pong": "1"}
+    assert standin.connects[1] == {"pong": "1", "since": "1", "epoch": "e1"}
+    deadline = time.monotonic() + 2
+    while not standin.pongs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert standin.pongs == 1
+
+
+def test_spool_survives_restart_and_flushes_in_order(standin, spool_path):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        down = f"http://127.0.0.1:{s.getsockname()[1]}"  # nothing listens here
+
+    async def offline():
+        async with _client(down, spool_path) as client:
+            assert await client.end_session(11, [{"player_id": 1, "score": 5}]) is False
+            assert await client.end_session(12, [{"player_id": 1, "score": 6}]) is False
+
+    asyncio.run(offline())
+    assert len(ResultSpool(spool_path)) == 2
+
+    async def online():
+        async with _client(standin.url, spool_path) as client:
+            assert await client.flush() == 2
+            assert len(client.spool) == 0
+
+    asyncio.run(online())
+    assert standin.received == [11, 12]
+
+
+def test_failing_result_does_not_block_the_spool(standin, spool_path):
+    standin.statuses = {21: 500, 23: 404}
+
+    async def run():
+        async with _client(standin.url, spool_path, backoff_base=0.2, backoff_max=0.2) as client:
+            assert await client.end_session(21, []) is False
+            await client.end_session(22, [])
+            await client.end_session(23, [])
+            assert standin.received == [22]
+            assert len(client.spool) == 1  # 21 waits for its retry, 23 was dropped
+            standin.statuses = {}
+            await asyncio.sleep(0.3)  # past the per-entry backoff
+            assert await client.flush() == 1
+
+    asyncio.run(run())
+    assert standin.received == [22, 21]
+
+
+def test_server_error_ends_the_flush_pass(standin, spool_path):
+    standin.statuses = {41: 500, 42: 500}
+
+    async def run():
+        async with _client(standin.url, spool_path, backoff_base=0.0) as client:
+            client.spool.append({"session_id": 41, "players": []})
+            client.spool.append({"session_id": 42, "players": []})
+            # Even with no backoff, one flush must not turn into a loop of retries.
+            assert await client.flush() == 0
+            assert standin.posts == 1
+            standin.statuses = {}
+
+    asyncio.run(run())
+
+
+def test_rejected_api_key_raises_and_keeps_results(standin, spool_path):
+    standin.statuses = {31: 401}
+
+    async def run():
+        async with _client(standin.url, spool_path) as client:
+            with pytest.raises(ConfigError):
+                await client.end_session(31, [])
+            assert len(client.spool) == 1
+            standin.statuses = {}
+            assert await client.flush() == 1
+
+    asyncio.run(run())
+    assert standin.received == [31]
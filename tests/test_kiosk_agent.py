@@ -0,0 +1,225 @@
+"""Kiosk agent (kiosk_agent/agent.py) reading a pseudo-terminal as its RFID reader."""
+import asyncio
+import json
+import os
+import pty
+import socket
+
+import httpx
+import pytest
+import websockets
+
+from kiosk_agent.agent import Agent, Debouncer, ScanSpool, load_config, read_uids
+
+
+@pytest.fixture
+def reader():
+    """(master fd, slave path): write to master what the reader would send."""
+    master, slave = pty.openpty()
+    path = os.ttyname(slave)
+    yield master, path
+    for fd in (master, slave):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def _agent(tmp_path, port_path, **server):
+    cfg = load_config(None)
+    cfg["serial"].update(port=port_path, reconnect_delay_sec=0.05)
+    cfg["server"].update(kiosk_id="k1", bulk_batch_size=2, **server)
+    cfg["spool_path"] = str(tmp_path / "scan_spool.jsonl")
+    cfg["dead_letter_path"] = str(tmp_path / "scan_spool.rejected.jsonl")
+    cfg["debounce_window_sec"] = 5.0
+    return Agent(cfg)
+
+
+def _opened(path):
+    n = 0
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            n += os.readlink(f"/proc/self/fd/{fd}") == path
+        except OSError:
+            pass
+    return n
+
+
+async def _reader_opened(path):
+    # open_serial() flushes pending input (tty.setraw uses TCSAFLUSH), so write only once it
+    # has run. It opens and configures the tty without yielding, so seeing the fd is enough.
+    await _wait_for(lambda: _opened(path) >= 2)  # the fixture's slave fd plus the reader's
+
+
+async def _wait_for(cond, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not cond():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_debouncer_window():
+    d = Debouncer(2.0)
+    assert d.accept("A", now=0.0)
+    assert not d.accept("A", now=1.0)
+    assert not d.accept("A", now=2.5)  # each repeat restarts the quiet period
+    assert d.accept("A", now=5.0)
+    assert d.accept("B", now=5.0)
+
+
+def test_read_uids_splits_lines_from_pty(reader):
+    master, path = reader
+
+    async def run():
+        gen = read_uids(path, 9600)
+        first = asyncio.ensure_future(gen.__anext__())
+        await _reader_opened(path)
+        os.write(master, b"04A1\r\n\r\n04B2\n04C")
+        await asyncio.sleep(0.05)
+        os.write(master, b"3\n")
+        uids = [await first, await gen.__anext__(), await gen.__anext__()]
+        await gen.aclose()
+        return uids
+
+    assert asyncio.run(asyncio.wait_for(run(), 5)) == ["04A1", "04B2", "04C3"]
+
+
+def test_reader_loss_raises(reader):
+    master, path = reader
+
+    async def run():
+        gen = read_uids(path, 9600)
+        first = asyncio.ensure_future(gen.__anext__())
+        await _reader_opened(path)
+        os.write(master, b"04A1\n")
+        assert await first == "04A1"
+        os.close(master)
+        with pytest.raises(OSError):
+            await gen.__anext__()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_scans_spool_while_offline_then_replay_in_bulk(tmp_path, reader):
+    master, path = reader
+    posts = []
+
+    def server(request: httpx.Request):
+        if request.url.path == "/kiosks/k1/status":
+            return httpx.Response(200, json={})
+        body = json.loads(request.content)
+        posts.append(body)
+        return httpx.Response(200, json={"ok": True, "queued": len(body["scans"])})
+
+    agent = _agent(tmp_path, path)
+
+    async def run():
+        serial = asyncio.create_task(agent.serial_loop())
+        try:
+            # Nothing is connected and the server hasn't answered a probe yet: everything spools.
+            await _reader_opened(path)
+            os.write(master, b"UID1\nUID1\nUID2\r\nUID3\nUID1\n")
+            await _wait_for(lambda: len(agent.spool.load()) == 3)
+        finally:
+            serial.cancel()
+        async with httpx.AsyncClient(base_url="http://server", transport=httpx.MockTransport(server)) as http:
+            agent._http = http
+            assert await agent.probe() is True
+            assert await agent.flush() == 3
+
+    asyncio.run(run())
+    assert [[s["rfid_uid"] for s in p["scans"]] for p in posts] == [["UID1", "UID2"], ["UID3"]]
+    assert all(p["kiosk_id"] == "k1" and all(s["scanned_at"] for s in p["scans"]) for p in posts)
+    assert agent.spool.load() == []
+
+
+def test_failed_bulk_keeps_undelivered_scans(tmp_path, reader):
+    _, path = reader
+    agent = _agent(tmp_path, path)
+    for uid in ("A", "B", "C"):
+        agent.spool.append({"rfid_uid": uid, "scanned_at": "2026-01-01T00:00:00"})
+    calls = []
+
+    def server(request: httpx.Request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(200, json={"ok": True})
+        return httpx.Response(503, json={"detail": "down"})
+
+    async def run():
+        async with httpx.AsyncClient(base_url="http://server", transport=httpx.MockTransport(server)) as http:
+            agent._http = http
+            return await agent.flush()
+
+    assert asyncio.run(run()) == 2
+    assert [r["rfid_uid"] for r in ScanSpool(agent.cfg["spool_path"]).load()] == ["C"]
+
+
+def _flush_against(agent, statuses):
+    """Flush with the server answering each bulk POST with the next status; returns (sent, posted uids)."""
+    posts = []
+
+    def server(request: httpx.Request):
+        posts.append([s["rfid_uid"] for s in json.loads(request.content)["scans"]])
+        return httpx.Response(statuses[len(posts) - 1], json={})
+
+    async def run():
+        async with httpx.AsyncClient(base_url="http://server", transport=httpx.MockTransport(server)) as http:
+            agent._http = http
+            return await agent.flush()
+
+    return asyncio.run(run()), posts
+
+
+def test_rejected_bulk_is_dead_lettered(tmp_path, reader):
+    _, path = reader
+    agent = _agent(tmp_path, path)
+    for uid in ("A", "B", "C"):
+        agent.spool.append({"rfid_uid": uid, "scanned_at": "2026-01-01T00:00:00"})
+
+    assert _flush_against(agent, [422, 200]) == (1, [["A", "B"], ["C"]])
+    assert agent.spool.load() == []
+    assert [(r["rfid_uid"], r["rejected"]) for r in agent.dead_letter.load()] == [("A", 422), ("B", 422)]
+
+
+def test_unauthorized_bulk_keeps_scans(tmp_path, reader):
+    _, path = reader
+    agent = _agent(tmp_path, path)
+    agent.spool.append({"rfid_uid": "A", "scanned_at": "2026-01-01T00:00:00"})
+
+    assert _flush_against(agent, [401]) == (0, [["A"]])
+    assert [r["rfid_uid"] for r in agent.spool.load()] == ["A"]
+    assert agent.dead_letter.load() == []
+
+
+def test_bulk_batch_size_is_bounded_by_server_limit(tmp_path):
+    config = tmp_path / "config.yaml"
+    config.write_text("server:\n  bulk_batch_size: 1000\n")
+    with pytest.raises(ValueError):
+        load_config(str(config))
+
+
+def test_online_scans_go_to_browser(tmp_path, reader):
+    master, path = reader
+    agent = _agent(tmp_path, path)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    async def run():
+        async with websockets.serve(agent.local_client, "127.0.0.1", port):
+            async with websockets.connect(f"ws://127.0.0.1:{port}") as browser:
+                await _wait_for(lambda: agent.clients)
+                agent.server_ok = True
+                serial = asyncio.create_task(agent.serial_loop())
+                try:
+                    await _reader_opened(path)
+                    os.write(master, b"UID9\nUID9\nUID8\n")
+                    got = [await browser.recv(), await browser.recv()]
+                finally:
+                    serial.cancel()
+        return got
+
+    assert asyncio.run(asyncio.wait_for(run(), 5)) == ["UID9", "UID8"]
+    assert agent.spool.load() == []
@@ -0,0 +1,44 @@
+"""RFID scan path: queueing and balancing between bays of one game."""
+from fastapi.testclient import TestClient
+
+from server import models
+from server.app import app
+from server.database import SessionLocal
+from server.services.balancer import balancer
+from server.settings import settings
+
+KEY = {"X-API-Key": "kk"}
+
+
+def _bays():
+    """Game with bays k1 (one player waiting) and k2 (idle); returns (k1 pk, k2 pk, tag uid)."""
+    with SessionLocal() as db:
+        game = models.Game(game_id="bays", name="Bays", session_capacity=1)
+        db.add(game)
+        db.flush()
+        a, b = models.Kiosk(kiosk_id="k1", game_id=game.id), models.Kiosk(kiosk_id="k2", game_id=game.id)
+        waiting, player = models.Player(username="waiting"), models.Player(username="rescanner")
+        db.add_all([a, b, waiting, player])
+        db.flush()
+        db.add_all([models.RFIDTag(uid="TAG-R", player_id=player.id), models.QueueEntry(kiosk_id=a.id, player_id=waiting.id)])
+        db.commit()
+        return a.id, b.id, "TAG-R"
+
+
+def test_rescan_after_routing_keeps_one_place(schema, monkeypatch):
+    monkeypatch.setattr(settings, "balance_mode", "route")
+    monkeypatch.setattr(settings, "scan_debounce_sec", 0.0)
+    a_pk, b_pk, uid = _bays()
+    balancer.sync()
+    client = TestClient(app)
+
+    first = client.post("/rfid/scan", json={"kiosk_id": "k1", "rfid_uid": uid}, headers=KEY).json()
+    assert first["routed_to"] == "k2"
+    # B now has the player waiting, so the balancer no longer prefers it.
+    again = client.post("/rfid/scan", json={"kiosk_id": "k1", "rfid_uid": uid}, headers=KEY).json()
+    assert again.get("debounced") is None
+    assert again["queued_at"] == "k2"
+
+    with SessionLocal() as db:
+        entries = db.query(models.QueueEntry.kiosk_id).filter_by(player_id=first["player_id"]).all()
+    assert entries == [(b_pk,)]
@@ -0,0 +1,126 @@
+"""Webhook delivery against the local stand-in receiver (scripts/webhook_receiver.py)."""
+import argparse
+import asyncio
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from scripts.webhook_receiver import make_handler
+from server.database import SessionLocal
+from server.services import outbox, webhooks
+from server.settings import settings
+
+
+@pytest.fixture
+def receiver():
+    """Start a stand-in receiver; yields (url, args) and args can be changed between rounds."""
+    args = argparse.Namespace(fail_first=0, fail_rate=0.0, delay_ms=0, quiet=True)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/hook", args
+    server.shutdown()
+    server.server_close()
+
+
+def _counts(url):
+    with urllib.request.urlopen(url) as resp:
+        return json.loads(resp.read())
+
+
+def _emit(n, topic="test.event"):
+    with SessionLocal() as db:
+        outbox.emit_many(db, [(topic, {"n": i}) for i in range(n)])
+        db.commit()
+
+
+@pytest.fixture
+def endpoint(schema, monkeypatch):
+    """A fresh endpoint whose cursor starts at the current end of the outbox."""
+    monkeypatch.setattr(settings, "webhook_batch_size", 3)
+    monkeypatch.setattr(settings, "webhook_concurrency", 2)
+    name = f"pos{endpoint.counter}"
+    endpoint.counter += 1
+    webhooks.dispatcher.set_cursor(name, outbox.latest_id())
+    return name
+
+
+endpoint.counter = 0
+
+
+def test_delivers_signed_batches_and_advances_cursor(receiver, endpoint):
+    url, _ = receiver
+    start = outbox.latest_id()
+    _emit(7)
+
+    # Two batches of 3 per round (batch size x concurrency), then the last event.
+    assert asyncio.run(webhooks.dispatcher.deliver(endpoint, url)) is True
+    assert webhooks._load(endpoint)[0] == start + 6
+    assert asyncio.run(webhooks.dispatcher.deliver(endpoint, url)) is False
+    cursor, stats = webhooks._load(endpoint)
+    assert cursor == start + 7
+    assert stats["delivered"] == 7
+
+    counts = _counts(url)
+    assert counts["requests"] == 3
+    assert counts["events"] == 7
+    assert counts["bad_signature"] == 0 and counts["duplicates"] == 0
+    assert asyncio.run(webhooks.dispatcher.deliver(endpoint, url)) is False
+
+
+def test_receiver_rejects_bad_signature(receiver):
+    url, _ = receiver
+    body = json.dumps({"endpoint": "x", "events": []}).encode()
+    req = urllib.request.Request(url, data=body, method="POST", headers={"X-Outbox-Signature": "sha256=00"})
+    with pytest.raises(urllib.error.HTTPError) as exc:
+        urllib.request.urlopen(req)
+    assert exc.value.code == 401
+    assert webhooks.sign(body).startswith("sha256=")
+    assert _counts(url)["bad_signature"] == 1
+
+
+def test_retries_with_backoff_after_503(receiver, endpoint):
+    url, args = receiver
+    start = outbox.latest_id()
+    _emit(6)
+
+    # Every batch of the round fails (they are sent in parallel): the cursor stays.
+    args.fail_rate = 1.0
+    asyncio.run(webhooks.dispatcher.deliver(endpoint, url))
+    cursor, stats = webhooks._load(endpoint)
+    assert cursor == start
+    assert stats["consecutive_failures"] == 1 and stats["last_status"] == 503
+    first_delay = webhooks.dispatcher._retry_at[endpoint]
+
+    # A second failure doubles the delay (1s -> 2s, with +-20% jitter).
+    asyncio.run(webhooks.dispatcher.deliver(endpoint, url))
+    _, stats = webhooks._load(endpoint)
+    assert stats["consecutive_failures"] == 2 and stats["failures"] == 2
+    assert webhooks.dispatcher._retry_at[endpoint] - first_delay > 0.5
+
+    # Once the receiver recovers, delivery resumes from the first unacknowledged event.
+    args.fail_rate = 0.0
+    asyncio.run(webhooks.dispatcher.deliver(endpoint, url))
+    cursor, stats = webhooks._load(endpoint)
+    assert cursor == start + 6
+    assert stats["consecutive_failures"] == 0
+    assert endpoint not in webhooks.dispatcher._retry_at
+    counts = _counts(url)
+    assert counts["events"] == 6 and counts["failed"] == 4
+
+
+def test_cursor_moves_only_after_ack(receiver, endpoint, monkeypatch):
+    url, args = receiver
+    monkeypatch.setattr(settings, "webhook_concurrency", 1)
+    start = outbox.latest_id()
+    _emit(3)
+    args.fail_first = 1
+    asyncio.run(webhooks.dispatcher.deliver(endpoint, url))
+    assert webhooks._load(endpoint)[0] == start
+    webhooks.dispatcher._retry_at.pop(endpoint)
+    asyncio.run(webhooks.dispatcher.deliver(endpoint, url))
+    assert webhooks._load(endpoint)[0] == start + 3